@@ -3,7 +3,13 @@ from anomaly_detector.adapters.base_model_adapter import BaseModelAdapter
 from anomaly_detector.adapters.base_storage_adapter import BaseStorageAdapter
 from anomaly_detector.adapters.feedback_strategy import FeedbackStrategy
 from anomaly_detector.adapters.som_storage_adapter import SomStorageAdapter
+from anomaly_detector.adapters.encoded_log_model_adapter import EncodedLogModelAdapter
 from anomaly_detector.adapters.som_model_adapter import SomModelAdapter
+from anomaly_detector.adapters.model_registry import ModelRegistry
+from anomaly_detector.adapters.isolation_forest_model_adapter import IsolationForestModelAdapter
+from anomaly_detector.adapters.knn_model_adapter import KNNModelAdapter
 
 
-__all__ = ['BaseModelAdapter', 'BaseStorageAdapter', 'FeedbackStrategy', 'SomStorageAdapter', 'SomModelAdapter']
+__all__ = ['BaseModelAdapter', 'BaseStorageAdapter', 'FeedbackStrategy', 'SomStorageAdapter',
+           'EncodedLogModelAdapter', 'SomModelAdapter', 'ModelRegistry', 'IsolationForestModelAdapter',
+           'KNNModelAdapter']
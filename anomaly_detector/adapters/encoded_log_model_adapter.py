@@ -0,0 +1,294 @@
+"""Encoded Log Model Adapter - Shared logic of the models that score logs encoded into vectors."""
+import hashlib
+import logging
+import uuid
+import numpy as np
+from anomaly_detector.adapters.base_model_adapter import BaseModelAdapter
+from anomaly_detector.decorator.utils import latency_logger
+from anomaly_detector.exception import ModelLoadException, ModelSaveException
+from anomaly_detector.model import W2VModel, HashingEncoderModel
+from anomaly_detector.model.quantile_sketch import TDigest
+from anomaly_detector.model.score_cache import ScoreCache
+import os
+import pandas
+from prometheus_client import Gauge, Counter, Histogram
+from urllib.parse import quote
+
+ANOMALY_COUNT = Gauge("aiops_lad_anomaly_count", "count of anomalies runs", ['anomaly_status'])
+ANOMALY_SCORE = Gauge("aiops_lad_anomaly_avg_score", "avg anomaly score")
+LOG_LINES_COUNT = Gauge("aiops_lad_loglines_count", "count of log lines processed runs")
+FALSE_POSITIVE_COUNT = Counter("aiops_lad_false_positive_count", "count of false positives processed runs", ['id'])
+ANOMALY_HIST = Histogram("aiops_hist", "histogram of anomalies runs")
+THRESHOLD = Gauge("aiops_lad_threshold", "Threshold of marker for anomaly")
+BATCH_ROWS = Gauge("aiops_lad_batch_rows", "count of log lines scored")
+BATCH_UNIQUE_ROWS = Gauge("aiops_lad_batch_unique_rows", "count of distinct log lines scored")
+BATCH_COMPRESSION_RATIO = Gauge("aiops_lad_batch_compression_ratio", "log lines per distinct log line")
+
+
+class EncodedLogModelAdapter(BaseModelAdapter):
+    """Log encoding, storage, thresholds, score cache and deduplicated scoring shared by the model adapters.
+
+    Subclasses build their model in create_model and train it. The jobs load and save every model through
+    load_som_model and save_som_model. Warm start and online updates are only supported where overridden.
+    """
+
+    def __init__(self, storage_adapter):
+        """Init storage provider which provides config and storage interface with storage systems."""
+        self.storage_adapter = storage_adapter
+        update_model = self.storage_adapter.TRAIN_UPDATE_MODEL
+        self.update_model = os.path.isfile(self.storage_adapter.MODEL_PATH) and update_model
+        self.update_w2v_model = os.path.isfile(self.storage_adapter.W2V_MODEL_PATH) and update_model
+        self.recreate_models = False
+        self.model = self.create_model()
+        if self.storage_adapter.LOG_ENCODER not in self._encoder_choices:
+            raise ValueError("Invalid Value for Param: {0}".format(self.storage_adapter.LOG_ENCODER))
+        self.w2v_model = self._encoder_choices[self.storage_adapter.LOG_ENCODER](config=storage_adapter.config)
+        self.last_inference = None
+        self.score_cache = None
+        self.threshold_digest = None
+
+    def create_model(self):
+        """Model scoring the encoded logs."""
+        raise NotImplementedError("Please implement the <create_model method>")
+
+    def load_w2v_model(self):
+        """Load in w2v model."""
+        try:
+            self.w2v_model.load(self.storage_adapter.W2V_MODEL_PATH)
+        except ModelLoadException as ex:
+            logging.error("Failed to load W2V model: %s" % ex)
+            raise
+        self.invalidate_scores()
+
+    def load_som_model(self):
+        """Load in the model saved at MODEL_PATH."""
+        try:
+            self.model.load(self.storage_adapter.MODEL_PATH)
+        except ModelLoadException as ex:
+            logging.error("Failed to load model: %s" % ex)
+            raise
+        self.invalidate_scores()
+        self.load_threshold_digest()
+
+    def load_threshold_digest(self):
+        """Restore the digest of anomaly scores saved with the model when thresholds come from quantiles."""
+        self.threshold_digest = None
+        meta_data = self.model.get_metadata()
+        if self.storage_adapter.INFER_THRESHOLD_MODE != "quantile":
+            return
+        if meta_data is not None and len(meta_data) > 5:
+            self.threshold_digest = TDigest.from_dict(meta_data[5])
+        else:
+            logging.warning("Model was saved without a score digest, using the standard deviation threshold")
+
+    def invalidate_scores(self):
+        """Drop cached scores when the models they were computed with changed."""
+        if self.score_cache is not None:
+            self.score_cache.set_version(self.model_version())
+
+    def get_score_cache(self):
+        """Score cache of the current models, opened on first use and again after close, None when disabled."""
+        if self.score_cache is None and self.storage_adapter.INFER_SCORE_CACHE_SIZE > 0:
+            self.score_cache = ScoreCache(self.storage_adapter.INFER_SCORE_CACHE_SIZE,
+                                          self.storage_adapter.INFER_SCORE_CACHE_PATH)
+            self.score_cache.set_version(self.model_version())
+        return self.score_cache
+
+    def model_version(self):
+        """Fingerprint of the model state, its distance statistics and the log encoder."""
+        digest = hashlib.sha1()
+        if self.model.get() is not None:
+            digest.update(self.model_state())
+            digest.update(np.asarray(self.model.get_metadata()[:5], dtype=np.float64).tobytes())
+        if self.w2v_model.get() is not None:
+            digest.update(self.w2v_model.state())
+        return digest.hexdigest()
+
+    def model_state(self):
+        """Bytes identifying the trained model, hashed into the model version."""
+        return self.model.state()
+
+    def get_anomaly_score(self, vectors):
+        """Anomaly score of every vector, computed by PARALLELISM workers."""
+        return self.model.get_anomaly_score(vectors, self.storage_adapter.PARALLELISM)
+
+    def close(self):
+        """Close the score cache and forget the last inference, the cache is reopened if the adapter is reused.
+
+        The models and their score digest stay loaded.
+        """
+        if self.score_cache is not None:
+            self.score_cache.close()
+        self.last_inference = None
+        self.score_cache = None
+
+    def load_for_warm_start(self, node_map):
+        """Models are trained from scratch unless a subclass supports warm start."""
+        logging.info("%s does not support warm start, training a new model" % type(self.model).__name__)
+        return False
+
+    def _finish_training(self, vectors):
+        """Store the training distance statistics and epochs and save the model.
+
+        The statistics come from a t-digest of the distances the trainer found in its last assignment of the
+        vectors. Only vectors the trainer did not assign, or all of them if it reports no distances, are scored.
+        """
+        dist = self.model.train_dist
+        self.model.train_dist = None
+        if dist is None:
+            dist = self.get_anomaly_score(vectors)
+        elif np.isnan(dist).any():
+            missing = np.isnan(dist)
+            dist[missing] = self.get_anomaly_score(vectors[missing])
+        digest = TDigest(self.storage_adapter.INFER_THRESHOLD_COMPRESSION)
+        digest.update(dist)
+        max_dist = digest.max
+        digest.scale(1 / max_dist)
+        self.model.set_metadata((digest.mean, digest.std, max_dist, digest.min, self.model.epochs))
+        self.threshold_digest = None
+        if self.storage_adapter.INFER_THRESHOLD_MODE == "quantile":
+            self.threshold_digest = digest
+        self.invalidate_scores()
+        self.save_som_model()
+        return dist / max_dist
+
+    def save_som_model(self):
+        """Save the model, with the digest of anomaly scores in its metadata."""
+        if self.threshold_digest is not None:
+            self.model.set_metadata(self.model.get_metadata()[:5] + (self.threshold_digest.to_dict(),))
+        try:
+            self.model.save(self.storage_adapter.MODEL_PATH)
+        except ModelSaveException as ex:
+            logging.error("Failed to save model: %s" % ex)
+            raise
+
+    def update_online(self, threshold, infer_loop):
+        """Models do not learn from inference unless a subclass supports it, logs are learned by the next training."""
+        self.last_inference = None
+        return 0
+
+    @latency_logger(name="EncodedLogModelAdapter")
+    def preprocess(self, config_type, recreate_model):
+        """Load data and train."""
+        dataframe, raw_data = self.storage_adapter.load_data(config_type)
+        if dataframe is not None:
+            LOG_LINES_COUNT.set(len(dataframe))
+            if config_type != "infer" or not self.storage_adapter.INFER_FREEZE_ENCODER:
+                self.train_w2v_model(dataframe, recreate_model)
+
+        return dataframe, raw_data
+
+    def train_w2v_model(self, dataframe, recreate_model):
+        """Add the words of new logs to the w2v model, or create it from them, and save it."""
+        if not recreate_model:
+            self.w2v_model.update(dataframe)
+        else:
+            self.w2v_model.create(dataframe,
+                                  self.storage_adapter.TRAIN_VECTOR_LENGTH,
+                                  self.storage_adapter.TRAIN_WINDOW)
+        self.save_w2v_model()
+
+    def save_w2v_model(self):
+        """Save w2v model, readers of the saved model never see it partly written."""
+        try:
+            self.w2v_model.save(self.storage_adapter.W2V_MODEL_PATH)
+        except ModelSaveException as ex:
+            logging.error("Failed to save W2V model: %s" % ex)
+            raise
+
+    @latency_logger(name="EncodedLogModelAdapter")
+    def predict(self, data, json_logs, threshold):
+        """Prediction from data provided and if it hits threshold it flags it an anomaly."""
+        feedback_strategy = self.storage_adapter.feedback_strategy
+        inference_batch_id = str(uuid.uuid4())
+        false_positives = None
+        if feedback_strategy is not None:
+            false_positives = feedback_strategy.execute()
+        logging.info("False Positive: {} ".format(false_positives))
+        dist = self.process_anomaly_score(data)
+        if self.threshold_digest is not None:
+            self.threshold_digest.update(dist)
+        f = []
+        hist_count = 0
+        logging.info("Max anomaly score: %f" % max(dist))
+        ANOMALY_COUNT._metrics.clear()
+
+        last_id = dict()
+        for i in range(len(data)):
+            s = json_logs[i]
+            s["predict_id"] = str(uuid.uuid4())
+            s["anomaly_score"] = dist[i]
+            s["elast_alert"] = self.storage_adapter.ES_ELAST_ALERT
+            s["inference_batch_id"] = inference_batch_id
+            s["predictor_namespace"] = self.storage_adapter.OS_NAMESPACE
+            s["e_message"] = quote(s["message"])
+            # Record anomaly event in fact_store
+            if dist[i] > threshold:
+                if false_positives is not None:
+                    if s["message"] in feedback_strategy.uniq_items:
+                        # logging.info("False positive was found (score: %f): %s" % (dist[i], s["message"]))
+                        FALSE_POSITIVE_COUNT.labels(id=s["predict_id"]).inc()
+                        continue
+                hist_count += 1
+                s["anomaly"] = 1
+                logging.warning("Anomaly found (score: %f): %s" % (dist[i], s["message"]))
+                last_id[quote(s["message"])] = s["predict_id"]
+                ANOMALY_SCORE.set(dist[i])
+            else:
+                s["anomaly"] = 0
+            ANOMALY_COUNT.labels(anomaly_status=s["anomaly"]).inc()
+            ANOMALY_HIST.observe(hist_count)
+            f.append(s)
+        return f
+
+    @latency_logger(name="EncodedLogModelAdapter")
+    def process_anomaly_score(self, data):
+        """Generate scores from some. To be used for inference."""
+        meta_data = self.model.get_metadata()
+        max_dist = meta_data[2]
+        # Every distinct log is encoded and scored once, codes maps the scores back to all rows
+        codes, keys = pandas.factorize(np.array(self.score_keys(data), dtype=object))
+        _, first = np.unique(codes, return_index=True)
+        BATCH_ROWS.set(len(codes))
+        BATCH_UNIQUE_ROWS.set(len(keys))
+        BATCH_COMPRESSION_RATIO.set(len(codes) / max(len(keys), 1))
+
+        score_cache = self.get_score_cache()
+        if score_cache is None:
+            v = self.w2v_model.one_vector(data.iloc[first])
+            dist = self.get_anomaly_score(v)
+            dist = dist / max_dist
+            self.last_inference = (v[codes], dist[codes])
+            return dist[codes]
+
+        # Only the logs missing in the cache are encoded and scored, and only those are learned from online
+        dist, missing = score_cache.get(list(keys))
+        self.last_inference = None
+        if len(missing):
+            v = self.w2v_model.one_vector(data.iloc[first[missing]])
+            dist[missing] = self.get_anomaly_score(v) / max_dist
+            score_cache.put(keys[missing], dist[missing])
+            self.last_inference = (v, dist[missing])
+        return dist[codes]
+
+    def score_keys(self, data):
+        """Cache key of every log, the values of all columns encoded by the W2V model."""
+        columns = [data[col] for col in self.w2v_model.get().keys() if col in data]
+        return ["\x1f".join(values) for values in zip(*columns)]
+
+    def set_threshold(self):
+        """Setting threshold for prediction."""
+        meta_data = self.model.get_metadata()
+        stdd = meta_data[1]
+        mean = meta_data[0]
+        if self.threshold_digest is not None:
+            threshold = self.threshold_digest.quantile(self.storage_adapter.INFER_THRESHOLD_QUANTILE)
+        else:
+            threshold = self.storage_adapter.INFER_ANOMALY_THRESHOLD * stdd + mean
+        THRESHOLD.set(threshold)
+        logging.info("threshold for anomaly is of %f" % threshold)
+        logging.info("Models loaded, running %d infer loops" % self.storage_adapter.INFER_LOOPS)
+        return mean, threshold
+
+    # Log encoders selectable with LOG_ENCODER, named as in LogEncoderCatalog
+    _encoder_choices = {'w2v_encoder': W2VModel, 'hashing_encoder': HashingEncoderModel}
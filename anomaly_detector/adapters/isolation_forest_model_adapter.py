@@ -0,0 +1,24 @@
+"""Isolation Forest Model Adapter - Isolation forest in place of the SOM on the same W2V encoded logs."""
+from anomaly_detector.adapters.encoded_log_model_adapter import EncodedLogModelAdapter
+from anomaly_detector.decorator.utils import latency_logger
+from anomaly_detector.model.isolation_forest_model import IsolationForestModel
+
+
+class IsolationForestModelAdapter(EncodedLogModelAdapter):
+    """Isolation forest custom logic to train model and predict anomalies in logs.
+
+    The W2V encoding, storage, thresholds, score cache and deduplicated scoring are shared with the SOM, the
+    forest takes the place of the map. Forests are always fit from scratch, warm start and online updates are
+    not supported.
+    """
+
+    def create_model(self):
+        """Isolation forest scoring the encoded logs."""
+        return IsolationForestModel(config=self.storage_adapter.config)
+
+    @latency_logger(name="IsolationForestModelAdapter")
+    def train(self, node_map, data, recreate_model=True):
+        """Fit a new isolation forest to the vectors the w2v model creates from words, node_map is not used."""
+        vectors = self.w2v_model.one_vector(data)
+        self.model.train(vectors, self.storage_adapter.PARALLELISM)
+        return self._finish_training(vectors)
@@ -0,0 +1,24 @@
+"""kNN Model Adapter - k nearest neighbour search over an IVF index of the W2V encoded training logs."""
+from anomaly_detector.adapters.encoded_log_model_adapter import EncodedLogModelAdapter
+from anomaly_detector.decorator.utils import latency_logger
+from anomaly_detector.model.ivf_knn_model import IVFKNNModel
+
+
+class KNNModelAdapter(EncodedLogModelAdapter):
+    """kNN custom logic to train model and predict anomalies in logs.
+
+    Logs are scored against the training logs themselves instead of the SOM prototypes. The W2V encoding,
+    storage, thresholds, score cache and deduplicated scoring are shared with the SOM. Indexes are always
+    rebuilt from scratch, warm start and online updates are not supported.
+    """
+
+    def create_model(self):
+        """IVF index of the encoded training logs."""
+        return IVFKNNModel(config=self.storage_adapter.config)
+
+    @latency_logger(name="KNNModelAdapter")
+    def train(self, node_map, data, recreate_model=True):
+        """Index the vectors the w2v model creates from words, node_map is not used."""
+        vectors = self.w2v_model.one_vector(data)
+        self.model.train(vectors, self.storage_adapter.PARALLELISM)
+        return self._finish_training(vectors)
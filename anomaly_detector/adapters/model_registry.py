@@ -0,0 +1,213 @@
+"""Model Registry - One SOM and W2V model pair per tenant, such as a namespace or service, in one process."""
+import copy
+import logging
+import os
+from collections import OrderedDict
+from urllib.parse import quote
+
+import numpy as np
+from prometheus_client import Gauge
+
+from anomaly_detector.adapters.base_model_adapter import BaseModelAdapter
+from anomaly_detector.adapters.som_model_adapter import SomModelAdapter
+
+REGISTRY_MODELS = Gauge("aiops_lad_registry_models", "count of tenant models loaded in memory")
+REGISTRY_BYTES = Gauge("aiops_lad_registry_bytes", "bytes of tenant model arrays in memory")
+
+
+class ModelRegistry(BaseModelAdapter):
+    """Route every log to the SomModelAdapter of its tenant, the value of the MODEL_REGISTRY_KEY field.
+
+    Tenant models live in their own directory next to MODEL_PATH and are loaded on first use. Once the arrays
+    of the loaded models exceed MODEL_REGISTRY_MAX_BYTES the least recently used ones are dropped. Every
+    tenant has its own threshold, so the threshold handed to predict is not used. It is set once a tenant
+    model is loaded or trained and again only when the score digest of the tenant learned new scores.
+    Tenants are scored in process, SOM_SHARED_SCORING_POOL would start a pool of workers per tenant.
+    """
+
+    def __init__(self, storage_adapter):
+        """Init storage provider shared by all tenants, which provides config and storage interface."""
+        self.storage_adapter = storage_adapter
+        if storage_adapter.SOM_SHARED_SCORING_POOL:
+            logging.warning("SOM_SHARED_SCORING_POOL is not used with MODEL_REGISTRY_KEY, tenants score in process")
+        self.adapters = OrderedDict()
+        self.routes = OrderedDict()
+        self.thresholds = {}
+        # Tenants whose model learned from online updates since it was last saved
+        self.updated = set()
+
+    def tenant_of(self, log):
+        """Tenant of a raw log, the MODEL_REGISTRY_KEY field where dots walk into nested fields."""
+        value = log
+        for field in self.storage_adapter.MODEL_REGISTRY_KEY.split("."):
+            if not isinstance(value, dict) or field not in value:
+                return self.storage_adapter.MODEL_REGISTRY_DEFAULT_TENANT
+            value = value[field]
+        return str(value)
+
+    def route(self, raw_data):
+        """Group the row numbers of a batch of raw logs by tenant."""
+        routes = OrderedDict()
+        for i, log in enumerate(raw_data):
+            routes.setdefault(self.tenant_of(log), []).append(i)
+        return OrderedDict((tenant, np.array(rows)) for tenant, rows in routes.items())
+
+    def get(self, tenant):
+        """Model adapter of a tenant, loading its saved models on first use."""
+        if tenant in self.adapters:
+            self.adapters.move_to_end(tenant)
+            return self.adapters[tenant]
+
+        adapter = SomModelAdapter(self._tenant_storage_adapter(tenant))
+        if os.path.exists(adapter.storage_adapter.MODEL_PATH) and os.path.exists(
+                adapter.storage_adapter.W2V_MODEL_PATH):
+            logging.info("Loading models of tenant %s" % tenant)
+            adapter.load_w2v_model()
+            adapter.load_som_model()
+        self.thresholds.pop(tenant, None)
+        self.adapters[tenant] = adapter
+        self._evict()
+        return adapter
+
+    def _tenant_storage_adapter(self, tenant):
+        """Storage adapter sharing the storage backend, with model paths in a directory of the tenant."""
+        config = copy.copy(self.storage_adapter.config)
+        config.SOM_SHARED_SCORING_POOL = False
+        directory = os.path.join(os.path.dirname(config.MODEL_PATH), quote(tenant, safe=""))
+        os.makedirs(directory, exist_ok=True)
+        config.MODEL_PATH = os.path.join(directory, os.path.basename(config.MODEL_PATH))
+        config.W2V_MODEL_PATH = os.path.join(directory, os.path.basename(config.W2V_MODEL_PATH))
+        if config.INFER_SCORE_CACHE_PATH:
+            config.INFER_SCORE_CACHE_PATH = "%s.%s" % (config.INFER_SCORE_CACHE_PATH, quote(tenant, safe=""))
+        if config.SOM_UMATRIX_DIR:
+            config.SOM_UMATRIX_DIR = os.path.join(config.SOM_UMATRIX_DIR, quote(tenant, safe=""))
+            os.makedirs(config.SOM_UMATRIX_DIR, exist_ok=True)
+        # Storage adapters pass unknown attributes through to their config, so copy.copy can not be used
+        storage_adapter = object.__new__(type(self.storage_adapter))
+        storage_adapter.__dict__.update(self.storage_adapter.__dict__, config=config)
+        return storage_adapter
+
+    def _evict(self):
+        """Drop least recently used tenant models until the loaded arrays fit in MODEL_REGISTRY_MAX_BYTES."""
+        sizes = [self._model_bytes(adapter) for adapter in self.adapters.values()]
+        total = sum(sizes)
+        for (tenant, adapter), size in list(zip(self.adapters.items(), sizes))[:-1]:
+            if total <= self.storage_adapter.MODEL_REGISTRY_MAX_BYTES:
+                break
+            logging.info("Evicting models of tenant %s" % tenant)
+            if self._learned(tenant, adapter):
+                # Keep what the model learned since it was loaded
+                adapter.save_som_model()
+            self.updated.discard(tenant)
+            adapter.close()
+            del self.adapters[tenant]
+            total -= size
+        REGISTRY_MODELS.set(len(self.adapters))
+        REGISTRY_BYTES.set(total)
+
+    def _learned(self, tenant, adapter):
+        """Whether a tenant model learned from inference since it was loaded or saved."""
+        return adapter.model.get() is not None and (adapter.threshold_digest is not None or tenant in self.updated)
+
+    @property
+    def threshold_digest(self):
+        """Score digest of a loaded tenant, jobs save the registry at their end when there is one."""
+        return next((adapter.threshold_digest for adapter in self.adapters.values()
+                     if adapter.threshold_digest is not None), None)
+
+    @staticmethod
+    def _model_bytes(adapter):
+        """Bytes of the SOM codebook and W2V arrays of a model adapter."""
+        size = adapter.w2v_model.nbytes()
+        if adapter.model.get() is not None:
+            size += adapter.model.get().nbytes
+        return size
+
+    def preprocess(self, config_type, recreate_model):
+        """Load data and update the w2v model of every tenant in it."""
+        dataframe, raw_data = self.storage_adapter.load_data(config_type)
+        self.routes = OrderedDict()
+        if dataframe is None:
+            return dataframe, raw_data
+        self.routes = self.route(raw_data)
+        for tenant, rows in self.routes.items():
+            adapter = self.get(tenant)
+            if config_type == "infer" and (adapter.model.get() is None or
+                                           self.storage_adapter.INFER_FREEZE_ENCODER):
+                continue
+            adapter.train_w2v_model(self._rows(dataframe, rows), recreate_model or adapter.w2v_model.get() is None)
+        return dataframe, raw_data
+
+    def train(self, node_map, data, recreate_model=True):
+        """Train the som model of every tenant on its logs, returns the distances of all logs."""
+        dist = np.zeros(len(data))
+        for tenant, rows in self.routes.items():
+            adapter = self.get(tenant)
+            dist[rows] = adapter.train(node_map=node_map, data=self._rows(data, rows),
+                                       recreate_model=recreate_model or adapter.model.get() is None)
+            self.thresholds.pop(tenant, None)
+        return dist
+
+    def predict(self, data, json_logs, threshold):
+        """Prediction of every log with the model and threshold of its tenant."""
+        results = []
+        for tenant, rows in self.routes.items():
+            adapter = self.get(tenant)
+            if adapter.model.get() is None:
+                logging.warning("No model trained for tenant %s, skipping %d logs" % (tenant, len(rows)))
+                continue
+            results.extend(adapter.predict(self._rows(data, rows), [json_logs[i] for i in rows],
+                                           self.threshold(tenant)))
+            if adapter.threshold_digest is not None:
+                # The digest learned the scores of this batch, the threshold follows it
+                self.thresholds.pop(tenant, None)
+        return results
+
+    def update_online(self, threshold, infer_loop):
+        """Let the som model of every tenant of the last batch learn from its logs below its threshold."""
+        updates = 0
+        for tenant in self.routes:
+            adapter = self.get(tenant)
+            if adapter.model.get() is not None:
+                tenant_updates = adapter.update_online(self.threshold(tenant), infer_loop)
+                if tenant_updates:
+                    self.updated.add(tenant)
+                updates += tenant_updates
+        return updates
+
+    def threshold(self, tenant):
+        """Threshold of a tenant with a trained model, only set again after its model or score digest changed."""
+        if tenant not in self.thresholds:
+            self.thresholds[tenant] = self.get(tenant).set_threshold()[1]
+        return self.thresholds[tenant]
+
+    def load_w2v_model(self):
+        """Tenant models are loaded on first use."""
+
+    def load_som_model(self):
+        """Tenant models are loaded on first use."""
+
+    def load_for_warm_start(self, node_map):
+        """Tenant models are always retrained from scratch."""
+        return False
+
+    def set_threshold(self):
+        """Thresholds are set per tenant when predicting."""
+        return None, None
+
+    def save_som_model(self):
+        """Save the som model of every loaded tenant that learned from inference, with its score digest."""
+        for tenant, adapter in self.adapters.items():
+            if self._learned(tenant, adapter):
+                adapter.save_som_model()
+        self.updated.clear()
+
+    def close(self):
+        """Release the resources of every loaded tenant."""
+        for adapter in self.adapters.values():
+            adapter.close()
+
+    @staticmethod
+    def _rows(data, rows):
+        """Rows of a dataframe renumbered from 0."""
+        return data.iloc[rows].reset_index(drop=True)
@@ -1,51 +1,72 @@
 """Som Model Adapter - Working with custom implementation of SOM."""
 import logging
-import uuid
 import numpy as np
-from anomaly_detector.adapters import BaseModelAdapter
+from anomaly_detector.adapters.encoded_log_model_adapter import EncodedLogModelAdapter
 from anomaly_detector.decorator.utils import latency_logger
-from anomaly_detector.exception import ModelLoadException, ModelSaveException
-from anomaly_detector.model import SOMPYModel, W2VModel
+from anomaly_detector.exception import ModelLoadException
+from anomaly_detector.model import SOMModel, SOMPYModel
+from anomaly_detector.model.scoring_pool import SharedMemoryScoringPool, shared_memory
+from anomaly_detector.model.umatrix import UMatrixRenderer
 import os
-from prometheus_client import Gauge, Counter, Histogram
-from urllib.parse import quote
+from prometheus_client import Counter
 
-ANOMALY_COUNT = Gauge("aiops_lad_anomaly_count", "count of anomalies runs", ['anomaly_status'])
-ANOMALY_SCORE = Gauge("aiops_lad_anomaly_avg_score", "avg anomaly score")
-LOG_LINES_COUNT = Gauge("aiops_lad_loglines_count", "count of log lines processed runs")
-FALSE_POSITIVE_COUNT = Counter("aiops_lad_false_positive_count", "count of false positives processed runs", ['id'])
-ANOMALY_HIST = Histogram("aiops_hist", "histogram of anomalies runs")
-THRESHOLD = Gauge("aiops_lad_threshold", "Threshold of marker for anomaly")
+ONLINE_UPDATE_COUNT = Counter("aiops_lad_online_update_count", "count of logs learned by online updates")
 
 
-class SomModelAdapter(BaseModelAdapter):
+class SomModelAdapter(EncodedLogModelAdapter):
     """Self organizing map custom logic to train model. Includes logic to train and predict anomalies in logs."""
 
     def __init__(self, storage_adapter):
         """Init storage provider which provides config and storage interface with storage systems."""
-        self.storage_adapter = storage_adapter
-        update_model = self.storage_adapter.TRAIN_UPDATE_MODEL
-        self.update_model = os.path.isfile(self.storage_adapter.MODEL_PATH) and update_model
-        self.update_w2v_model = os.path.isfile(self.storage_adapter.W2V_MODEL_PATH) and update_model
-        self.recreate_models = False
-        self.model = SOMPYModel(config=storage_adapter.config)
-        self.w2v_model = W2VModel(config=storage_adapter.config)
-
-    def load_w2v_model(self):
-        """Load in w2v model."""
-        try:
-            self.w2v_model.load(self.storage_adapter.W2V_MODEL_PATH)
-        except ModelLoadException as ex:
-            logging.error("Failed to load W2V model: %s" % ex)
-            raise
+        super().__init__(storage_adapter)
+        self.scoring_pool = None
+        self.umatrix_renderer = UMatrixRenderer()
+
+    def create_model(self):
+        """SOM trained online or in batches by SOMModel, otherwise by sompy."""
+        if self.storage_adapter.SOM_TRAIN_MODE in ("online", "batch"):
+            return SOMModel(config=self.storage_adapter.config)
+        return SOMPYModel(config=self.storage_adapter.config)
 
     def load_som_model(self):
-        """Load in w2v model."""
-        try:
-            self.model.load(self.storage_adapter.MODEL_PATH)
-        except ModelLoadException as ex:
-            logging.error("Failed to load SOM model: %s" % ex)
-            raise
+        """Load in som model and hand its codebook to the scoring pool."""
+        super().load_som_model()
+        self.publish_codebook()
+
+    def publish_codebook(self):
+        """Hand the current SOM codebook to the shared memory scoring pool when it is enabled."""
+        if not self.storage_adapter.SOM_SHARED_SCORING_POOL:
+            return
+        if self.scoring_pool is None:
+            if shared_memory is None:
+                logging.warning("Shared memory scoring pool needs python 3.8 or newer, scoring in process")
+                return
+            self.scoring_pool = SharedMemoryScoringPool(self.storage_adapter.PARALLELISM,
+                                                        self.storage_adapter.SOM_BLOCK_SIZE,
+                                                        self.storage_adapter.config)
+        self.scoring_pool.publish(self.model.get())
+
+    def model_state(self):
+        """Bytes of the SOM codebook, hashed into the model version."""
+        return np.ascontiguousarray(self.model.get()).tobytes()
+
+    def get_anomaly_score(self, vectors):
+        """Distance of every vector to the SOM, computed by the scoring pool if one is running."""
+        if self.scoring_pool is not None:
+            return self.scoring_pool.score(vectors)
+        return super().get_anomaly_score(vectors)
+
+    def close(self):
+        """Stop the scoring pool workers, free their shared memory and wait for queued U-matrix images.
+
+        Scoring runs in process after close until the next publish_codebook starts a new pool, when a model is
+        loaded, trained or updated online. The rendering thread is started again with the next U-matrix image.
+        """
+        if self.scoring_pool is not None:
+            self.scoring_pool.close()
+            self.scoring_pool = None
+        self.umatrix_renderer.close()
+        super().close()
 
     @latency_logger(name="SomModelAdapter")
     def train(self, node_map, data, recreate_model=True):
@@ -53,101 +74,70 @@ class SomModelAdapter(BaseModelAdapter):
         vectors = self.w2v_model.one_vector(data)
         # If node_map is none then we assume it is calculating score for inference
         if recreate_model is True:
-            self.model.set(np.random.rand(node_map, node_map, vectors.shape[1]))
+            self.model.set(np.random.rand(node_map, node_map, vectors.shape[1]).astype(vectors.dtype))
         self.model.train(vectors, node_map, self.storage_adapter.TRAIN_ITERATIONS,
                          self.storage_adapter.PARALLELISM)
-        dist = self.model.get_anomaly_score(vectors, self.storage_adapter.PARALLELISM)
-        max_dist = np.max(dist)
-        dist = dist / max_dist
-        self.model.set_metadata((np.mean(dist), np.std(dist), max_dist, np.min(dist)))
-        try:
-            self.model.save(self.storage_adapter.MODEL_PATH)
-        except ModelSaveException as ex:
-            logging.error("Failed to save SOM model: %s" % ex)
-            raise
-        return dist
+        return self._finish_training(vectors)
 
-    @latency_logger(name="SomModelAdapter")
-    def preprocess(self, config_type, recreate_model):
-        """Load data and train."""
-        dataframe, raw_data = self.storage_adapter.load_data(config_type)
-        if dataframe is not None:
-            LOG_LINES_COUNT.set(len(dataframe))
-            if not recreate_model:
-                self.w2v_model.update(dataframe)
-            else:
-                self.w2v_model.create(dataframe,
-                                      self.storage_adapter.TRAIN_VECTOR_LENGTH,
-                                      self.storage_adapter.TRAIN_WINDOW)
-            try:
-                self.w2v_model.save(self.storage_adapter.W2V_MODEL_PATH)
-            except ModelSaveException as ex:
-                logging.error("Failed to save W2V model: %s" % ex)
-                raise
-
-        return dataframe, raw_data
+    def load_for_warm_start(self, node_map):
+        """Load the saved models to continue training them, returns False when a full rebuild is needed."""
+        if not (os.path.exists(self.storage_adapter.MODEL_PATH) and
+                os.path.exists(self.storage_adapter.W2V_MODEL_PATH)):
+            return False
+        try:
+            self.load_w2v_model()
+            self.load_som_model()
+        except ModelLoadException:
+            return False
+        model = self.model.get()
+        if model is None or model.shape[:2] != (node_map, node_map) or self.model.get_metadata() is None:
+            logging.info("Saved SOM model does not match the configured map, rebuilding it")
+            return False
+        return True
 
     @latency_logger(name="SomModelAdapter")
-    def predict(self, data, json_logs, threshold):
-        """Prediction from data provided and if it hits threshold it flags it an anomaly."""
-        feedback_strategy = self.storage_adapter.feedback_strategy
-        inference_batch_id = str(uuid.uuid4())
-        false_positives = None
-        if feedback_strategy is not None:
-            false_positives = feedback_strategy.execute()
-        logging.info("False Positive: {} ".format(false_positives))
-        dist = self.process_anomaly_score(data)
-        f = []
-        hist_count = 0
-        logging.info("Max anomaly score: %f" % max(dist))
-        ANOMALY_COUNT._metrics.clear()
-
-        last_id = dict()
-        for i in range(len(data)):
-            s = json_logs[i]
-            s["predict_id"] = str(uuid.uuid4())
-            s["anomaly_score"] = dist[i]
-            s["elast_alert"] = self.storage_adapter.ES_ELAST_ALERT
-            s["inference_batch_id"] = inference_batch_id
-            s["predictor_namespace"] = self.storage_adapter.OS_NAMESPACE
-            s["e_message"] = quote(s["message"])
-            # Record anomaly event in fact_store
-            if dist[i] > threshold:
-                if false_positives is not None:
-                    if s["message"] in feedback_strategy.uniq_items:
-                        # logging.info("False positive was found (score: %f): %s" % (dist[i], s["message"]))
-                        FALSE_POSITIVE_COUNT.labels(id=s["predict_id"]).inc()
-                        continue
-                hist_count += 1
-                s["anomaly"] = 1
-                logging.warning("Anomaly found (score: %f): %s" % (dist[i], s["message"]))
-                last_id[quote(s["message"])] = s["predict_id"]
-                ANOMALY_SCORE.set(dist[i])
-            else:
-                s["anomaly"] = 0
-            ANOMALY_COUNT.labels(anomaly_status=s["anomaly"]).inc()
-            ANOMALY_HIST.observe(hist_count)
-            f.append(s)
-        return f
+    def warm_start(self, data):
+        """Continue training the loaded som model on new data, returns None when the map drifted too far."""
+        vectors = self.w2v_model.one_vector(data)
+        if vectors.shape[1] != self.model.get().shape[-1]:
+            logging.info("Encoded log vectors no longer match the SOM codebook, rebuilding it")
+            return None
+        mean, max_dist = self.model.get_metadata()[0], self.model.get_metadata()[2]
+        drift = np.mean(self.get_anomaly_score(vectors)) / (mean * max_dist)
+        if drift > self.storage_adapter.TRAIN_WARM_START_MAX_DRIFT:
+            logging.info("New logs drifted %.2f times from the SOM model, rebuilding it" % drift)
+            return None
+        self.model.train_warm(vectors, self.storage_adapter.TRAIN_WARM_START_ROUGH_LEN,
+                              self.storage_adapter.TRAIN_WARM_START_FINETUNE_LEN,
+                              self.storage_adapter.PARALLELISM)
+        return self._finish_training(vectors)
 
-    @latency_logger(name="SomModelAdapter")
-    def process_anomaly_score(self, data):
-        """Generate scores from some. To be used for inference."""
-        meta_data = self.model.get_metadata()
-        max_dist = meta_data[2]
-        v = self.w2v_model.one_vector(data)
-        dist = []
-        dist = self.model.get_anomaly_score(v, self.storage_adapter.PARALLELISM)
-        dist = dist / max_dist
+    def _finish_training(self, vectors):
+        """Publish the trained codebook, store the training distance statistics, save and render the model."""
+        self.publish_codebook()
+        dist = super()._finish_training(vectors)
+        if self.storage_adapter.SOM_UMATRIX_DIR:
+            self.umatrix_renderer.submit(self.model.get(), self.storage_adapter.SOM_UMATRIX_DIR)
         return dist
 
-    def set_threshold(self):
-        """Setting threshold for prediction."""
-        meta_data = self.model.get_metadata()
-        stdd = meta_data[1]
-        mean = meta_data[0]
-        threshold = self.storage_adapter.INFER_ANOMALY_THRESHOLD * stdd + mean
-        THRESHOLD.set(threshold)
-        logging.info("threshold for anomaly is of %f" % threshold)
-        logging.info("Models loaded, running %d infer loops" % self.storage_adapter.INFER_LOOPS)
-        return mean, threshold
+    def update_online(self, threshold, infer_loop):
+        """Let the som model learn from the logs of the last inference that scored below the threshold."""
+        if self.last_inference is None:
+            return 0
+        vectors, dist = self.last_inference
+        self.last_inference = None
+        normal = vectors[dist <= threshold]
+        max_updates = self.storage_adapter.INFER_ONLINE_MAX_UPDATES
+        if len(normal) > max_updates:
+            normal = normal[np.random.choice(len(normal), max_updates, replace=False)]
+        if len(normal) == 0:
+            return 0
+        # Learning rate decays over all the updates that can happen until the next retrain
+        steps = infer_loop * max_updates + np.arange(len(normal))
+        rates = self.storage_adapter.INFER_ONLINE_LEARNING_RATE * SOMModel.alph(
+            self.storage_adapter.INFER_LOOPS * max_updates, steps)
+        self.model.update_online(normal, rates)
+        self.publish_codebook()
+        self.invalidate_scores()
+        ONLINE_UPDATE_COUNT.inc(len(normal))
+        return len(normal)
@@ -3,6 +3,7 @@ import logging
 from anomaly_detector.adapters import BaseStorageAdapter
 from anomaly_detector.decorator.utils import latency_logger
 from anomaly_detector.storage import ESStorageAttribute
+from anomaly_detector.storage.sampler import ReservoirSampler
 from anomaly_detector.storage.storage_proxy import StorageProxy
 
 
@@ -15,11 +16,13 @@ class SomStorageAdapter(BaseStorageAdapter):
         self.feedback_strategy = feedback_strategy
         self.storage = StorageProxy(config)
 
-    def retrieve_data(self, timespan, max_entry, false_positive):
+    def retrieve_data(self, timespan, max_entry, false_positive, sampler=None, training=False):
         """Fetch data from storage system."""
         data, raw = self.storage.retrieve(ESStorageAttribute(timespan,
                                                              max_entry,
-                                                             false_positive))
+                                                             false_positive,
+                                                             sampler,
+                                                             training))
         if len(data) == 0:
             logging.info("There are no logs in last %s seconds", timespan)
             return None, None
@@ -34,15 +37,49 @@ class SomStorageAdapter(BaseStorageAdapter):
             false_data = self.feedback_strategy.execute()
 
         if config_type == "train":
-            return self.retrieve_data(timespan=self.config.TRAIN_TIME_SPAN,
-                                      max_entry=self.config.TRAIN_MAX_ENTRIES,
-                                      false_positive=false_data)
+            return self.training_data(self.config.TRAIN_TIME_SPAN, false_data)
+        elif config_type == "warm":
+            return self.training_data(self.config.TRAIN_WARM_START_TIME_SPAN, false_data)
         elif config_type == "infer":
             return self.retrieve_data(timespan=self.config.INFER_TIME_SPAN,
                                       max_entry=self.config.INFER_MAX_ENTRIES,
                                       false_positive=false_data)
         else:
-            raise Exception("Not Supported option . config_type not in ['infer','train']")
+            raise Exception("Not Supported option . config_type not in ['infer','train','warm']")
+
+    def training_data(self, timespan, false_data):
+        """Training logs of the timespan, sampled to TRAIN_SAMPLE_SIZE logs followed by all false positive feedback.
+
+        Storages feeding the sampler while reading append the feedback after sampling and are kept as they are,
+        the logs of other storages are sampled once they are loaded.
+        """
+        sampler = self.sampler()
+        data, raw = self.retrieve_data(timespan=timespan,
+                                       max_entry=self.config.TRAIN_MAX_ENTRIES,
+                                       false_positive=false_data,
+                                       sampler=sampler,
+                                       training=True)
+        if sampler is None or sampler.seen > 0:
+            return data, raw
+        return self.sample_data(data, raw)
+
+    def sampler(self):
+        """Reservoir sampler of TRAIN_SAMPLE_SIZE training logs for the storage to feed while reading them."""
+        if self.config.TRAIN_SAMPLE_SIZE <= 0:
+            return None
+        return ReservoirSampler(self.config.TRAIN_SAMPLE_SIZE, stratified=self.config.TRAIN_SAMPLE_STRATIFIED)
+
+    def sample_data(self, data, raw, chunk_size=10000):
+        """Reservoir sample the training logs of storages that loaded more than TRAIN_SAMPLE_SIZE of them."""
+        if data is None or not 0 < self.config.TRAIN_SAMPLE_SIZE < len(data):
+            return data, raw
+        sampler = self.sampler()
+        for start in range(0, len(data), chunk_size):
+            rows = range(start, min(start + chunk_size, len(data)))
+            sampler.add(rows, data["message"].iloc[start:rows.stop])
+        rows = sorted(sampler.sample())
+        logging.info("Sampled %d of %d logs for training", len(rows), len(data))
+        return data.iloc[rows].reset_index(drop=True), [raw[i] for i in rows]
 
     @latency_logger(name="SomStorageAdapter")
     def persist_data(self, df):
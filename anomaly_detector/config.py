@@ -3,6 +3,7 @@
 import os
 import distutils
 import logging
+import sys
 import yaml
 
 _LOGGER = logging.getLogger(__name__)
@@ -24,6 +25,12 @@ def check_or_create_model_dir(config):
         os.mkdir(config.MODEL_DIR)
 
 
+def check_shared_scoring_pool(config):
+    """Reject the shared memory scoring pool on python older than 3.8, which has no shared memory module."""
+    if config.SOM_SHARED_SCORING_POOL and sys.version_info < (3, 8):
+        raise ValueError("SOM_SHARED_SCORING_POOL needs python 3.8 or newer")
+
+
 class Configuration:
     """Main configuration class which is contains the config values."""
 
@@ -36,25 +43,107 @@ class Configuration:
     # A directory where trained models will be stored
     MODEL_DIR = "./models/"
     MODE_DIR_CALLABLE = check_or_create_model_dir
+    # Log field, such as "kubernetes.namespace_name", whose values get a model each, empty serves a single model
+    MODEL_REGISTRY_KEY = ""
+    # Model of logs without the MODEL_REGISTRY_KEY field
+    MODEL_REGISTRY_DEFAULT_TENANT = "default"
+    # Bytes of model arrays kept in memory before least recently used tenant models are unloaded
+    MODEL_REGISTRY_MAX_BYTES = 1073741824
     # Name of the file where SOM model will be stored
     MODEL_FILE = "SOM.model"
     # Name of the file where W2V model will be stored
     W2V_MODEL_FILE = "W2V.model"
+    # Format models are saved in: "joblib" pickles or "native", a directory of a json header and raw
+    # .npy arrays that are memory mapped on load. Both formats are detected automatically on load
+    MODEL_FORMAT = "joblib"
     MODEL_PATH_CALLABLE = join_model_path
     MODEL_PATH = ""
     W2V_MODEL_PATH_CALLABLE = join_w2v_model_path
     W2V_MODEL_PATH = ""
+    # Floating point precision of encoded vectors, SOM codebooks and scores: "float64" or "float32"
+    MODEL_PRECISION = "float64"
     # Custom parameters for W2V
     W2V_MIN_COUNT = 1
     W2V_ITER = 5
     W2V_COMPUTE_LOSS = False
     W2V_SEED = 1
     W2V_WORKERS = 3
+    # Number of consecutive words of a column in every W2V training sentence, sentences are what the
+    # W2V_WORKERS train in parallel and gensim cuts sentences after 10000 words
+    W2V_SENTENCE_LENGTH = 10000
+    # Directory W2V training corpora are written to in LineSentence format and trained from, which scales
+    # better with W2V_WORKERS on large training sets. The files are removed after training. Empty trains from memory
+    W2V_CORPUS_DIR = ""
+    # Precision the W2V embeddings are kept and saved with, "" for gensim's float32 or "float16" to halve memory
+    W2V_STORAGE_PRECISION = ""
+    # Encoding of words missing in the W2V vocabulary: "zero" vectors, or "hash" for a small random vector
+    # seeded by the word, like the vectors gensim gives new words
+    W2V_OOV_STRATEGY = "hash"
+    # Number of most recently seen unknown words whose "hash" vectors are kept in memory
+    W2V_OOV_TABLE_SIZE = 10000
+    # Maximum number of words in the W2V vocabulary of a column, 0 for no limit. When set, updates only train
+    # the vectors of new words and evict the least recently seen, then least frequent, words
+    W2V_MAX_VOCAB = 0
+    # Encoder of logs into vectors, as named in LogEncoderCatalog: "w2v_encoder" or "hashing_encoder" for
+    # feature hashing, which needs no training
+    LOG_ENCODER = "w2v_encoder"
+    # Number of hashing_encoder buckets every column is hashed into
+    HASHING_VECTOR_LENGTH = 64
+    # Number of characters of the n-grams hashed by the hashing_encoder
+    HASHING_NGRAM = 3
+    # Model the jobs train and infer with: "sompy" for a SOM, "iforest" for an isolation forest or "knn" for
+    # k nearest neighbours of the training logs
+    MODEL_ALGORITHM = "sompy"
     # Custom parameters for SOM
     SOMPY_TRAIN_ROUGH_LEN = 100
     SOMPY_TRAIN_FINETUNE_LEN = 5
     SOMPY_NODE_MAP = 24
     SOMPY_INIT = "pca"
+    # SOM training algorithm: "sompy", or "online"/"batch" for the built in SOMModel trainers
+    SOM_TRAIN_MODE = "sompy"
+    # Number of epochs over the whole training set used by batch SOM training
+    SOM_BATCH_EPOCHS = 10
+    # Number of rows matched against the codebook at once when searching for best matching units
+    SOM_BLOCK_SIZE = 4096
+    # Index over the SOM codebook used for scoring: "" for an exhaustive scan, "kd_tree", "ball_tree"
+    # or "hierarchical" for an approximate coarse to fine search
+    SOM_INDEX = ""
+    # Side of the square block of nodes summarised by one coarse node in hierarchical search
+    SOM_COARSE_REGION_SIZE = 4
+    # Number of closest coarse regions searched node by node in hierarchical search
+    SOM_COARSE_TOP_K = 3
+    # If true, score with PARALLELISM long lived workers that read the SOM codebook from shared memory.
+    # Not used with MODEL_REGISTRY_KEY, which would start workers for every tenant. Needs python 3.8 or newer
+    SOM_SHARED_SCORING_POOL = False
+    SOM_SHARED_SCORING_POOL_CALLABLE = check_shared_scoring_pool
+    # Directory a U-matrix image of the SOM is rendered to in the background after training, empty disables it
+    SOM_UMATRIX_DIR = ""
+    # If true, SOM training stops once the quantization error on held out logs stops improving
+    SOM_EARLY_STOPPING = False
+    # Relative quantization error improvement below which an epoch counts as no improvement
+    SOM_EARLY_STOPPING_TOLERANCE = 0.001
+    # Number of epochs in a row without improvement before training stops
+    SOM_EARLY_STOPPING_PATIENCE = 2
+    # Number of logs held out of training to evaluate the SOM on
+    SOM_EARLY_STOPPING_SAMPLE = 1000
+    # Number of trees of the isolation forest
+    IFOREST_N_ESTIMATORS = 100
+    # Number of logs drawn to build every tree of the isolation forest
+    IFOREST_MAX_SAMPLES = 256
+    # Number of rows scored at once by every isolation forest scoring thread
+    IFOREST_BATCH_SIZE = 10000
+    # Number of inverted lists, k-means clusters of the training logs, of the kNN index
+    IVF_NLIST = 256
+    # Number of lists closest to a log searched for its nearest neighbours, IVF_NLIST searches exhaustively
+    IVF_NPROBE = 8
+    # Number of nearest training logs whose mean distance is the anomaly score
+    IVF_K = 5
+    # Maximum number of k-means iterations when building the lists
+    IVF_KMEANS_ITERATIONS = 20
+    # Number of training logs sampled to compute the k-means centroids
+    IVF_KMEANS_SAMPLE = 100000
+    # Number of rows searched at once by every kNN scoring thread
+    IVF_BLOCK_SIZE = 1024
 
     MODEL_STORE = ""
     MODEL_STORE_PATH = "anomaly-detection/models/"
@@ -66,6 +155,20 @@ class Configuration:
     TRAIN_ITERATIONS = 315448
     # If true, re-traing the models
     TRAIN_UPDATE_MODEL = False
+    # Number of logs reservoir sampled from the loaded logs for training, 0 trains on all of them
+    TRAIN_SAMPLE_SIZE = 0
+    # If true, every distinct message gets an equal share of the training sample
+    TRAIN_SAMPLE_STRATIFIED = False
+    # If true, continue training the saved models on the newest logs instead of rebuilding them every cycle
+    TRAIN_WARM_START = False
+    # Number of seconds of the newest logs used for warm start training
+    TRAIN_WARM_START_TIME_SPAN = 600
+    # Number of rough and fine tuning batch epochs of warm start training
+    TRAIN_WARM_START_ROUGH_LEN = 10
+    TRAIN_WARM_START_FINETUNE_LEN = 2
+    # Rebuild from scratch when the mean distance of the new logs to the map exceeds this multiple of the
+    # mean distance measured at the end of the previous training
+    TRAIN_WARM_START_MAX_DRIFT = 1.5
     # Set the window size for word2Vec training
     TRAIN_WINDOW = 5
     # Set the length of the encoded log vectors
@@ -75,12 +178,33 @@ class Configuration:
 
     # Threshold used to decide whether an entry is an anomaly
     INFER_ANOMALY_THRESHOLD = 3.1
+    # Either "std" for a threshold of INFER_ANOMALY_THRESHOLD standard deviations above the mean training score,
+    # or "quantile" for a quantile of a digest of training and inference scores saved with the model
+    INFER_THRESHOLD_MODE = "std"
+    # Quantile of the scores used as threshold in "quantile" mode
+    INFER_THRESHOLD_QUANTILE = 0.99
+    # Compression of the score digest, higher keeps more centroids and is more accurate
+    INFER_THRESHOLD_COMPRESSION = 100
     # Number of seconds specifying how far in the past to go to load log entries for inference
     INFER_TIME_SPAN = 60
     # Number of inferences before retraining the models
     INFER_LOOPS = 10
     # Maximum number of entries to be loaded for inference
     INFER_MAX_ENTRIES = 78862
+    # If true, inference never updates or saves the W2V model, unknown words are encoded with W2V_OOV_STRATEGY
+    INFER_FREEZE_ENCODER = False
+    # If true, the SOM model keeps learning from the logs scored below the threshold between retrains
+    INFER_ONLINE_UPDATE = False
+    # Initial learning rate of online updates, decays to 0 over INFER_LOOPS
+    INFER_ONLINE_LEARNING_RATE = 0.05
+    # Maximum number of logs the SOM model learns from per inference
+    INFER_ONLINE_MAX_UPDATES = 1000
+    # Number of inferences between checkpoints of the online updated SOM model
+    INFER_ONLINE_CHECKPOINT_LOOPS = 5
+    # Number of distinct log messages whose scores are cached in memory, 0 disables the score cache
+    INFER_SCORE_CACHE_SIZE = 0
+    # Path of a sqlite file keeping cached scores across restarts, empty keeps them in memory only
+    INFER_SCORE_CACHE_PATH = ""
 
     # S3 credentials for storing model up to s3 post training.
     S3_KEY = ""
@@ -106,6 +230,17 @@ class Configuration:
     ES_INPUT_INDEX = ""
     # JSON representing a query passed to data source to match the data
     LOG_FORMATTER = ""
+    # If true, messages are replaced by the id of their log template, mined with a Drain parse tree at training time,
+    # before they are encoded and scored. At inference messages matching no template get one shared unknown id
+    LOG_TEMPLATE_MINER = False
+    # Name of the file next to the models where log templates mined at training time are kept, inference only reads it
+    LOG_TEMPLATE_FILE = "templates.json"
+    # Depth of the parse tree, messages are routed by their first LOG_TEMPLATE_DEPTH - 2 tokens
+    LOG_TEMPLATE_DEPTH = 4
+    # Share of equal tokens above which a message joins a template instead of starting a new one
+    LOG_TEMPLATE_SIMILARITY = 0.4
+    # Number of children of a parse tree node before new tokens share its wildcard branch
+    LOG_TEMPLATE_MAX_CHILDREN = 100
     # When customer has custom log format. We will need to perform custom processing.
     ES_QUERY = ""
     ES_VERSION = 5
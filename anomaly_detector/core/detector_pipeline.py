@@ -1,6 +1,7 @@
 """DetectorPipeline class for processing a workflow of tasks to train an ML model."""
 from anomaly_detector.core import AbstractCommand
-from anomaly_detector.adapters import FeedbackStrategy, SomStorageAdapter, SomModelAdapter
+from anomaly_detector.adapters import FeedbackStrategy, SomStorageAdapter, SomModelAdapter, ModelRegistry, \
+    IsolationForestModelAdapter, KNNModelAdapter
 from anomaly_detector.core import SomTrainJob, SomInferenceJob
 from prometheus_client import Counter
 
@@ -78,6 +79,8 @@ class DetectorPipelineCatalog(object):
         if feedback_strategy is None:
             feedback_strategy = FeedbackStrategy(config=config)
         storage_adapter = SomStorageAdapter(config, feedback_strategy)
+        if config.MODEL_REGISTRY_KEY:
+            return ModelRegistry(storage_adapter)
         model_adapter = SomModelAdapter(storage_adapter)
         return model_adapter
 
@@ -86,7 +89,8 @@ class DetectorPipelineCatalog(object):
         """Perform Training and inference of SOMPY Model."""
         pipeline = DetectorPipeline()
         model_adapter = cls.create_sompy_modeladapter(config, feedback_strategy)
-        train = SomTrainJob(node_map=config.SOMPY_NODE_MAP, model_adapter=model_adapter)
+        train = SomTrainJob(node_map=config.SOMPY_NODE_MAP, model_adapter=model_adapter,
+                            warm_start=config.TRAIN_WARM_START)
         pipeline.add_steps(train)
         return pipeline
 
@@ -95,8 +99,9 @@ class DetectorPipelineCatalog(object):
         """Perform Training and inference of SOMPY Model."""
         pipeline = DetectorPipeline()
         model_adapter = cls.create_sompy_modeladapter(config, feedback_strategy)
-        pipeline.add_steps(SomTrainJob(node_map=config.SOMPY_NODE_MAP, model_adapter=model_adapter))
-        pipeline.add_steps(SomInferenceJob(model_adapter=model_adapter))
+        pipeline.add_steps(SomTrainJob(node_map=config.SOMPY_NODE_MAP, model_adapter=model_adapter,
+                                       warm_start=config.TRAIN_WARM_START))
+        pipeline.add_steps(SomInferenceJob(model_adapter=model_adapter, online_update=config.INFER_ONLINE_UPDATE))
         return pipeline
 
     @classmethod
@@ -104,13 +109,86 @@ class DetectorPipelineCatalog(object):
         """Perform inference of SOMPY Model."""
         pipeline = DetectorPipeline()
         model_adapter = cls.create_sompy_modeladapter(config, feedback_strategy)
-        train = SomTrainJob(node_map=config.SOMPY_NODE_MAP, model_adapter=model_adapter)
+        train = SomTrainJob(node_map=config.SOMPY_NODE_MAP, model_adapter=model_adapter,
+                            warm_start=config.TRAIN_WARM_START)
         pipeline.add_steps(train)
         return pipeline
 
+    @classmethod
+    def create_iforest_modeladapter(cls, config, feedback_strategy):
+        """Setup isolation forest model adapter which trains an isolation forest on the W2V encoded logs."""
+        if feedback_strategy is None:
+            feedback_strategy = FeedbackStrategy(config=config)
+        storage_adapter = SomStorageAdapter(config, feedback_strategy)
+        return IsolationForestModelAdapter(storage_adapter)
+
+    @classmethod
+    def _iforest_train_job(cls, config, feedback_strategy):
+        """Perform Training of Isolation Forest Model."""
+        pipeline = DetectorPipeline()
+        model_adapter = cls.create_iforest_modeladapter(config, feedback_strategy)
+        pipeline.add_steps(SomTrainJob(model_adapter=model_adapter))
+        return pipeline
+
+    @classmethod
+    def _iforest_train_infer_job(cls, config, feedback_strategy):
+        """Perform Training and inference of Isolation Forest Model."""
+        pipeline = DetectorPipeline()
+        model_adapter = cls.create_iforest_modeladapter(config, feedback_strategy)
+        pipeline.add_steps(SomTrainJob(model_adapter=model_adapter))
+        pipeline.add_steps(SomInferenceJob(model_adapter=model_adapter))
+        return pipeline
+
+    @classmethod
+    def _iforest_infer_job(cls, config, feedback_strategy):
+        """Perform inference of Isolation Forest Model."""
+        pipeline = DetectorPipeline()
+        model_adapter = cls.create_iforest_modeladapter(config, feedback_strategy)
+        pipeline.add_steps(SomInferenceJob(model_adapter=model_adapter))
+        return pipeline
+
+    @classmethod
+    def create_knn_modeladapter(cls, config, feedback_strategy):
+        """Setup kNN model adapter which indexes the W2V encoded training logs for nearest neighbour search."""
+        if feedback_strategy is None:
+            feedback_strategy = FeedbackStrategy(config=config)
+        storage_adapter = SomStorageAdapter(config, feedback_strategy)
+        return KNNModelAdapter(storage_adapter)
+
+    @classmethod
+    def _knn_train_job(cls, config, feedback_strategy):
+        """Perform Training of kNN Model."""
+        pipeline = DetectorPipeline()
+        model_adapter = cls.create_knn_modeladapter(config, feedback_strategy)
+        pipeline.add_steps(SomTrainJob(model_adapter=model_adapter))
+        return pipeline
+
+    @classmethod
+    def _knn_train_infer_job(cls, config, feedback_strategy):
+        """Perform Training and inference of kNN Model."""
+        pipeline = DetectorPipeline()
+        model_adapter = cls.create_knn_modeladapter(config, feedback_strategy)
+        pipeline.add_steps(SomTrainJob(model_adapter=model_adapter))
+        pipeline.add_steps(SomInferenceJob(model_adapter=model_adapter))
+        return pipeline
+
+    @classmethod
+    def _knn_infer_job(cls, config, feedback_strategy):
+        """Perform inference of kNN Model."""
+        pipeline = DetectorPipeline()
+        model_adapter = cls.create_knn_modeladapter(config, feedback_strategy)
+        pipeline.add_steps(SomInferenceJob(model_adapter=model_adapter))
+        return pipeline
+
     _class_method_choices = {'sompy.train': _sompy_train_job,
                              'sompy.inference': _sompy_infer_job,
-                             'sompy.train.inference': _sompy_train_infer_job}
+                             'sompy.train.inference': _sompy_train_infer_job,
+                             'iforest.train': _iforest_train_job,
+                             'iforest.inference': _iforest_infer_job,
+                             'iforest.train.inference': _iforest_train_infer_job,
+                             'knn.train': _knn_train_job,
+                             'knn.inference': _knn_infer_job,
+                             'knn.train.inference': _knn_train_infer_job}
 
     def get_pipeline(self):
         """Provide a pipeline to allow client to select which algorithm to use."""
@@ -1,7 +1,7 @@
 """Encoder class for converting raw log to vector representation."""
 import os
 import logging
-from anomaly_detector.model import W2VModel
+from anomaly_detector.model import W2VModel, HashingEncoderModel
 from anomaly_detector.exception import ModelSaveException, ModelLoadException
 
 
@@ -56,6 +56,20 @@ class LogEncoderCatalog(object):
 
         return self.model
 
+    def _hashing_encoder(self):
+        """Prepare the feature hashing encoder, which encodes logs without being trained.
+
+        :return: None
+        """
+        self.model = HashingEncoderModel(config=self.config)
+        try:
+            self.model.load(self.config.W2V_MODEL_PATH)
+        except ModelLoadException as ex:
+            logging.error("Failed to load hashing encoder: %s" % ex)
+            raise
+
+        return self.model
+
     def one_vector(self, data):
         """Based on the data you provide you will get the vector representation of that log message.
 
@@ -64,7 +78,7 @@ class LogEncoderCatalog(object):
         """
         return self.model.one_vector(data)
 
-    _instance_method_choices = {'w2v_encoder': _w2v_encoder}
+    _instance_method_choices = {'w2v_encoder': _w2v_encoder, 'hashing_encoder': _hashing_encoder}
 
     def build(self):
         """Build encoder based on which class encoding scheme you select in the constructor.
@@ -25,11 +25,12 @@ class SomTrainJob(AbstractCommand):
 
     recreate_models = False
 
-    def __init__(self, node_map=24, model_adapter=None, recreate_model=True):
+    def __init__(self, node_map=24, model_adapter=None, recreate_model=True, warm_start=False):
         """Initialize training job with fields to perform model training."""
         self.node_map = node_map
         self.model_adapter = model_adapter
         self.recreate_model = recreate_model
+        self.warm_start = warm_start
 
     def execute_with_tracing(self, tracer):
         """Wrap execution of train with tracer to measure latency."""
@@ -40,6 +41,14 @@ class SomTrainJob(AbstractCommand):
     def execute(self):
         """Execute training logic for anomaly detection for SOMPY with w2v encoding."""
         TRAINING_COUNT.inc()
+        if self.warm_start and self.model_adapter.load_for_warm_start(self.node_map):
+            dataframe, raw_data = self.model_adapter.preprocess(config_type="warm", recreate_model=False)
+            if not raw_data:
+                raise EmptyDataSetException("no new logs found.")
+            dist = self.model_adapter.warm_start(data=dataframe)
+            if dist is not None:
+                self.recreate_model = False
+                return 0, dist
         dataframe, raw_data = self.model_adapter.preprocess(config_type="train",
                                                             recreate_model=self.recreate_model)
         if not raw_data:
@@ -53,11 +62,12 @@ class SomTrainJob(AbstractCommand):
 class SomInferenceJob(AbstractCommand):
     """Som Inference implementation."""
 
-    def __init__(self, model_adapter=None, sleep=True, recreate_model=False):
+    def __init__(self, model_adapter=None, sleep=True, recreate_model=False, online_update=False):
         """Initialize inference job with fields to perform model inference."""
         self.model_adapter = model_adapter
         self.sleep = sleep
         self.recreate_model = recreate_model
+        self.online_update = online_update
 
     def execute_with_tracing(self, tracer):
         """Will wrap execution of inference with tracer to measure latency."""
@@ -84,6 +94,14 @@ class SomInferenceJob(AbstractCommand):
                          self.model_adapter.storage_adapter.INFER_TIME_SPAN)
             results = self.model_adapter.predict(data, json_logs, threshold)
             self.model_adapter.storage_adapter.persist_data(results)
+            if self.model_adapter.threshold_digest is not None:
+                # The digest learned the scores of this inference, the threshold follows it
+                mean, threshold = self.model_adapter.set_threshold()
+            if self.online_update:
+                updates = self.model_adapter.update_online(threshold, infer_loops)
+                logging.info("SOM model learned from %d logs", updates)
+                if (infer_loops + 1) % self.model_adapter.storage_adapter.INFER_ONLINE_CHECKPOINT_LOOPS == 0:
+                    self.model_adapter.save_som_model()
             # Inference done, increase counter
             infer_loops += 1
             now = time.time()
@@ -95,4 +113,9 @@ class SomInferenceJob(AbstractCommand):
                 if sleep_time > 0:
                     time.sleep(sleep_time)
 
+        if self.model_adapter.threshold_digest is not None or (
+                self.online_update and infer_loops % self.model_adapter.storage_adapter.INFER_ONLINE_CHECKPOINT_LOOPS):
+            self.model_adapter.save_som_model()
+        # Stops the scoring pool workers and frees their shared memory, the models stay loaded
+        self.model_adapter.close()
         return 0
@@ -1,10 +1,16 @@
 """Model package."""
 from anomaly_detector.model.base_model import BaseModel
+from anomaly_detector.model.hashing_encoder_model import HashingEncoderModel
+from anomaly_detector.model.isolation_forest_model import IsolationForestModel
+from anomaly_detector.model.ivf_knn_model import IVFKNNModel
 from anomaly_detector.model.som_model import SOMModel
 from anomaly_detector.model.sompy_model import SOMPYModel
 from anomaly_detector.model.w2v_model import W2VModel
 
 __all__ = ['BaseModel',
+           'HashingEncoderModel',
+           'IsolationForestModel',
+           'IVFKNNModel',
            'SOMModel',
            'SOMPYModel',
            'W2VModel']
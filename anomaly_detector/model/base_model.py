@@ -1,7 +1,16 @@
 """Base model class."""
 from anomaly_detector.exception import ModelLoadException, ModelSaveException
 from sklearn.externals import joblib
+import numpy as np
+import json
 import os
+import shutil
+import uuid
+
+PRECISIONS = ("float32", "float64")
+NATIVE_FORMAT = "lad-native"
+NATIVE_VERSION = 1
+NATIVE_HEADER = "header.json"
 
 
 class BaseModel:
@@ -12,9 +21,15 @@ class BaseModel:
         self.model = None
         self.metadata = None
         self.config = config
+        # Distance of every training vector found by the trainer, NaN for vectors it did not assign
+        self.train_dist = None
 
     def load(self, source):
-        """Load a model from disk."""
+        """Load a model from disk, either a native format directory or a joblib file."""
+        if os.path.isdir(source):
+            self._load_native_format(source)
+            return
+
         if not os.path.isfile(source):
             raise ModelLoadException("Could not load a model. File %s does not exist" % source)
 
@@ -27,14 +42,82 @@ class BaseModel:
         self.metadata = loaded_model["metadata"]
 
     def save(self, dest):
-        """Save a model to disk."""
+        """Save a model to disk in the format selected by MODEL_FORMAT."""
+        if self.config and self.config.MODEL_FORMAT == "native":
+            self._save_native_format(dest)
+            return
+
         saved_model = {"model": self.model, "metadata": self.metadata}
 
+        # Readers never see a partly written file, the complete file is renamed over dest
+        tmp = "%s.tmp-%s" % (dest, uuid.uuid4().hex)
         try:
-            joblib.dump(saved_model, dest)
+            joblib.dump(saved_model, tmp)
+            _replace(tmp, dest)
         except Exception as ex:
+            _remove(tmp)
             raise ModelSaveException("Could not save the model: %s" % ex)
 
+    def _load_native_format(self, source):
+        """Load a directory holding a json header and the raw arrays of the model, arrays are memory mapped.
+
+        The version source links to is resolved once, so header and arrays come from the same save. If a concurrent
+        save removed that version while it was read, the new version is loaded instead.
+        """
+        version = os.path.realpath(source)
+        try:
+            with open(os.path.join(version, NATIVE_HEADER)) as f:
+                header = json.load(f)
+        except Exception as ex:
+            if os.path.realpath(source) != version:
+                return self._load_native_format(source)
+            raise ModelLoadException("Could not load a model header: %s" % ex)
+        if header.get("format") != NATIVE_FORMAT or header.get("version", 0) > NATIVE_VERSION:
+            raise ModelLoadException("Unsupported model format %s version %s in %s"
+                                     % (header.get("format"), header.get("version"), source))
+
+        try:
+            self._load_native(version, header)
+        except Exception as ex:
+            if os.path.realpath(source) != version:
+                return self._load_native_format(source)
+            raise ModelLoadException("Could not load a model: %s" % ex)
+        metadata = header["metadata"]
+        self.metadata = tuple(metadata) if isinstance(metadata, list) else metadata
+
+    def _save_native_format(self, dest):
+        """Write the header and arrays to a new versioned directory and point dest at it once complete."""
+        version = "%s.v-%s" % (dest, uuid.uuid4().hex)
+        try:
+            os.makedirs(version)
+            header = {"format": NATIVE_FORMAT, "version": NATIVE_VERSION, "model_class": self.__class__.__name__,
+                      "metadata": self.metadata}
+            header.update(self._save_native(version))
+            with open(os.path.join(version, NATIVE_HEADER), "w") as f:
+                json.dump(header, f, default=_json_scalar)
+            _replace(version, dest)
+        except Exception as ex:
+            _remove(version)
+            raise ModelSaveException("Could not save the model: %s" % ex)
+
+    def _save_native(self, directory):
+        """Write the model arrays into directory and return the header entries describing them."""
+        np.save(os.path.join(directory, "model.npy"), self.model)
+        return {"arrays": {"model": "model.npy"}}
+
+    def _load_native(self, directory, header):
+        """Memory map the model arrays described by header from directory."""
+        self.model = np.load(os.path.join(directory, header["arrays"]["model"]), mmap_mode="r")
+
+    @property
+    def dtype(self):
+        """Floating point type of the vectors and arrays computed by the model."""
+        if not self.config:
+            return np.dtype(np.float64)
+        if self.config.MODEL_PRECISION not in PRECISIONS:
+            raise ValueError("Unsupported MODEL_PRECISION used {}".format(self.config.MODEL_PRECISION))
+        return np.dtype(self.config.MODEL_PRECISION)
+
     def get(self):
         """Get a model."""
         return self.model
@@ -50,3 +133,38 @@ class BaseModel:
     def set_metadata(self, metadata):
         """Set model metadata."""
         self.metadata = metadata
+
+
+def _json_scalar(obj):
+    """Convert numpy scalars and arrays found in model metadata to json types."""
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+def _replace(src, dest):
+    """Make dest the model file or native format directory src with one rename, loaders never find dest missing.
+
+    A directory cannot be renamed over another one, so dest becomes a symlink to the versioned directory src and the
+    symlink is renamed over dest. The version dest linked to before is removed afterwards. Only a plain directory
+    left by older saves has to be moved aside first.
+    """
+    old = os.path.realpath(dest) if os.path.islink(dest) else None
+    if old is None and os.path.isdir(dest):
+        old = "%s.old-%s" % (dest, uuid.uuid4().hex)
+        os.rename(dest, old)
+    if os.path.isdir(src):
+        link = "%s.link-%s" % (dest, uuid.uuid4().hex)
+        os.symlink(os.path.basename(src), link)
+        src = link
+    os.replace(src, dest)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def _remove(path):
+    """Remove a model file or native format directory if it exists."""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
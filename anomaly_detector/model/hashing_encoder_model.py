@@ -0,0 +1,120 @@
+"""Feature hashing encoder of log messages, which needs no training."""
+import numpy as np
+import pandas
+from anomaly_detector.exception import ModelLoadException
+from anomaly_detector.model.base_model import BaseModel
+import logging
+import numbers
+import os
+
+_LOGGER = logging.getLogger(__name__)
+
+# 64 bit FNV-1a hash of the code points of an n-gram, stable across processes unlike hash()
+_FNV_OFFSET = np.uint64(14695981039346656037)
+_FNV_PRIME = np.uint64(1099511628211)
+# Distinct words hashed together, words are sorted by length so the character matrix of a block stays narrow
+_BLOCK_SIZE = 1024
+
+
+class HashingEncoderModel(BaseModel):
+    """Encode every column of a log as the signed feature hashes of its character n-grams.
+
+    Cleaned messages keep only their letters, so the words of a message run together and n-grams of
+    HASHING_NGRAM characters stand in for its tokens. Every n-gram adds +1 or -1 to one of
+    HASHING_VECTOR_LENGTH buckets and the vector is scaled to unit length. The model only records the
+    encoded columns, it learns nothing from the logs and can encode them before any training.
+    """
+
+    def __init__(self, config=None):
+        """Construct with configurations for customizations."""
+        super().__init__(config)
+        self.config = config
+
+    def create(self, words, vector_length, window_size):
+        """Encode the columns of words, vector_length and window_size of the W2V model are not used."""
+        self.model = {col: self.config.HASHING_VECTOR_LENGTH for col in words.columns}
+
+    def update(self, words):
+        """Keep encoding the same columns, there is nothing to learn from new words."""
+        if self.model is None:
+            self.create(words, self.config.HASHING_VECTOR_LENGTH, None)
+
+    def load(self, source):
+        """Load the encoded columns, without a saved model the cleaned message column is encoded.
+
+        Models saved by another LOG_ENCODER at the same path raise ModelLoadException instead of failing to encode.
+        """
+        if not os.path.exists(source):
+            _LOGGER.info("No hashing encoder saved at %s, encoding the message column" % source)
+            self.model = {"message": self.config.HASHING_VECTOR_LENGTH}
+            return
+        super().load(source)
+        # W2V_MODEL_PATH may still hold a W2V model, whose columns map to gensim models or their files
+        sizes = self.model.values() if isinstance(self.model, dict) else [None]
+        if not all(isinstance(size, numbers.Integral) for size in sizes):
+            self.model = None
+            raise ModelLoadException("%s does not hold a hashing encoder, it was saved by another LOG_ENCODER" % source)
+
+    def _save_native(self, directory):
+        """Write nothing, the header lists the encoded columns."""
+        return {"columns": self.model}
+
+    def _load_native(self, directory, header):
+        """Restore the encoded columns from the header."""
+        self.model = header["columns"]
+
+    def state(self):
+        """Bytes of the encoded columns and hashing settings, which identify the encoding."""
+        return repr((sorted(self.model.items()), self.config.HASHING_NGRAM)).encode()
+
+    def nbytes(self):
+        """Bytes of the model arrays, there are none."""
+        return 0
+
+    def one_vector(self, new_D: object) -> object:
+        """Create a single vector per log, a leading 0 followed by the hashed n-grams of every column.
+
+        Every distinct value of a column is hashed once, missing values are encoded as zeros.
+        """
+        columns = [col for col in self.model.keys() if col in new_D]
+        bounds = np.cumsum([1] + [self.model[col] for col in columns])
+        vectors = np.zeros((len(new_D), bounds[-1]), dtype=self.dtype)
+        for col, start, stop in zip(columns, bounds[:-1], bounds[1:]):
+            codes, words = pandas.factorize(np.asarray(new_D[col], dtype=object))
+            found = codes >= 0
+            vectors[found, start:stop] = self.encode(words, stop - start)[codes[found]]
+        return vectors
+
+    def encode(self, words, size):
+        """Unit vectors of size buckets holding the signed hashes of the character n-grams of words."""
+        # Boundary characters mark the first and last n-grams and give short words at least one n-gram
+        text = np.array(["\x02%s\x03" % word for word in words], dtype=np.str_)
+        lengths = np.char.str_len(text) if len(text) else np.zeros(0, dtype=np.intp)
+        vectors = np.zeros((len(text), size), dtype=self.dtype)
+        order = np.argsort(lengths, kind="stable")
+        for start in range(0, len(order), _BLOCK_SIZE):
+            rows = order[start:start + _BLOCK_SIZE]
+            vectors[rows] = self._hash_block(text[rows], lengths[rows], size)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1)
+
+    def _hash_block(self, text, lengths, size):
+        """Hash every n-gram of a block of words at once and add their signs into the buckets."""
+        ngram = self.config.HASHING_NGRAM
+        text = text.astype("<U%d" % max(lengths.max(), 1))
+        chars = text.view(np.uint32).reshape(len(text), -1).astype(np.uint64)
+        width = chars.shape[1] - ngram + 1
+        if width <= 0:
+            return np.zeros((len(text), size))
+        hashes = np.full((len(text), width), _FNV_OFFSET, dtype=np.uint64)
+        for i in range(ngram):
+            hashes ^= chars[:, i:i + width]
+            hashes *= _FNV_PRIME
+        # Positions past the end of shorter words hash the padding, they are dropped
+        valid = np.arange(width) <= (lengths - ngram)[:, np.newaxis]
+        rows = np.broadcast_to(np.arange(len(text))[:, np.newaxis], hashes.shape)[valid]
+        hashes = hashes[valid]
+        # The low bits pick the bucket and the high bit its sign, so colliding n-grams tend to cancel out
+        buckets = (hashes % np.uint64(size)).astype(np.intp)
+        signs = np.where(hashes >> np.uint64(63), -1.0, 1.0)
+        return np.bincount(rows * size + buckets, weights=signs, minlength=len(text) * size).reshape(len(text), size)
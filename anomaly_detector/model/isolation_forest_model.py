@@ -0,0 +1,58 @@
+"""Isolation forest model."""
+from anomaly_detector.model.base_model import BaseModel
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.ensemble import IsolationForest
+from sklearn.externals import joblib
+import numpy as np
+import os
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+class IsolationForestModel(BaseModel):
+    """Isolation forest over encoded log vectors, logs that are isolated in fewer splits score higher."""
+
+    def __init__(self, config=None):
+        """Construct with configurations for customizations."""
+        super().__init__(config)
+        self.config = config
+        self.epochs = 0
+
+    def train(self, inp, parallelism):
+        """Fit a new forest to the log vectors, trees are built in parallel by parallelism jobs."""
+        forest = IsolationForest(n_jobs=parallelism)
+        if self.config:
+            forest.set_params(n_estimators=self.config.IFOREST_N_ESTIMATORS,
+                              max_samples=min(self.config.IFOREST_MAX_SAMPLES, len(inp)))
+        self.model = forest.fit(inp)
+        # A forest is fit in a single pass over the data
+        self.epochs = 1
+
+    def get_anomaly_score(self, logs, parallelism):
+        """Anomaly score of every log vector, scored in batches of IFOREST_BATCH_SIZE rows by parallelism threads.
+
+        The score is the negated sklearn score_samples, so it grows with how anomalous a log is like SOM distances.
+        """
+        batch_size = self.config.IFOREST_BATCH_SIZE if self.config else DEFAULT_BATCH_SIZE
+        batches = [logs[start:start + batch_size] for start in range(0, len(logs), batch_size)]
+        if parallelism > 1 and len(batches) > 1:
+            # Tree traversal releases the GIL, so threads score batches concurrently without copying the forest
+            with ThreadPoolExecutor(max_workers=parallelism) as executor:
+                scores = list(executor.map(self.model.score_samples, batches))
+        else:
+            scores = [self.model.score_samples(batch) for batch in batches]
+        return -np.concatenate(scores).astype(self.dtype, copy=False)
+
+    def state(self):
+        """Bytes of the split features, thresholds and leaf sizes of every tree, which identify the fitted forest."""
+        return b"".join(tree.tree_.feature.tobytes() + tree.tree_.threshold.tobytes() +
+                        tree.tree_.n_node_samples.tobytes() for tree in self.model.estimators_)
+
+    def _save_native(self, directory):
+        """Write the forest with joblib, its trees are not plain arrays that could be memory mapped."""
+        joblib.dump(self.model, os.path.join(directory, "model.joblib"))
+        return {"files": {"model": "model.joblib"}}
+
+    def _load_native(self, directory, header):
+        """Load the forest written by _save_native."""
+        self.model = joblib.load(os.path.join(directory, header["files"]["model"]))
@@ -0,0 +1,141 @@
+"""k nearest neighbour model over an inverted file (IVF) index of the training vectors."""
+from anomaly_detector.model.base_model import BaseModel
+from anomaly_detector.model.som_scorer import SOMScorer, DEFAULT_BLOCK_SIZE
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import numpy as np
+import os
+
+# Arrays of the index, saved as separate .npy files that are memory mapped on load
+IVF_ARRAYS = ("centroids", "offsets", "vectors", "norms")
+
+
+def kmeans(inp, n_clusters, iterations, block_size=DEFAULT_BLOCK_SIZE, random_state=None):
+    """Lloyd's k-means starting from random rows, empty clusters are reseeded with random rows.
+
+    :return: centroids of shape (n_clusters, dim) and the number of iterations run
+    """
+    rng = np.random.RandomState(random_state)
+    centroids = inp[rng.choice(len(inp), n_clusters, replace=False)].copy()
+    labels = None
+    for iteration in range(1, iterations + 1):
+        previous, (labels, _) = labels, SOMScorer(centroids, block_size).bmu(inp)
+        if previous is not None and np.array_equal(previous, labels):
+            return centroids, iteration
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=n_clusters)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts[filled])[:-1]))
+        centroids[filled] = np.add.reduceat(inp[order], starts, axis=0) / counts[filled, np.newaxis]
+        empty = np.flatnonzero(counts == 0)
+        centroids[empty] = inp[rng.choice(len(inp), len(empty), replace=False)]
+    return centroids, iterations
+
+
+class IVFKNNModel(BaseModel):
+    """Anomaly score of a log is the mean distance to its IVF_K nearest training logs.
+
+    Training vectors are clustered with k-means into IVF_NLIST inverted lists and a query only searches the
+    lists of its IVF_NPROBE closest centroids, so the neighbours found are approximate. The index is always
+    saved in the native format so its vectors are memory mapped on load. Training logs are scored without
+    themselves, every one is in the index and would otherwise count as its own nearest neighbour.
+    """
+
+    def __init__(self, config=None):
+        """Construct with configurations for customizations."""
+        super().__init__(config)
+        self.config = config
+        self.epochs = 0
+
+    def train(self, inp, parallelism):
+        """Cluster the training vectors and build the inverted lists, the k-means sample is taken at random."""
+        inp = np.ascontiguousarray(inp, dtype=self.dtype)
+        nlist = min(self.config.IVF_NLIST, len(inp))
+        sample = inp
+        if len(inp) > self.config.IVF_KMEANS_SAMPLE:
+            sample = inp[np.random.choice(len(inp), self.config.IVF_KMEANS_SAMPLE, replace=False)]
+        centroids, self.epochs = kmeans(sample, nlist, self.config.IVF_KMEANS_ITERATIONS,
+                                        self.config.IVF_BLOCK_SIZE)
+        labels, _ = SOMScorer(centroids, self.config.IVF_BLOCK_SIZE).bmu(inp)
+        counts = np.bincount(labels, minlength=nlist)
+        # Lists left empty by the final assignment are dropped, so every probed list holds a neighbour
+        filled = counts > 0
+        labels = np.cumsum(filled)[labels] - 1
+        vectors = inp[np.argsort(labels, kind="stable")]
+        self.model = {"centroids": centroids[filled], "offsets": np.concatenate(([0], np.cumsum(counts[filled]))),
+                      "vectors": vectors, "norms": np.einsum("ij,ij->i", vectors, vectors)}
+        self.train_dist = self._scores(inp, parallelism, skip=1)
+
+    def get_anomaly_score(self, logs, parallelism):
+        """Mean distance of every log vector to its nearest training vectors, in blocks of IVF_BLOCK_SIZE rows."""
+        return self._scores(logs, parallelism)
+
+    def _scores(self, logs, parallelism, skip=0):
+        """Mean distance of every log vector to its nearest training vectors after the skip closest ones.
+
+        Blocks are searched by parallelism threads, the matrix products release the GIL.
+        """
+        logs = np.atleast_2d(logs).astype(self.dtype, copy=False)
+        block_size = self.config.IVF_BLOCK_SIZE
+        blocks = [logs[start:start + block_size] for start in range(0, len(logs), block_size)]
+        score_block = partial(self._score_block, skip=skip)
+        if parallelism > 1 and len(blocks) > 1:
+            with ThreadPoolExecutor(max_workers=parallelism) as executor:
+                return np.concatenate(list(executor.map(score_block, blocks)))
+        return np.concatenate([score_block(block) for block in blocks])
+
+    def _score_block(self, block, skip=0):
+        """Search the closest lists of every row of block and average the distances to its nearest vectors.
+
+        Rows are grouped by probed list, so every list is matched against all rows probing it with one matrix
+        product. Each list keeps its k closest candidates per row and the k closest among those are averaged,
+        leaving out the skip closest ones.
+        """
+        centroids, offsets = self.model["centroids"], self.model["offsets"]
+        vectors, norms = self.model["vectors"], self.model["norms"]
+        nprobe = min(self.config.IVF_NPROBE, len(centroids))
+        k = min(self.config.IVF_K + skip, len(vectors))
+        # An index of a single vector has no other neighbour to score against
+        skip = min(skip, k - 1)
+        block_sq = np.einsum("ij,ij->i", block, block)
+        centroid_dist = np.einsum("ij,ij->i", centroids, centroids) - 2 * block.dot(centroids.T)
+        probes = np.argpartition(centroid_dist, nprobe - 1, axis=1)[:, :nprobe].ravel()
+
+        nearest = np.full((len(block), nprobe, k), np.inf, dtype=block.dtype)
+        order = np.argsort(probes, kind="stable")
+        starts = np.flatnonzero(np.diff(probes[order], prepend=-1))
+        for start, stop in zip(starts, np.append(starts[1:], len(order))):
+            lst = probes[order[start]]
+            rows, slots = np.divmod(order[start:stop], nprobe)
+            members = slice(offsets[lst], offsets[lst + 1])
+            dist = block_sq[rows, np.newaxis] - 2 * block[rows].dot(vectors[members].T) + norms[members]
+            if dist.shape[1] > k:
+                dist = np.partition(dist, k - 1, axis=1)[:, :k]
+            nearest[rows, slots, :dist.shape[1]] = dist
+
+        nearest = np.partition(nearest.reshape(len(block), -1), k - 1, axis=1)[:, :k]
+        if skip:
+            nearest = np.sort(nearest, axis=1)[:, skip:]
+        # Probed lists holding fewer than k vectors leave inf, those rows average the neighbours found
+        found = np.isfinite(nearest)
+        dist = np.sqrt(np.maximum(np.where(found, nearest, 0), 0))
+        return dist.sum(axis=1) / found.sum(axis=1)
+
+    def state(self):
+        """Bytes of the centroids, list offsets and vector norms, which identify the index."""
+        return b"".join(np.ascontiguousarray(self.model[name]).tobytes() for name in ("centroids", "offsets", "norms"))
+
+    def save(self, dest):
+        """Save the index in the native format whatever MODEL_FORMAT is."""
+        self._save_native_format(dest)
+
+    def _save_native(self, directory):
+        """Write every array of the index into its own .npy file."""
+        for name in IVF_ARRAYS:
+            np.save(os.path.join(directory, "%s.npy" % name), self.model[name])
+        return {"arrays": {name: "%s.npy" % name for name in IVF_ARRAYS}}
+
+    def _load_native(self, directory, header):
+        """Memory map the arrays of the index."""
+        self.model = {name: np.load(os.path.join(directory, path), mmap_mode="r")
+                      for name, path in header["arrays"].items()}
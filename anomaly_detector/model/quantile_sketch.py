@@ -0,0 +1,116 @@
+"""Streaming quantile sketch of anomaly scores."""
+import numpy as np
+
+DEFAULT_COMPRESSION = 100
+
+
+class TDigest:
+    """Mergeable t-digest (Dunning) of a stream of values, accurate in the tails where thresholds sit.
+
+    Values are summarized by weighted centroids whose size is bounded by the arcsine scale function, so
+    centroids near the extreme quantiles stay small. About compression / 2 centroids are kept. The sum and
+    the sum of squares of the values are kept as well, for their exact mean and standard deviation.
+    """
+
+    def __init__(self, compression=DEFAULT_COMPRESSION):
+        """Create an empty digest."""
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+        self.sum = 0.0
+        self.squares = 0.0
+        self._buffer = []
+
+    @property
+    def count(self):
+        """Number of values added to the digest."""
+        return self.weights.sum() + sum(len(values) for values in self._buffer)
+
+    @property
+    def mean(self):
+        """Mean of the values added to the digest."""
+        return self.sum / self.count
+
+    @property
+    def std(self):
+        """Standard deviation of the values added to the digest."""
+        return np.sqrt(max(self.squares / self.count - self.mean ** 2, 0.0))
+
+    def update(self, values):
+        """Add an array of values to the digest."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.sum += values.sum()
+        self.squares += np.dot(values, values)
+        self._buffer.append(values)
+        if sum(len(values) for values in self._buffer) > 10 * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        """Add all values summarized by another digest to this one."""
+        other._compress()
+        self._compress()
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.sum += other.sum
+        self.squares += other.squares
+        self._compress(np.concatenate((self.means, other.means)), np.concatenate((self.weights, other.weights)))
+
+    def scale(self, factor):
+        """Multiply all values added to the digest by a positive factor."""
+        self._compress()
+        self.means = self.means * factor
+        self.min, self.max = self.min * factor, self.max * factor
+        self.sum, self.squares = self.sum * factor, self.squares * factor ** 2
+
+    def quantile(self, q):
+        """Value below which a share q of the values added to the digest fall."""
+        self._compress()
+        if len(self.means) == 0:
+            raise ValueError("Quantile of an empty digest")
+        cumulative = np.cumsum(self.weights)
+        centers = cumulative - self.weights / 2.0
+        return np.interp(q * cumulative[-1], np.concatenate(([0], centers, [cumulative[-1]])),
+                         np.concatenate(([self.min], self.means, [self.max])))
+
+    def to_dict(self):
+        """State of the digest as plain lists, to store in model metadata."""
+        self._compress()
+        return {"compression": self.compression, "means": self.means.tolist(), "weights": self.weights.tolist(),
+                "min": float(self.min), "max": float(self.max), "sum": float(self.sum), "squares": float(self.squares)}
+
+    @classmethod
+    def from_dict(cls, state):
+        """Restore a digest saved with to_dict."""
+        digest = cls(state["compression"])
+        digest.means = np.asarray(state["means"], dtype=np.float64)
+        digest.weights = np.asarray(state["weights"], dtype=np.float64)
+        digest.min = state["min"]
+        digest.max = state["max"]
+        # Digests saved without the sums estimate them from their centroids
+        digest.sum = state.get("sum", float(np.dot(digest.means, digest.weights)))
+        digest.squares = state.get("squares", float(np.dot(digest.means ** 2, digest.weights)))
+        return digest
+
+    def _compress(self, means=None, weights=None):
+        """Merge the buffered values into the centroids, every centroid spans one unit of the scale function."""
+        if means is None:
+            if not self._buffer:
+                return
+            buffered = np.concatenate(self._buffer)
+            self._buffer = []
+            means = np.concatenate((self.means, buffered))
+            weights = np.concatenate((self.weights, np.ones(len(buffered))))
+        order = np.argsort(means, kind="mergesort")
+        means, weights = means[order], weights[order]
+        left = (np.cumsum(weights) - weights) / weights.sum()
+        scale = self.compression / (2 * np.pi) * np.arcsin(2 * left - 1)
+        group = np.floor(scale - scale[0]).astype(np.int64)
+        starts = np.flatnonzero(np.diff(group, prepend=-1))
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
@@ -0,0 +1,107 @@
+"""Cache of anomaly scores per distinct log message."""
+from collections import OrderedDict
+from prometheus_client import Counter
+import numpy as np
+import logging
+import sqlite3
+
+_LOGGER = logging.getLogger(__name__)
+
+SCORE_CACHE_HIT_COUNT = Counter("aiops_lad_score_cache_hit_count", "count of scores found in the cache", ['tier'])
+SCORE_CACHE_MISS_COUNT = Counter("aiops_lad_score_cache_miss_count", "count of scores missing in the cache")
+
+# sqlite limits the number of parameters of a single statement to 999 in older versions
+_SQLITE_CHUNK = 900
+
+
+class ScoreCache:
+    """Bounded LRU cache of scores keyed on the model version and the encoded log message.
+
+    Scores are kept in memory for the most recently seen max_entries messages, with an optional sqlite
+    file behind it that survives restarts. Changing the model version drops every cached score.
+    """
+
+    def __init__(self, max_entries, path=None):
+        """Create an empty cache, path enables the on disk tier."""
+        self.max_entries = max_entries
+        self.version = None
+        self.memory = OrderedDict()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS scores "
+                            "(version TEXT, message TEXT, score REAL, PRIMARY KEY (version, message))")
+            self.db.commit()
+
+    def set_version(self, version):
+        """Switch to a new model version, scores computed with any other version are dropped."""
+        if version == self.version:
+            return
+        _LOGGER.info("Model version changed to %s, clearing score cache" % version)
+        self.version = version
+        self.memory.clear()
+        if self.db is not None:
+            self.db.execute("DELETE FROM scores WHERE version != ?", (version,))
+            self.db.commit()
+
+    def get(self, keys):
+        """Look up the scores of keys, returns the scores with nan for misses and the indices of the misses."""
+        scores = np.full(len(keys), np.nan)
+        missing = []
+        for i, key in enumerate(keys):
+            score = self.memory.get(key)
+            if score is None:
+                missing.append(i)
+            else:
+                self.memory.move_to_end(key)
+                scores[i] = score
+        SCORE_CACHE_HIT_COUNT.labels(tier="memory").inc(len(keys) - len(missing))
+
+        if missing and self.db is not None:
+            found = self._get_disk({keys[i] for i in missing})
+            SCORE_CACHE_HIT_COUNT.labels(tier="disk").inc(sum(keys[i] in found for i in missing))
+            for key, score in found.items():
+                self._put_memory(key, score)
+            for i in missing:
+                scores[i] = found.get(keys[i], np.nan)
+            missing = [i for i in missing if keys[i] not in found]
+
+        SCORE_CACHE_MISS_COUNT.inc(len(missing))
+        return scores, np.array(missing, dtype=np.int64)
+
+    def put(self, keys, scores):
+        """Store the scores of keys for the current model version."""
+        for key, score in zip(keys, scores):
+            self._put_memory(key, float(score))
+        if self.db is not None:
+            self.db.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?)",
+                                ((self.version, key, float(score)) for key, score in zip(keys, scores)))
+            self.db.commit()
+
+    def close(self):
+        """Close the on disk tier."""
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __len__(self):
+        """Number of scores held in memory."""
+        return len(self.memory)
+
+    def _put_memory(self, key, score):
+        """Insert into the memory tier, evicting the least recently used scores above max_entries."""
+        self.memory[key] = score
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _get_disk(self, keys):
+        """Read the scores of keys from the on disk tier."""
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), _SQLITE_CHUNK):
+            chunk = keys[start:start + _SQLITE_CHUNK]
+            rows = self.db.execute("SELECT message, score FROM scores WHERE version = ? AND message IN (%s)"
+                                   % ",".join("?" * len(chunk)), [self.version] + chunk)
+            found.update(rows)
+        return found
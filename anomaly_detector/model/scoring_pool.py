@@ -0,0 +1,168 @@
+"""Long lived worker pool that scores log vectors against a SOM codebook held in shared memory."""
+import logging
+import math
+import types
+import weakref
+from multiprocessing import Pool
+
+import numpy as np
+
+from anomaly_detector.model.som_scorer import build_scorer, DEFAULT_BLOCK_SIZE
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # shared memory segments need python >= 3.8
+    resource_tracker = shared_memory = None
+
+_LOGGER = logging.getLogger(__name__)
+
+# Segments attached by a worker process, keyed by role ("codebook", "input", "output").
+_WORKER_SEGMENTS = {}
+_WORKER_SCORER = {}
+
+
+def _borrow_segment(name):
+    """Attach to a segment owned by the parent process without tracking it for cleanup in the worker."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # python < 3.13 always tracks, untrack by hand so worker exit does not unlink it
+        segment = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+def _worker_array(role, name, shape, dtype):
+    """Attach a worker to a shared memory segment, releasing the previous segment of the same role."""
+    attached = _WORKER_SEGMENTS.get(role)
+    if attached is None or attached.name != name:
+        if attached is not None:
+            attached.close()
+        attached = _borrow_segment(name)
+        _WORKER_SEGMENTS[role] = attached
+    return np.ndarray(shape, dtype=dtype, buffer=attached.buf)
+
+
+def _score_range(task):
+    """Score rows [start, stop) of the shared input buffer and write distances to the shared output buffer."""
+    codebook_spec, input_spec, output_spec, index_config, start, stop = task
+    scorer = _WORKER_SCORER.get(codebook_spec[0])
+    if scorer is None:
+        # Only one codebook is live at a time, drop the scorer of the previous one before detaching from it
+        # so the node norms are computed once per published codebook.
+        _WORKER_SCORER.clear()
+        codebook = _worker_array("codebook", *codebook_spec)
+        scorer = _WORKER_SCORER[codebook_spec[0]] = build_scorer(codebook, index_config)
+    inputs = _worker_array("input", *input_spec)
+    outputs = _worker_array("output", *output_spec)
+    outputs[start:stop] = scorer.min_distance(inputs[start:stop])
+    return stop - start
+
+
+def _release(segments):
+    """Close and unlink shared memory segments owned by the parent process."""
+    for segment in segments:
+        if segment is None:
+            continue
+        segment.close()
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedMemoryScoringPool:
+    """Worker processes kept alive across inference loops which read the codebook from shared memory.
+
+    The codebook is copied into shared memory once per publish() and input vectors are copied into a
+    reusable shared input buffer, so tasks only carry segment names and row ranges instead of pickled
+    arrays or a pickled model.
+    """
+
+    def __init__(self, processes, block_size=DEFAULT_BLOCK_SIZE, config=None):
+        """Start the worker processes.
+
+        :param processes: number of worker processes
+        :param block_size: number of rows each worker matches against the codebook at once
+        :param config: configuration whose SOM_INDEX settings select the nearest node search of the workers
+        """
+        if shared_memory is None:
+            raise RuntimeError("Shared memory scoring pool requires python 3.8 or newer")
+        self.processes = processes
+        self.block_size = block_size
+        # Only the index settings are sent to the workers, build_scorer reads nothing else
+        self.index_config = types.SimpleNamespace(
+            SOM_INDEX=config.SOM_INDEX if config else "", SOM_BLOCK_SIZE=block_size,
+            SOM_COARSE_REGION_SIZE=config.SOM_COARSE_REGION_SIZE if config else None,
+            SOM_COARSE_TOP_K=config.SOM_COARSE_TOP_K if config else None)
+        self.pool = Pool(processes)
+        self._codebook = None
+        self._codebook_spec = None
+        self._input = None
+        self._output = None
+        self._capacity = (0, 0, None)
+        self._finalizer = weakref.finalize(self, SharedMemoryScoringPool._shutdown, self.pool, self._segments)
+
+    @property
+    def _segments(self):
+        """Shared memory segments currently owned by this pool."""
+        return [self._codebook, self._input, self._output]
+
+    @staticmethod
+    def _shutdown(pool, segments):
+        """Stop the workers and free the shared memory, also called when the pool is garbage collected."""
+        pool.terminate()
+        pool.join()
+        _release(segments)
+
+    def publish(self, codebook):
+        """Copy a new codebook into shared memory, the workers switch to it on their next task."""
+        # The map keeps its grid shape, hierarchical search groups neighbouring nodes
+        codebook = np.ascontiguousarray(codebook)
+        segment = shared_memory.SharedMemory(create=True, size=max(codebook.nbytes, 1))
+        np.ndarray(codebook.shape, dtype=codebook.dtype, buffer=segment.buf)[:] = codebook
+        _release([self._codebook])
+        self._codebook = segment
+        self._codebook_spec = (segment.name, codebook.shape, codebook.dtype.str)
+        self._update_finalizer()
+        _LOGGER.info("Published SOM codebook %s to scoring pool" % str(codebook.shape))
+
+    def score(self, logs):
+        """Distance from every row of logs to its best matching unit of the published codebook."""
+        if self._codebook is None:
+            raise RuntimeError("No codebook has been published to the scoring pool")
+        logs = np.asarray(logs, dtype=np.dtype(self._codebook_spec[2]))
+        rows = logs.shape[0]
+        if rows == 0:
+            return np.empty(0, dtype=logs.dtype)
+        self._reserve(rows, logs.shape[1], logs.dtype)
+        capacity = self._capacity[0]
+        np.ndarray((capacity, logs.shape[1]), dtype=logs.dtype, buffer=self._input.buf)[:rows] = logs
+
+        input_spec = (self._input.name, (capacity, logs.shape[1]), logs.dtype.str)
+        output_spec = (self._output.name, (capacity,), logs.dtype.str)
+        chunk = max(self.block_size, int(math.ceil(rows / self.processes)))
+        tasks = [(self._codebook_spec, input_spec, output_spec, self.index_config, start, min(start + chunk, rows))
+                 for start in range(0, rows, chunk)]
+        self.pool.map(_score_range, tasks)
+        return np.ndarray((capacity,), dtype=logs.dtype, buffer=self._output.buf)[:rows].copy()
+
+    def _reserve(self, rows, dim, dtype):
+        """Make sure the shared input and output buffers can hold rows vectors, growing them if needed."""
+        capacity, current_dim, current_dtype = self._capacity
+        if rows <= capacity and dim == current_dim and dtype == current_dtype:
+            return
+        capacity = max(rows, 2 * capacity if dim == current_dim and dtype == current_dtype else 0)
+        _release([self._input, self._output])
+        self._input = shared_memory.SharedMemory(create=True, size=capacity * dim * dtype.itemsize)
+        self._output = shared_memory.SharedMemory(create=True, size=capacity * dtype.itemsize)
+        self._capacity = (capacity, dim, dtype)
+        self._update_finalizer()
+
+    def _update_finalizer(self):
+        """Point the garbage collection hook at the segments currently owned by the pool."""
+        self._finalizer.detach()
+        self._finalizer = weakref.finalize(self, SharedMemoryScoringPool._shutdown, self.pool, self._segments)
+
+    def close(self):
+        """Stop the workers and free the shared memory."""
+        self._finalizer()
@@ -1,28 +1,274 @@
 """SOM model."""
 
 from anomaly_detector.model.base_model import BaseModel
-from matplotlib import pyplot as plt
-import os
+from anomaly_detector.model.som_scorer import SOMScorer, DEFAULT_BLOCK_SIZE, build_scorer
+from anomaly_detector.model.umatrix import render_u_matrix, u_matrix
 import numpy as np
 import logging
-import matplotlib
-
-matplotlib.use("agg")
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def batch_train(model, inp, radii, block_size, callback=None):
+    """Batch SOM training, every epoch moves each node to the neighborhood weighted mean of the inputs.
+
+    All inputs are first assigned to their BMU, then the per node sums and counts are smoothed over the
+    map with a gaussian of the grid distance, one epoch per radius in radii.
+
+    :param model: SOM codebook of shape (rows, cols, dim), updated in place
+    :param inp: training vectors
+    :param radii: neighborhood radius of every epoch
+    :param block_size: number of rows matched against the codebook at once
+    :param callback: called with the codebook after every epoch, training stops when it returns True
+    :return: the trained codebook, and the BMU and its distance of every input in the last epoch
+    """
+    rows, cols, dim = model.shape
+    grid = np.indices((rows, cols)).reshape(2, -1).T
+    grid_sq_dist = ((grid[:, np.newaxis, :] - grid[np.newaxis, :, :]) ** 2).sum(axis=2)
+    codebook = model.reshape(rows * cols, dim)
+
+    for epoch, radius in enumerate(radii):
+        bmu, dist = SOMScorer(codebook, block_size).bmu(inp)
+        _LOGGER.info("SOM batch training epoch %d/%d, quantization error %f"
+                     % (epoch, len(radii), np.mean(np.sqrt(dist))))
+        counts = np.bincount(bmu, minlength=rows * cols)
+        # Per node sums of the assigned inputs, one bincount over (node, feature) pairs
+        sums = np.bincount((bmu[:, np.newaxis] * dim + np.arange(dim)).ravel(), weights=inp.ravel(),
+                           minlength=rows * cols * dim).reshape(rows * cols, dim)
+        neighborhood = np.exp(-1.0 * grid_sq_dist / (2.0 * radius ** 2))
+        numerator = neighborhood.dot(sums)
+        denominator = neighborhood.dot(counts)
+        updated = denominator > 0
+        codebook[updated] = numerator[updated] / denominator[updated, np.newaxis]
+        if callback is not None and callback(model):
+            break
+
+    return codebook.reshape(rows, cols, dim), bmu, np.sqrt(dist)
+
+
+def assignment_distances(model, inp, bmu):
+    """Euclidean distance of every row of inp to the node of the codebook model it was assigned to."""
+    diff = inp - model.reshape(-1, model.shape[-1])[bmu]
+    return np.sqrt(np.einsum("ij,ij->i", diff, diff))
+
+
+def warm_start_radii(shape, rough_len, finetune_len):
+    """Neighborhood radii for continuing training of an already organized map.
+
+    A trained map is treated like a PCA initialized one, so this follows the shorter SOMPY schedule for
+    PCA initialization: a rough phase shrinking from 1/8 of the map size and a fine tuning phase ending at 1.
+    """
+    map_len = max(shape[0], shape[1])
+    rough_in = max(1.0, np.ceil(map_len / 8.0))
+    finetune_in = max(1.0, rough_in / 4.0)
+    return np.concatenate((np.linspace(rough_in, max(1.0, rough_in / 4.0), rough_len),
+                           np.linspace(finetune_in, 1.0, finetune_len)))
+
+
+def map_errors(model, inp):
+    """Quantization and topographic error of the SOM codebook model on the vectors inp.
+
+    The quantization error is the mean distance of the vectors to their BMU, the topographic error is the
+    share of vectors whose first and second BMU are not neighbours on the map.
+    """
+    rows, cols, dim = model.shape
+    codebook = model.reshape(rows * cols, dim)
+    dist = (np.einsum("ij,ij->i", inp, inp)[:, np.newaxis] - 2 * inp.dot(codebook.T) +
+            np.einsum("ij,ij->i", codebook, codebook)[np.newaxis, :])
+    if rows * cols > 1:
+        nearest = np.argpartition(dist, 1, axis=1)[:, :2]
+    else:
+        nearest = np.zeros((len(inp), 2), dtype=np.int64)
+    quantization = np.mean(np.sqrt(np.maximum(dist[np.arange(len(inp)), nearest[:, 0]], 0)))
+    first = np.stack(np.unravel_index(nearest[:, 0], (rows, cols)), axis=1)
+    second = np.stack(np.unravel_index(nearest[:, 1], (rows, cols)), axis=1)
+    topographic = np.mean(np.abs(first - second).max(axis=1) > 1)
+    return quantization, topographic
+
+
+def hold_out(inp, size):
+    """Split size random rows off inp to evaluate training on, small inputs are evaluated on themselves.
+
+    Returns the rows of inp to train on and the rows held out, as index arrays or slices.
+    """
+    if size <= 0 or len(inp) < 2 * size:
+        return slice(None), slice(None)
+    rows = np.random.permutation(len(inp))
+    return rows[size:], rows[:size]
+
+
+class EarlyStopping:
+    """Stop SOM training once the quantization error on held out vectors stops improving.
+
+    Called with the codebook after every epoch, returns True when the relative improvement of the quantization
+    error stayed below tolerance for patience evaluations in a row. epochs counts the evaluations.
+    """
+
+    def __init__(self, held_out, tolerance, patience):
+        """Evaluate on held_out vectors."""
+        self.held_out = held_out
+        self.tolerance = tolerance
+        self.patience = patience
+        self.epochs = 0
+        self.best = np.inf
+        self.stalled = 0
+
+    def __call__(self, model):
+        """Evaluate the codebook after an epoch and tell whether to stop training."""
+        self.epochs += 1
+        quantization, topographic = map_errors(model, self.held_out)
+        _LOGGER.info("SOM epoch %d held out quantization error %f, topographic error %f"
+                     % (self.epochs, quantization, topographic))
+        if self.best - quantization > self.tolerance * self.best:
+            self.stalled = 0
+        else:
+            self.stalled += 1
+        self.best = min(self.best, quantization)
+        if self.stalled >= self.patience:
+            _LOGGER.info("SOM training converged after %d epochs" % self.epochs)
+            return True
+        return False
+
+    @classmethod
+    def from_config(cls, inp, config):
+        """Split the held out vectors off inp, returns the training row numbers and the early stopping."""
+        if not config or not config.SOM_EARLY_STOPPING:
+            return slice(None), None
+        train, held_out = hold_out(inp, config.SOM_EARLY_STOPPING_SAMPLE)
+        return train, cls(inp[held_out], config.SOM_EARLY_STOPPING_TOLERANCE, config.SOM_EARLY_STOPPING_PATIENCE)
+
+
+def online_update(model, inp, rates):
+    """Apply one online SOM step per input vector, in order, with the learning rate of that step.
+
+    :param model: SOM codebook of shape (rows, cols, dim), updated in place
+    :param inp: vectors to learn from
+    :param rates: learning rate of every step, already decayed
+    :return: the updated codebook
+    """
+    rows, cols = model.shape[0:2]
+    kernel = SOMModel.neighborhood_kernel(rows, cols)
+    for current_vector, rate in zip(inp, rates):
+        diff = current_vector - model
+        bmu_loc = np.unravel_index(np.argmin(np.einsum("ijk,ijk->ij", diff, diff)), (rows, cols))
+        window = kernel[rows - 1 - bmu_loc[0]:2 * rows - 1 - bmu_loc[0],
+                        cols - 1 - bmu_loc[1]:2 * cols - 1 - bmu_loc[1]]
+        model += (rate * window)[:, :, np.newaxis] * diff
+    return model
+
+
 class SOMModel(BaseModel):
     """Self-Organizing Map model implementation."""
 
+    def __init__(self, config=None):
+        """Construct with configurations for customizations."""
+        super().__init__(config)
+        self._scorer = None
+        self.epochs = 0
+
     def train(self, inp, map_size, iterations, parallelism):
         """Train the SOM model."""
         if self.model is None:
-            # Generate a 24x24 node feature of color data
+            # Generate a map_size x map_size node feature of color data
             self.model = np.random.rand(map_size, map_size, inp.shape[1])
+        if not self.model.flags.writeable:
+            # Memory mapped models are read only, train on a private copy
+            self.model = np.array(self.model)
+        self.model = self.model.astype(self.dtype, copy=False)
+        inp = inp.astype(self.dtype, copy=False)
+        rows, early_stopping = EarlyStopping.from_config(inp, self.config)
+        self.train_dist = np.full(len(inp), np.nan)
+
+        if self.config and self.config.SOM_TRAIN_MODE == "batch":
+            self.epochs, self.train_dist[rows] = self._train_batch(inp[rows], self.config.SOM_BATCH_EPOCHS,
+                                                                   self._block_size(), early_stopping)
+        else:
+            self.epochs, self.train_dist[rows] = self._train_online(inp[rows], iterations, early_stopping)
+        self._scorer = build_scorer(self.model, self.config)
+
+    def _block_size(self):
+        """Number of rows matched against the codebook at once."""
+        if not self.config:
+            return DEFAULT_BLOCK_SIZE
+        return self.config.SOM_BLOCK_SIZE
+
+    def load(self, source):
+        """Load a model from disk and build its codebook scorer, models saved in another precision are converted."""
+        super().load(source)
+        self.model = self.model.astype(self.dtype, copy=False)
+        self._get_scorer()
+
+    def _get_scorer(self):
+        """Build the codebook scorer once per trained or loaded model."""
+        if self._scorer is None or self._scorer.source is not self.model:
+            self._scorer = build_scorer(self.model, self.config)
+        return self._scorer
+
+    def _train_batch(self, inp, epochs, block_size, early_stopping=None):
+        """Batch training with a neighborhood radius shrinking from half the map size down to 1.
+
+        Returns the number of epochs trained and the BMU distance of every input in the last epoch.
+        """
+        rows, cols = self.model.shape[0:2]
+        radii = np.linspace(max(1.0, max(rows, cols) / 2.0), 1.0, max(epochs, 1))[:epochs]
+        self.model, _, dist = batch_train(self.model, inp, radii, block_size, early_stopping)
+        return (early_stopping.epochs if early_stopping else len(radii)), dist
+
+    def train_warm(self, inp, rough_len, finetune_len, parallelism):
+        """Continue training the current map on new data with a short batch schedule."""
+        self.model = np.array(self.model, dtype=self.dtype)
+        inp = inp.astype(self.dtype, copy=False)
+        self.model, _, self.train_dist = batch_train(self.model, inp,
+                                                     warm_start_radii(self.model.shape, rough_len, finetune_len),
+                                                     self._block_size())
+        self.epochs = rough_len + finetune_len
+        self._scorer = build_scorer(self.model, self.config)
+
+    def update_online(self, inp, rates):
+        """Learn from inference vectors between retrains with one decayed online step per vector."""
+        self.model = online_update(np.array(self.model, dtype=self.dtype), inp.astype(self.dtype, copy=False), rates)
+        self._scorer = build_scorer(self.model, self.config)
+
+    def _train_online(self, inp, iterations, early_stopping=None):
+        """Online training with one BMU search and one neighbourhood update per sample, both vectorized.
+
+        With early stopping the map is evaluated every tenth of the iterations. Returns the number of iterations
+        and the BMU distance of every input when it was last drawn, NaN for inputs never drawn.
+        """
+        rows, cols = self.model.shape[0:2]
+        kernel = self.neighborhood_kernel(rows, cols)
+        log_step = max(1, int(iterations / 10))
+        dist = np.full(len(inp), np.nan)
+
+        for iters in range(iterations):
+            if not iters % log_step:
+                _LOGGER.info("SOM training iteration %d/%d" % (iters, iterations))
+            rand_num = np.random.randint(inp.shape[0])
+            # Select a Random Document Vector From the training data
+            current_vector = inp[rand_num, :]
+
+            # Squared Euclidian Distance from every node to find best matching unit (BMU)
+            diff = current_vector - self.model
+            sq_dist = np.einsum("ijk,ijk->ij", diff, diff)
+            bmu_loc = np.unravel_index(np.argmin(sq_dist), (rows, cols))
+            dist[rand_num] = np.sqrt(sq_dist[bmu_loc])
+
+            # Update BMU and Neighbours in the map by slicing the kernel around the BMU
+            window = kernel[rows - 1 - bmu_loc[0]:2 * rows - 1 - bmu_loc[0],
+                            cols - 1 - bmu_loc[1]:2 * cols - 1 - bmu_loc[1]]
+            self.model += (self.alph(iterations, iters) * window)[:, :, np.newaxis] * diff
+
+            if early_stopping is not None and not (iters + 1) % log_step and early_stopping(self.model):
+                return iters + 1, dist
+        return iterations, dist
+
+    def _train_loop(self, inp, iterations):
+        """Train node by node in pure python, kept as the reference implementation of _train_online."""
+        rows, cols = self.model.shape[0:2]
+        log_step = max(1, int(iterations / 10))
 
         for iters in range(iterations):
-            if not iters % int(iterations / 10):
+            if not iters % log_step:
                 _LOGGER.info("SOM training iteration %d/%d" % (iters, iterations))
             rand_num = np.random.randint(inp.shape[0])
             # Select a Random Document Vector From the training data
@@ -33,19 +279,19 @@ class SOMModel(BaseModel):
             bmu = np.inf
             bmu_loc = (0, 0)
 
-            for i in range(self.model.shape[0]):
-                for j in range(self.model.shape[1]):
+            for i in range(rows):
+                for j in range(cols):
                     dist = np.linalg.norm(current_vector - self.model[i][j])
                     if dist < bmu:
                         bmu = dist
                         bmu_loc = (i, j)
 
             # Update BMU and Neighbours in the map:
-            for x in range(-12, 12):
-                for y in range(-12, 12):
+            for x in range(-(rows // 2), rows // 2):
+                for y in range(-(cols // 2), cols // 2):
                     current_x = bmu_loc[0] + x
                     current_y = bmu_loc[1] + y
-                    if 0 <= current_x < 24 and 0 <= current_y < 24:
+                    if 0 <= current_x < rows and 0 <= current_y < cols:
                         self.model[current_x][current_y] = self.model[current_x][current_y] + (
                             self.alph(iterations, iters)
                         ) * self.neihborhood(np.array(bmu_loc), np.array([current_x, current_y])) * (
@@ -53,38 +299,17 @@ class SOMModel(BaseModel):
                         )
 
     def save_visualisation(self, dest):
-        """Create and save a png image of the SOM."""
+        """Create and save a png image of the U-matrix of the SOM."""
         # Since Data is no longer representable in 2 or 3 dimensions we will display a matrix
         # of distances from adjecent vectors
-        new = np.zeros((24, 24))
-
-        for x in range(self.model.shape[0]):
-            for y in range(self.model.shape[1]):
-                spot = self.model[x][y]
-                try:
-                    for i in range(-1, 2):
-                        for j in range(-1, 2):
-                            new[x][y] += np.linalg.norm(spot - self.model[x + i][y + j])
-                except IndexError:
-                    pass
-
-        fig = plt.figure()
-        ax = fig.add_subplot(111)
-        cax = ax.matshow(new, interpolation="nearest")
-        fig.colorbar(cax)
-        fig.savefig(os.path.join(dest, "U-map.png"))
+        return render_u_matrix(u_matrix(self.model), dest)
 
     def get_anomaly_score(self, log, parallelism):
-        """Compute a distance of a log entry to elements of SOM."""
+        """Compute a distance of a log entry, or of every row of a matrix of log entries, to elements of SOM."""
         # convert log into vector using same word2vec model (here just going to grab from existing)
-        dist_smallest = np.inf
-        for x in range(self.model.shape[0]):
-            for y in range(self.model.shape[1]):
-                # cosine(som[x][y],log)#np.linalg.norm(som[x][y]-log)
-                dist = np.linalg.norm(self.model[x][y] - log)
-                if dist < dist_smallest:
-                    dist_smallest = dist
-
+        dist_smallest = self._get_scorer().min_distance(np.atleast_2d(log))
+        if np.ndim(log) == 1:
+            return dist_smallest[0]
         return dist_smallest
 
     # TODO: make method private
@@ -102,3 +327,18 @@ class SOMModel(BaseModel):
         """Neighborhood function, dictates the maganitude of the update as we move away from the BMU."""
         dist = np.linalg.norm(bmu_location - node_location)
         return np.exp(-1.0 * (dist / 2))
+
+    @classmethod
+    def neighborhood_kernel(cls, rows, cols):
+        """Precompute the neighborhood function for every grid offset within the update window.
+
+        The kernel has shape (2 * rows - 1, 2 * cols - 1) and is centered on the BMU, so the slice
+        [rows - 1 - i:2 * rows - 1 - i, cols - 1 - j:2 * cols - 1 - j] gives the weights of all nodes
+        for a BMU located at (i, j). Offsets outside of [-size // 2, size // 2) are not updated.
+        """
+        off_x = np.arange(-(rows - 1), rows)
+        off_y = np.arange(-(cols - 1), cols)
+        kernel = np.exp(-1.0 * (np.hypot(off_x[:, np.newaxis], off_y[np.newaxis, :]) / 2))
+        in_window_x = (off_x >= -(rows // 2)) & (off_x < rows // 2)
+        in_window_y = (off_y >= -(cols // 2)) & (off_y < cols // 2)
+        return kernel * (in_window_x[:, np.newaxis] & in_window_y[np.newaxis, :])
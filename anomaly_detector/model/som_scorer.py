@@ -0,0 +1,147 @@
+"""Nearest node search over a SOM codebook."""
+import math
+
+import numpy as np
+from sklearn.neighbors import BallTree, KDTree
+
+DEFAULT_BLOCK_SIZE = 4096
+
+
+class SOMScorer:
+    """Match log vectors against every node of a SOM codebook, one block of rows at a time."""
+
+    def __init__(self, codebook, block_size=DEFAULT_BLOCK_SIZE):
+        """Flatten the codebook and cache the squared norms of its nodes.
+
+        :param codebook: SOM codebook of shape (rows, cols, dim) or (nodes, dim)
+        :param block_size: number of input rows matched against the codebook at once
+        """
+        self.source = codebook
+        self.codebook = codebook.reshape(-1, codebook.shape[-1])
+        self.codebook_sq = np.einsum("ij,ij->i", self.codebook, self.codebook)
+        self.block_size = max(1, int(block_size))
+
+    def bmu(self, inp):
+        """Find the best matching unit and its squared distance for every row of inp.
+
+        Distances are expanded as ||x||^2 - 2x.c + ||c||^2 so each block of rows is matched against the
+        whole codebook with a single matrix product. The squared distance to the selected node is then
+        recomputed as a per row dot product, which avoids the cancellation error of the expansion and
+        matches np.linalg.norm of the difference.
+        """
+        bmu = np.empty(inp.shape[0], dtype=np.int64)
+        dist = np.empty(inp.shape[0], dtype=self.codebook.dtype)
+        for start in range(0, inp.shape[0], self.block_size):
+            stop = start + self.block_size
+            block = inp[start:stop]
+            # ||x||^2 is the same for every node of a row so it does not change the argmin
+            bmu[start:stop] = np.argmin(self.codebook_sq - 2 * block.dot(self.codebook.T), axis=1)
+            diff = block - self.codebook[bmu[start:stop]]
+            dist[start:stop] = np.matmul(diff[:, np.newaxis, :], diff[:, :, np.newaxis]).ravel()
+        return bmu, dist
+
+    def min_distance(self, inp):
+        """Euclidean distance from every row of inp to its best matching unit."""
+        _, dist = self.bmu(inp)
+        return np.sqrt(dist)
+
+
+class CodebookIndex(SOMScorer):
+    """KD-tree or ball tree over the flattened SOM codebook for sub-linear best matching unit lookup."""
+
+    ALGORITHMS = {"kd_tree": KDTree, "ball_tree": BallTree}
+
+    def __init__(self, codebook, algorithm="kd_tree", block_size=DEFAULT_BLOCK_SIZE, leaf_size=16):
+        """Build the tree over the nodes of the codebook.
+
+        :param codebook: SOM codebook of shape (rows, cols, dim) or (nodes, dim)
+        :param algorithm: either "kd_tree" or "ball_tree"
+        :param block_size: number of input rows queried at once
+        :param leaf_size: number of nodes below which the tree switches to a linear scan
+        """
+        super().__init__(codebook, block_size)
+        self.tree = self.ALGORITHMS[algorithm](self.codebook, leaf_size=leaf_size)
+
+    def bmu(self, inp):
+        """Find the best matching unit and its squared distance for every row of inp with a tree query."""
+        bmu = np.empty(inp.shape[0], dtype=np.int64)
+        dist = np.empty(inp.shape[0], dtype=self.codebook.dtype)
+        for start in range(0, inp.shape[0], self.block_size):
+            stop = start + self.block_size
+            block = inp[start:stop]
+            bmu[start:stop] = self.tree.query(block, k=1, return_distance=False)[:, 0]
+            diff = block - self.codebook[bmu[start:stop]]
+            dist[start:stop] = np.matmul(diff[:, np.newaxis, :], diff[:, :, np.newaxis]).ravel()
+        return bmu, dist
+
+
+class HierarchicalScorer(SOMScorer):
+    """Approximate coarse to fine search, the fine search only looks inside the closest coarse regions.
+
+    The map is cut into square regions of region_size x region_size neighbouring nodes and every region
+    is summarised by the mean of its nodes. A query is first matched against these coarse nodes and then
+    against the nodes of its top_k closest regions only. As neighbouring SOM nodes are similar, the best
+    matching unit is usually inside one of the closest regions.
+    """
+
+    def __init__(self, codebook, region_size=4, top_k=3, block_size=DEFAULT_BLOCK_SIZE):
+        """Build the coarse map.
+
+        :param codebook: SOM codebook of shape (rows, cols, dim)
+        :param region_size: side of the square block of fine nodes summarised by one coarse node
+        :param top_k: number of closest coarse regions searched exhaustively
+        :param block_size: number of input rows matched at once
+        """
+        if codebook.ndim != 3:
+            raise ValueError("Hierarchical search needs a (rows, cols, dim) codebook")
+        super().__init__(codebook, block_size)
+        rows, cols = codebook.shape[0:2]
+        region_rows, region_cols = int(math.ceil(rows / region_size)), int(math.ceil(cols / region_size))
+        grid_x, grid_y = np.indices((rows, cols))
+        region = ((grid_x // region_size) * region_cols + grid_y // region_size).ravel()
+        n_regions = region_rows * region_cols
+
+        counts = np.bincount(region, minlength=n_regions)
+        coarse = np.zeros((n_regions, self.codebook.shape[1]), dtype=self.codebook.dtype)
+        np.add.at(coarse, region, self.codebook)
+        self.coarse = SOMScorer(coarse / counts[:, np.newaxis], block_size)
+        self.top_k = max(1, min(int(top_k), n_regions))
+
+        # Nodes of every region, regions on the map border are padded with their own last node
+        order = np.argsort(region, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        slot = np.minimum(np.arange(region_size * region_size)[np.newaxis, :], counts[:, np.newaxis] - 1)
+        self.members = order[starts[:, np.newaxis] + slot]
+
+    def bmu(self, inp):
+        """Find an approximate best matching unit and its squared distance for every row of inp."""
+        bmu = np.empty(inp.shape[0], dtype=np.int64)
+        dist = np.empty(inp.shape[0], dtype=self.codebook.dtype)
+        for start in range(0, inp.shape[0], self.block_size):
+            stop = start + self.block_size
+            block = inp[start:stop]
+            coarse_dist = self.coarse.codebook_sq - 2 * block.dot(self.coarse.codebook.T)
+            if self.top_k < coarse_dist.shape[1]:
+                regions = np.argpartition(coarse_dist, self.top_k - 1, axis=1)[:, :self.top_k]
+            else:
+                regions = np.broadcast_to(np.arange(coarse_dist.shape[1]), coarse_dist.shape)
+            candidates = self.members[regions].reshape(block.shape[0], -1)
+            fine_dist = self.codebook_sq[candidates] - 2 * np.einsum("ij,ikj->ik", block, self.codebook[candidates])
+            bmu[start:stop] = candidates[np.arange(block.shape[0]), np.argmin(fine_dist, axis=1)]
+            diff = block - self.codebook[bmu[start:stop]]
+            dist[start:stop] = np.matmul(diff[:, np.newaxis, :], diff[:, :, np.newaxis]).ravel()
+        return bmu, dist
+
+
+def build_scorer(codebook, config=None):
+    """Create the nearest node search selected by SOM_INDEX for a codebook."""
+    if not config:
+        return SOMScorer(codebook)
+    if not config.SOM_INDEX:
+        return SOMScorer(codebook, config.SOM_BLOCK_SIZE)
+    if config.SOM_INDEX in CodebookIndex.ALGORITHMS:
+        return CodebookIndex(codebook, config.SOM_INDEX, config.SOM_BLOCK_SIZE)
+    if config.SOM_INDEX == "hierarchical":
+        return HierarchicalScorer(codebook, config.SOM_COARSE_REGION_SIZE, config.SOM_COARSE_TOP_K,
+                                  config.SOM_BLOCK_SIZE)
+    raise ValueError("Unsupported SOM_INDEX used {}".format(config.SOM_INDEX))
@@ -1,13 +1,32 @@
 """SOMPY model."""
 from anomaly_detector.model.base_model import BaseModel
+from anomaly_detector.model.som_model import batch_train, online_update, warm_start_radii, assignment_distances, \
+    EarlyStopping
+from anomaly_detector.model.som_scorer import build_scorer, DEFAULT_BLOCK_SIZE
+from anomaly_detector.model.umatrix import render_u_matrix, u_matrix
 import numpy as np
 import logging
 import sompy
-from multiprocessing import Pool
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def sompy_radii(map_size, initialization, rough_len, finetune_len):
+    """Neighborhood radii of every epoch of the SOMPY rough and fine tuning schedule for its initialization."""
+    if initialization == "pca":
+        rough_in = max(1.0, np.ceil(map_size / 8.0))
+        rough_fin = max(1.0, rough_in / 4.0)
+        finetune_in = max(1.0, rough_in / 4.0)
+        finetune_fin = 1.0
+    else:
+        rough_in = max(1.0, np.ceil(map_size / 3.0))
+        rough_fin = max(1.0, rough_in / 6.0)
+        finetune_in = max(1.0, map_size / 12.0)
+        finetune_fin = max(1.0, finetune_in / 25.0)
+    return np.concatenate((np.linspace(rough_in, rough_fin, rough_len),
+                           np.linspace(finetune_in, finetune_fin, finetune_len)))
+
+
 class SOMPYModel(BaseModel):
     """SOMPY alternative SOM implementation with parallelization."""
 
@@ -15,26 +34,98 @@ class SOMPYModel(BaseModel):
         """Construct with configurations for customizations."""
         super().__init__(config)
         self.config = config
+        self._scorer = None
+        self.epochs = 0
 
     def train(self, inp, map_size, iterations, parallelism):
-        """Train the SOM model."""
+        """Train the SOM model, the distances of the training vectors come from the last BMU assignment of SOMPY.
+
+        SOMPY trains on the vectors it normalized, the codebook is mapped back to the space logs are scored in.
+        """
         mapsize = [map_size, map_size]
         som = sompy.SOMFactory.build(inp, mapsize, initialization=self.config.SOMPY_INIT)
+        if self.config and self.config.SOM_EARLY_STOPPING:
+            self._train_early_stopping(som, map_size, inp)
+            return
         if not self.config:
             som.train(n_job=parallelism)
         else:
             som.train(n_job=parallelism, train_rough_len=self.config.SOMPY_TRAIN_ROUGH_LEN,
                       train_finetune_len=self.config.SOMPY_TRAIN_FINETUNE_LEN)
             # train_rough_len=100,train_finetune_len=5
-        self.model = som.codebook.matrix.reshape([map_size, map_size, inp.shape[1]])
+            self.epochs = self.config.SOMPY_TRAIN_ROUGH_LEN + self.config.SOMPY_TRAIN_FINETUNE_LEN
+        codebook = self._denormalized(som, som.codebook.matrix)
+        self.model = codebook.reshape([map_size, map_size, inp.shape[1]]).astype(self.dtype, copy=False)
+        self.train_dist = assignment_distances(self.model, inp, som._bmu[0].astype(np.intp))
+        self._scorer = build_scorer(self.model, self.config)
+
+    def _train_early_stopping(self, som, map_size, inp):
+        """Replay the SOMPY batch schedule epoch by epoch and stop once the held out quantization error converged.
+
+        SOMPY only initializes the codebook here, on the data it normalized, and the epochs run with batch_train.
+        As in train, the trained codebook is mapped back to the space of the raw vectors.
+        """
+        data = som._data.astype(self.dtype)
+        if self.config.SOMPY_INIT == "pca":
+            som.codebook.pca_linear_initialization(som._data)
+        else:
+            som.codebook.random_initialization(som._data)
+        self.model = som.codebook.matrix.reshape([map_size, map_size, data.shape[1]]).astype(self.dtype)
+        rows, early_stopping = EarlyStopping.from_config(data, self.config)
+        radii = sompy_radii(map_size, self.config.SOMPY_INIT, self.config.SOMPY_TRAIN_ROUGH_LEN,
+                            self.config.SOMPY_TRAIN_FINETUNE_LEN)
+        codebook, bmu, _ = batch_train(self.model, data[rows], radii, self.config.SOM_BLOCK_SIZE, early_stopping)
+        codebook = self._denormalized(som, codebook.reshape(-1, data.shape[1]))
+        self.model = codebook.reshape([map_size, map_size, data.shape[1]]).astype(self.dtype, copy=False)
+        self.epochs = early_stopping.epochs
+        self.train_dist = np.full(len(inp), np.nan)
+        self.train_dist[rows] = assignment_distances(self.model, inp[rows], bmu)
+        self._scorer = build_scorer(self.model, self.config)
+
+    @staticmethod
+    def _denormalized(som, codebook):
+        """Codebook rows trained on the normalized vectors of som, in the space of the raw vectors."""
+        if som._normalizer is None:
+            return codebook
+        return som._normalizer.denormalize_by(som.data_raw, codebook)
+
+    def train_warm(self, inp, rough_len, finetune_len, parallelism):
+        """Continue training the current map on new data with a short batch schedule instead of rebuilding it.
+
+        Like update_online, the map is trained on the vectors as they are, which is the space logs are scored in.
+        """
+        inp = inp.astype(self.dtype, copy=False)
+        block_size = self.config.SOM_BLOCK_SIZE if self.config else DEFAULT_BLOCK_SIZE
+        self.model, _, self.train_dist = batch_train(np.array(self.model, dtype=self.dtype), inp,
+                                                     warm_start_radii(self.model.shape, rough_len, finetune_len),
+                                                     block_size)
+        self.epochs = rough_len + finetune_len
+        self._scorer = build_scorer(self.model, self.config)
+
+    def update_online(self, inp, rates):
+        """Learn from inference vectors between retrains with one decayed online step per vector."""
+        self.model = online_update(np.array(self.model, dtype=self.dtype), inp.astype(self.dtype, copy=False), rates)
+        self._scorer = build_scorer(self.model, self.config)
 
     def get_anomaly_score(self, logs, parallelism):
         """Get Anomaly Score."""
-        pool = Pool(parallelism)
-        dist = pool.map(self.calculate_anomaly_score, logs)
-        pool.close()
-        pool.join()
-        return dist
+        return self._get_scorer().min_distance(logs)
+
+    def load(self, source):
+        """Load a model from disk and build its codebook scorer, models saved in another precision are converted."""
+        super().load(source)
+        self.model = self.model.astype(self.dtype, copy=False)
+        self._get_scorer()
+
+    def _get_scorer(self):
+        """Build the codebook scorer once per trained or loaded model."""
+        if self._scorer is None or self._scorer.source is not self.model:
+            self._scorer = build_scorer(self.model, self.config)
+        return self._scorer
+
+    def save_visualisation(self, dest):
+        """Create and save a png image of the U-matrix of the SOM."""
+        return render_u_matrix(u_matrix(self.model), dest)
 
     def calculate_anomaly_score(self, log):
         """Compute a distance of a log entry to elements of SOM."""
@@ -0,0 +1,73 @@
+"""U-matrix of a SOM codebook and its rendering, matplotlib is only imported when an image is drawn."""
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import logging
+import os
+
+_LOGGER = logging.getLogger(__name__)
+
+UMATRIX_IMAGE = "U-map.png"
+
+# Grid offsets of the 8 neighbours of a node
+_NEIGHBOURS = [(i, j) for i in range(-1, 2) for j in range(-1, 2) if (i, j) != (0, 0)]
+
+
+def u_matrix(codebook):
+    """Mean distance of every node to its neighbours on the map, for a codebook of shape (rows, cols, dim).
+
+    :param codebook: SOM codebook
+    :return: array of shape (rows, cols)
+    """
+    codebook = np.asarray(codebook, dtype=np.float64)
+    rows, cols = codebook.shape[0:2]
+    padded = np.full((rows + 2, cols + 2) + codebook.shape[2:], np.nan)
+    padded[1:-1, 1:-1] = codebook
+    dist = np.stack([np.linalg.norm(codebook - padded[1 + i:1 + i + rows, 1 + j:1 + j + cols], axis=-1)
+                     for i, j in _NEIGHBOURS])
+    # Nodes on the border of the map have fewer neighbours, nan marks the missing ones
+    with np.errstate(invalid="ignore"):
+        return np.nanmean(dist, axis=0) if rows * cols > 1 else np.zeros((rows, cols))
+
+
+def render_u_matrix(umatrix, dest):
+    """Save a png image of the U-matrix to the directory dest."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    cax = ax.matshow(umatrix, interpolation="nearest")
+    fig.colorbar(cax)
+    path = os.path.join(dest, UMATRIX_IMAGE)
+    fig.savefig(path)
+    return path
+
+
+class UMatrixRenderer:
+    """Render U-matrix images in a background thread so training does not wait on plotting."""
+
+    def __init__(self):
+        """Start without a worker, it is created with the first image."""
+        self.executor = None
+
+    def submit(self, codebook, dest):
+        """Queue rendering the U-matrix of a copy of codebook to dest, returns a future of the image path."""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        return self.executor.submit(self._render, np.array(codebook), dest)
+
+    def close(self):
+        """Wait for queued images and stop the worker."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    @staticmethod
+    def _render(codebook, dest):
+        """Compute and save one U-matrix image, failures are logged and kept in the future."""
+        try:
+            return render_u_matrix(u_matrix(codebook), dest)
+        except Exception as ex:
+            _LOGGER.error("Failed to render U-matrix: %s" % ex)
+            raise
@@ -1,11 +1,61 @@
 """Word 2 vector model."""
+from collections import OrderedDict
 import numpy as np
+import pandas
 from gensim.models import Word2Vec
+from prometheus_client import Counter, Gauge
 from anomaly_detector.model.base_model import BaseModel
+import hashlib
 import logging
+import os
+import tempfile
+import uuid
 
 _LOGGER = logging.getLogger(__name__)
 
+W2V_VOCAB_SIZE = Gauge("aiops_lad_w2v_vocab_size", "count of words in the W2V vocabulary", ['column'])
+W2V_VOCAB_EVICTED_COUNT = Counter("aiops_lad_w2v_vocab_evicted_count", "count of words evicted from the W2V vocabulary",
+                                  ['column'])
+W2V_MODEL_BYTES = Gauge("aiops_lad_w2v_model_bytes", "bytes of the W2V model arrays")
+
+# gensim truncates longer sentences when training
+MAX_SENTENCE_LENGTH = 10000
+
+
+class SentenceCorpus:
+    """Stream a column of words as sentences of at most sentence_length consecutive words.
+
+    gensim trains every worker on its own batch of sentences, so a column passed as one sentence is trained by
+    a single worker and cut after MAX_SENTENCE_LENGTH words. The corpus can be iterated any number of times.
+    """
+
+    def __init__(self, words, sentence_length=MAX_SENTENCE_LENGTH):
+        """Split words into sentences of sentence_length, capped at MAX_SENTENCE_LENGTH."""
+        self.words = words
+        self.sentence_length = max(1, min(sentence_length, MAX_SENTENCE_LENGTH))
+
+    def __iter__(self):
+        """Sentences of the corpus in order."""
+        for start in range(0, len(self.words), self.sentence_length):
+            yield self.words[start:start + self.sentence_length]
+
+    def __len__(self):
+        """Number of sentences."""
+        return -(-len(self.words) // self.sentence_length)
+
+    def plain(self):
+        """Whether every word is a single non empty token, which the LineSentence format can hold."""
+        return all(word.split() == [word] for word in self.words)
+
+    def save(self, path):
+        """Write the corpus in LineSentence format, one sentence of space separated words per line."""
+        tmp = "%s.tmp-%s" % (path, uuid.uuid4().hex)
+        with open(tmp, "w") as f:
+            for sentence in self:
+                f.write(" ".join(sentence) + "\n")
+        os.replace(tmp, path)
+        return path
+
 
 class W2VModel(BaseModel):
     """Word2Vec model wrapper."""
@@ -14,48 +64,202 @@ class W2VModel(BaseModel):
         """Construct with configurations for customizations."""
         super().__init__(config)
         self.config = config
+        self._oov_vectors = OrderedDict()
 
     def update(self, words):
-        """Update existing w2v model."""
+        """Update existing w2v model, within W2V_MAX_VOCAB words if it is set."""
         for col in list(self.model.keys()):
             if col in words:
-                self.model[col].build_vocab([words[col]], update=True)
+                if self.config and self.config.W2V_MAX_VOCAB > 0:
+                    self._bounded_update(col, list(words[col]))
+                else:
+                    self.model[col].build_vocab([words[col]], update=True)
+                # Saved with the model, so the state of a loaded model tells which update it came from
+                self.model[col].updates = getattr(self.model[col], "updates", 0) + 1
             else:
                 _LOGGER.warning("Skipping key %s as it does not exist in 'words'" % col)
+        self._apply_storage_precision()
+        self._report()
         _LOGGER.info("Models Updated")
 
+    def _bounded_update(self, col, words):
+        """Add the new words of a column, train only their vectors and evict words beyond W2V_MAX_VOCAB.
+
+        Vectors of known words are locked while training, so logs encoded before the update keep their
+        encoding and the model trained on them stays valid. Every word remembers the last update it was seen
+        in, the least recently seen and then least frequent words are evicted.
+        """
+        model = self.model[col]
+        wv = model.wv
+        seen = 1 + max((getattr(vocab, "seen", 0) for vocab in wv.vocab.values()), default=0)
+        batch = set(words)
+        new = [word for word in batch if word not in wv.vocab]
+        model.build_vocab([words], update=True)
+        for word in batch:
+            if word in wv.vocab:
+                wv.vocab[word].seen = seen
+
+        added = [wv.vocab[word].index for word in new if word in wv.vocab]
+        if added:
+            lockf = np.zeros(len(wv.vocab), dtype=np.float32)
+            lockf[added] = 1.0
+            model.trainables.vectors_lockf = lockf
+            # Training needs writable float32 vectors, W2V_STORAGE_PRECISION is applied again afterwards
+            wv.vectors = wv.vectors.astype(np.float32)
+            corpus = SentenceCorpus(words, self.config.W2V_SENTENCE_LENGTH)
+            model.train(corpus, total_examples=len(corpus), epochs=model.epochs)
+            model.trainables.vectors_lockf = np.ones(len(wv.vocab), dtype=np.float32)
+
+        evicted = self._prune(model, self.config.W2V_MAX_VOCAB, batch)
+        if evicted:
+            _LOGGER.info("Evicted %d words from the W2V vocabulary of %s" % (evicted, col))
+            W2V_VOCAB_EVICTED_COUNT.labels(column=col).inc(evicted)
+
+    @staticmethod
+    def _prune(model, max_vocab, recent):
+        """Keep the max_vocab most recently seen words of a model, recent words first, and return the evictions."""
+        wv = model.wv
+        evicted = len(wv.vocab) - max_vocab
+        if evicted <= 0:
+            return 0
+        ranked = sorted(wv.index2word, reverse=True,
+                        key=lambda word: (word in recent, getattr(wv.vocab[word], "seen", 0), wv.vocab[word].count))
+        rows = np.sort([wv.vocab[word].index for word in ranked[:max_vocab]])
+        wv.index2word = [wv.index2word[row] for row in rows]
+        wv.vocab = {word: wv.vocab[word] for word in wv.index2word}
+        for index, word in enumerate(wv.index2word):
+            wv.vocab[word].index = index
+        wv.vectors = wv.vectors[rows]
+        wv.vectors_norm = None
+        model.trainables.vectors_lockf = model.trainables.vectors_lockf[rows]
+        if model.negative:
+            model.trainables.syn1neg = model.trainables.syn1neg[rows]
+            model.vocabulary.make_cum_table(wv)
+        return evicted
+
+    def state(self):
+        """Vocabulary size, update count and leading rows of the embedding matrix of every column.
+
+        The leading rows tell a rebuilt model from an updated one. Updates append words and evictions drop and
+        reindex rows beyond them, which the vocabulary size and the update count tell apart.
+        """
+        state = b""
+        for col in sorted(self.model or {}):
+            model = self.model[col]
+            counts = np.array([len(model.wv.vocab), getattr(model, "updates", 0)], dtype=np.int64)
+            state += col.encode() + counts.tobytes() + np.ascontiguousarray(model.wv.vectors[:1024]).tobytes()
+        return state
+
+    def nbytes(self):
+        """Bytes of the embedding and output layer arrays of every column model."""
+        size = 0
+        for model in (self.model or {}).values():
+            size += model.wv.vectors.nbytes
+            size += getattr(model.trainables, "syn1neg", np.empty(0)).nbytes
+        return size
+
+    def _report(self):
+        """Export the vocabulary size of every column and the size of the model."""
+        for col, model in self.model.items():
+            W2V_VOCAB_SIZE.labels(column=col).set(len(model.wv.vocab))
+        W2V_MODEL_BYTES.set(self.nbytes())
+
     def create(self, words, vector_length, window_size):
         """Create new word2vec model."""
         self.model = {}
         for col in words.columns:
             if col in words:
                 if not self.config:
-                    self.model[col] = Word2Vec([list(words[col])], min_count=1, size=vector_length, window=window_size)
+                    self.model[col] = Word2Vec(SentenceCorpus(list(words[col])), min_count=1, size=vector_length,
+                                               window=window_size)
+                    continue
+                corpus = SentenceCorpus(list(words[col]), self.config.W2V_SENTENCE_LENGTH)
+                params = dict(min_count=self.config.W2V_MIN_COUNT, size=vector_length, window=window_size,
+                              iter=self.config.W2V_ITER, compute_loss=self.config.W2V_COMPUTE_LOSS,
+                              workers=self.config.W2V_WORKERS, seed=self.config.W2V_SEED)
+                if self.config.W2V_CORPUS_DIR and corpus.plain():
+                    # Workers read their own share of the file instead of waiting on one producer thread
+                    fd, path = tempfile.mkstemp(prefix="%s-" % col, suffix=".txt", dir=self.config.W2V_CORPUS_DIR)
+                    os.close(fd)
+                    try:
+                        self.model[col] = Word2Vec(corpus_file=corpus.save(path), **params)
+                    finally:
+                        os.remove(path)
                 else:
-                    self.model[col] = Word2Vec([list(words[col])], min_count=self.config.W2V_MIN_COUNT,
-                                               size=vector_length,
-                                               window=window_size, iter=self.config.W2V_ITER,
-                                               compute_loss=self.config.W2V_COMPUTE_LOSS,
-                                               workers=self.config.W2V_WORKERS, seed=self.config.W2V_SEED)
+                    self.model[col] = Word2Vec(corpus, **params)
             else:
                 _LOGGER.warning("Skipping key %s as it does not exist in 'words'" % col)
+        self._apply_storage_precision()
+        self._report()
 
-    def one_vector(self, new_D: object) -> object:
-        """Create a single vector from model."""
-        transforms = {}
+    def load(self, source):
+        """Load a model from disk and convert its embeddings to the configured storage precision."""
+        super().load(source)
+        self._apply_storage_precision()
+
+    def _save_native(self, directory):
+        """Save every column model with gensim, keeping the embedding matrices in separate .npy files."""
+        columns = {}
+        for i, col in enumerate(self.model.keys()):
+            columns[col] = "w2v_%d.model" % i
+            self.model[col].save(os.path.join(directory, columns[col]), sep_limit=0)
+        return {"columns": columns}
+
+    def _load_native(self, directory, header):
+        """Load every column model with its embedding matrices memory mapped."""
+        self.model = {col: Word2Vec.load(os.path.join(directory, name), mmap="r")
+                      for col, name in header["columns"].items()}
+
+    def _apply_storage_precision(self):
+        """Keep the embeddings in W2V_STORAGE_PRECISION, lookups are converted to the model precision."""
+        if not self.config or not self.config.W2V_STORAGE_PRECISION:
+            return
         for col in self.model.keys():
-            if col in new_D:
-                transforms[col] = self.model[col].wv[new_D[col]]
+            wv = self.model[col].wv
+            wv.vectors = wv.vectors.astype(self.config.W2V_STORAGE_PRECISION, copy=False)
 
-        new_data = []
+    def one_vector(self, new_D: object) -> object:
+        """Create a single vector per log, a leading 0 followed by the embedding of every column.
 
-        for i in range(len(transforms["message"])):
-            logc = np.array(0)
-            for _, c in transforms.items():
-                if c.item(i):
-                    logc = np.append(logc, c[i])
-                else:
-                    logc = np.append(logc, [0, 0, 0, 0, 0])
-            new_data.append(logc)
+        Every distinct value of a column is looked up in the vocabulary once and the embeddings are gathered
+        into one preallocated matrix. Missing values are encoded as zeros, as are words missing in the
+        vocabulary unless W2V_OOV_STRATEGY is "hash".
+        """
+        columns = [col for col in self.model.keys() if col in new_D]
+        bounds = np.cumsum([1] + [self.model[col].wv.vector_size for col in columns])
+        vectors = np.zeros((len(new_D), bounds[-1]), dtype=self.dtype)
+        for col, start, stop in zip(columns, bounds[:-1], bounds[1:]):
+            wv = self.model[col].wv
+            codes, words = pandas.factorize(np.asarray(new_D[col], dtype=object))
+            # Code -1 of missing values picks the trailing -1 like words missing in the vocabulary
+            index = np.array([wv.vocab[word].index if word in wv.vocab else -1 for word in words] + [-1])
+            rows = index[codes]
+            found = rows >= 0
+            vectors[found, start:stop] = wv.vectors[rows[found]]
+            unknown = np.flatnonzero(index[:-1] < 0)
+            if len(unknown) and self.config and self.config.W2V_OOV_STRATEGY == "hash":
+                slot = np.full(len(index), -1)
+                slot[unknown] = np.arange(len(unknown))
+                rows = slot[codes]
+                hashed = rows >= 0
+                oov = np.array([self._oov_vector(col, words[i], wv.vector_size) for i in unknown])
+                vectors[hashed, start:stop] = oov[rows[hashed]]
+        return vectors
+
+    def _oov_vector(self, col, word, size):
+        """Vector of a word missing in the vocabulary, kept in a table of the W2V_OOV_TABLE_SIZE latest words.
 
-        return np.array(new_data, ndmin=2)
+        The vector is drawn from a seed hashed from the word, the way gensim initializes new words, so it is
+        the same in every process and across restarts.
+        """
+        key = (col, word)
+        vector = self._oov_vectors.get(key)
+        if vector is None:
+            seed = int.from_bytes(hashlib.md5(("%s\x1f%s" % key).encode()).digest()[:4], "little")
+            vector = (np.random.RandomState(seed).rand(size) - 0.5) / size
+            self._oov_vectors[key] = vector
+            while len(self._oov_vectors) > self.config.W2V_OOV_TABLE_SIZE:
+                self._oov_vectors.popitem(last=False)
+        else:
+            self._oov_vectors.move_to_end(key)
+        return vector
@@ -128,11 +128,12 @@ class ElasticSearchDataSource(StorageSource, DataCleaner, ESStorage):
         # only use _source sub-dict
         es_data = [x["_source"] for x in es_data["hits"]["hits"]]
         self.format_log(self.config, es_data)
+        es_data = self._sampled(es_data, storage_attribute.sampler)
 
         es_data_normalized = pandas.DataFrame(json_normalize(es_data)["message"])
 
         _LOGGER.info("%d logs loaded in from last %d seconds", len(es_data_normalized), storage_attribute.time_range)
 
-        self._preprocess(es_data_normalized)
+        self._preprocess(es_data_normalized, storage_attribute.training)
 
         return es_data_normalized, es_data  # bad solution, this is how Entry objects could come in.
@@ -1,4 +1,5 @@
 """Local Storage."""
+import itertools
 import json
 import logging
 from enum import Enum
@@ -61,20 +62,20 @@ class LocalDirectoryStorageDataSource(StorageSource, DataCleaner, LocalDirStorag
             else:
                 raise FileFormatNotSupported(
                     "File format is not supported json and common log format (which ends with '.log') .")
-            if storage_attribute.false_data is not None:
-                data.extend(storage_attribute.false_data)
         return data
 
     def read_all_files(self, storage_attribute: DefaultStorageAttribute):
         """Loop through all files in directory and send it to parser."""
         self.get_filesnames_recursively(self.config.LS_INPUT_PATH)
-        q = deque()
-        for file in self.files:
-            data = self.read_file(file, storage_attribute)
-            q.extend(data)
+        # Files are read one at a time, a sampler only keeps the sampled logs of every file
+        q = deque(self._sampled(itertools.chain.from_iterable(self.read_file(file, storage_attribute)
+                                                              for file in self.files), storage_attribute.sampler))
+        # False positive feedback is added once after sampling, so it is never dropped
+        if storage_attribute.false_data is not None:
+            q.extend(storage_attribute.false_data)
         dataset = json_normalize(list(q))
         _LOGGER.info("%d logs loaded", len(dataset))
-        self._preprocess(dataset)
+        self._preprocess(dataset, storage_attribute.training)
         return dataset, list(q)
 
     def extract_message(self, line):
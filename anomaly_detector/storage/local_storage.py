@@ -40,21 +40,19 @@ class LocalStorageDataSource(StorageSource, DataCleaner):
 
     def retrieve(self, storage_attribute: DefaultStorageAttribute):
         """Retrieve data from local storage."""
-        data = []
         _LOGGER.info("Reading from %s" % self.config.LS_INPUT_PATH)
 
         with open(self.config.LS_INPUT_PATH, "r") as fp:
             if self.config.LS_INPUT_PATH.endswith("json"):
-                data = json.load(fp)
+                logs = json.load(fp)
             else:
                 # Here we are loading in data from common log format Columns [0]= timestamp [1]=severity [2]=msg
-                for line in fp:
-                    message_field = " ".join(line.split(" ")[2:])
-                    message_field = message_field.rstrip("\n")
-                    data.append({"message": message_field})
-            if storage_attribute.false_data is not None:
-                data.extend(storage_attribute.false_data)
+                logs = ({"message": " ".join(line.split(" ")[2:]).rstrip("\n")} for line in fp)
+            data = self._sampled(logs, storage_attribute.sampler)
+        # False positive feedback is always kept, only the logs read are sampled
+        if storage_attribute.false_data is not None:
+            data.extend(storage_attribute.false_data)
         data_set = json_normalize(data)
         _LOGGER.info("%d logs loaded", len(data_set))
-        self._preprocess(data_set)
+        self._preprocess(data_set, storage_attribute.training)
         return data_set, data
@@ -0,0 +1,106 @@
+"""Reservoir sampling of log entries for training sets of bounded size."""
+from collections import defaultdict
+import math
+import random
+
+
+class ReservoirSampler:
+    """Keep a uniform random sample of at most size items from a stream fed in chunks with add().
+
+    With stratified, items are grouped by a key such as the cleaned message, and every key gets an equal share
+    of the sample. Frequent messages then no longer crowd out rare ones. Memory stays bounded by size items
+    plus one counter per key. Once more than size keys were seen, keys first seen after that are not sampled.
+    """
+
+    def __init__(self, size, stratified=False, seed=None):
+        """Create an empty reservoir."""
+        self.size = size
+        self.stratified = stratified
+        self.random = random.Random(seed)
+        self.seen = 0
+        self.reservoir = []
+        self.strata = {}
+        self.strata_seen = {}
+        # Keys of the strata by their length, to find the largest stratum in constant time
+        self._lengths = defaultdict(set)
+        self._longest = 0
+        # Algorithm L state, the stream position of the next item entering the reservoir
+        self._weight = 1.0
+        self._next = 0
+
+    def add(self, items, keys=None):
+        """Offer the next chunk of the stream, keys gives the stratum of every item when stratified."""
+        if self.stratified:
+            for item, key in zip(items, keys):
+                self._add_stratified(item, key)
+        else:
+            self._add_uniform(list(items))
+
+    def sample(self):
+        """Items currently kept."""
+        if self.stratified:
+            return [item for stratum in self.strata.values() for item in stratum]
+        return list(self.reservoir)
+
+    def __len__(self):
+        """Number of items currently kept."""
+        if self.stratified:
+            return sum(len(stratum) for stratum in self.strata.values())
+        return len(self.reservoir)
+
+    def _add_uniform(self, items):
+        """Algorithm L, jumps straight to the items entering the reservoir instead of drawing for every item."""
+        start = self.seen
+        self.seen += len(items)
+        fill = min(len(items), self.size - len(self.reservoir))
+        if fill > 0:
+            self.reservoir.extend(items[:fill])
+            if len(self.reservoir) == self.size:
+                self._skip(start + fill - 1)
+        if len(self.reservoir) < self.size:
+            return
+        while self._next < self.seen:
+            self.reservoir[self.random.randrange(self.size)] = items[self._next - start]
+            self._skip(self._next)
+
+    def _skip(self, position):
+        """Draw the stream position of the next item to enter the full reservoir after position."""
+        self._weight *= math.exp(math.log(self._random()) / self.size)
+        self._next = position + int(math.floor(math.log(self._random()) / math.log(1 - self._weight))) + 1
+
+    def _random(self):
+        """Uniform draw from the open interval (0, 1)."""
+        value = self.random.random()
+        while value == 0.0:
+            value = self.random.random()
+        return value
+
+    def _add_stratified(self, item, key):
+        """Reservoir per key, a full sample makes room by evicting from the largest stratum."""
+        self.seen += 1
+        seen = self.strata_seen.get(key, 0) + 1
+        self.strata_seen[key] = seen
+        stratum = self.strata.setdefault(key, [])
+        if self.seen <= self.size:
+            self._resize(key, 1)
+            stratum.append(item)
+        elif self._longest > len(stratum) + 1:
+            largest = next(iter(self._lengths[self._longest]))
+            slot = self.random.randrange(self._longest)
+            self._resize(largest, -1)
+            self.strata[largest].pop(slot)
+            self._resize(key, 1)
+            stratum.append(item)
+        elif stratum:
+            slot = self.random.randrange(seen)
+            if slot < len(stratum):
+                stratum[slot] = item
+
+    def _resize(self, key, change):
+        """Move the stratum of key to the bucket of its new length, before its list is changed."""
+        length = len(self.strata[key])
+        self._lengths[length].discard(key)
+        if not self._lengths[length]:
+            del self._lengths[length]
+        self._lengths[length + change].add(key)
+        self._longest = max(self._lengths)
@@ -1,8 +1,14 @@
 """Storage abstract class."""
 from abc import ABCMeta, abstractmethod
+from anomaly_detector.storage.template_miner import TemplateMiner
+import itertools
+import os
 import re
 import logging
 
+# Id of messages at inference that match none of the templates mined at training time
+UNKNOWN_TEMPLATE = "template_unknown"
+
 
 class Storage(metaclass=ABCMeta):
     """Base class for storage implementations."""
@@ -33,7 +39,22 @@ class DataCleaner:
         )  # Leaving only a-z in there as numbers add to anomalousness quite a bit
 
     @classmethod
-    def _preprocess(cls, data):
+    def _sampled(cls, records, sampler, chunk_size=10000):
+        """Feed a stream of raw logs to sampler in chunks keyed by cleaned message, return the kept logs in order.
+
+        Without a sampler all logs are kept. With one, only the sampled logs are held on to and preprocessed.
+        """
+        if sampler is None:
+            return list(records)
+        # Logs are sampled along with their stream position to restore their order afterwards
+        logs = enumerate(records)
+        chunk = list(itertools.islice(logs, chunk_size))
+        while chunk:
+            sampler.add(chunk, [cls._clean_message(str(log.get("message", ""))) for _, log in chunk])
+            chunk = list(itertools.islice(logs, chunk_size))
+        return [log for _, log in sorted(sampler.sample(), key=lambda item: item[0])]
+
+    def _preprocess(self, data, training=False):
         """Provide preprocessing for the data before running it through W2V and SOM."""
         def to_str(x):
             """Convert all non-str lists to string lists for Word2Vec."""
@@ -42,12 +63,38 @@ class DataCleaner:
 
         for col in data.columns:
             if col == "message":
-                data[col] = data[col].apply(cls._clean_message)
+                if self.config.LOG_TEMPLATE_MINER:
+                    data[col] = self._template_ids(data[col], training)
+                else:
+                    data[col] = data[col].apply(self._clean_message)
             else:
                 data[col] = data[col].apply(to_str)
 
         data = data.fillna("EMPTY")
 
+    def _template_ids(self, messages, training=False):
+        """Replace messages by the id of their log template.
+
+        Only training mines new templates and saves them next to the models. Inference reads the saved templates
+        again when training replaced them and maps messages matching none of them to UNKNOWN_TEMPLATE.
+        """
+        path = os.path.join(os.path.dirname(self.config.MODEL_PATH), self.config.LOG_TEMPLATE_FILE)
+        mtime = os.path.getmtime(path) if os.path.isfile(path) else None
+        if getattr(self, "template_miner", None) is None or (not training and mtime != self.template_mtime):
+            self.template_miner = TemplateMiner.load(path, self.config.LOG_TEMPLATE_DEPTH,
+                                                     self.config.LOG_TEMPLATE_SIMILARITY,
+                                                     self.config.LOG_TEMPLATE_MAX_CHILDREN)
+            self.template_mtime = mtime
+        if not training:
+            ids = (self.template_miner.match(str(message)) for message in messages)
+            return [UNKNOWN_TEMPLATE if i is None else "template%d" % i for i in ids]
+        ids = ["template%d" % self.template_miner.add(str(message)) for message in messages]
+        if self.template_miner.changed:
+            logging.info("%d log templates mined", len(self.template_miner))
+            self.template_miner.save(path)
+            self.template_mtime = os.path.getmtime(path)
+        return ids
+
     @classmethod
     def format_log(cls, config, es_dataset):
         """Format log will extract prefix out of the message."""
@@ -4,9 +4,11 @@
 class DefaultStorageAttribute:
     """Local Storage Attribute only requires false_positive data which is optional."""
 
-    def __init__(self, false_data=None):
+    def __init__(self, false_data=None, sampler=None, training=False):
         """Local Storage only takes an optional field of false_positive."""
         self._false_data = false_data
+        self._sampler = sampler
+        self._training = training
 
     @property
     def false_data(self):
@@ -18,13 +20,33 @@ class DefaultStorageAttribute:
         """Get false positive data."""
         self._false_data = x
 
+    @property
+    def sampler(self):
+        """Reservoir sampler fed with the logs while they are read, None keeps all logs."""
+        return self._sampler
+
+    @sampler.setter
+    def sampler(self, x):
+        """Set reservoir sampler."""
+        self._sampler = x
+
+    @property
+    def training(self):
+        """True when the logs are read to train models, only then new log templates are mined and saved."""
+        return self._training
+
+    @training.setter
+    def training(self, x):
+        """Set whether the logs are read for training."""
+        self._training = x
+
 
 class ESStorageAttribute(DefaultStorageAttribute):
     """Elastic Search Attributes require false positive data and time_range and number of entries to pull."""
 
-    def __init__(self, time_range: int, number_of_entries: int, false_data=None):
+    def __init__(self, time_range: int, number_of_entries: int, false_data=None, sampler=None, training=False):
         """Set initial properties for required fields when fetching data from ES."""
-        super().__init__(false_data)
+        super().__init__(false_data, sampler, training)
         self.__time_range = time_range
         self.__number_of_entries = number_of_entries
         self.false_data = false_data
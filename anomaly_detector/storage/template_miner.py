@@ -0,0 +1,155 @@
+"""Online log template mining with a fixed depth parse tree (Drain)."""
+import json
+import logging
+import os
+import uuid
+
+_LOGGER = logging.getLogger(__name__)
+
+WILDCARD = "<*>"
+# Number of distinct messages whose template id is remembered to skip the tree search for repeated messages
+_MESSAGE_CACHE_SIZE = 100000
+
+
+class TemplateMiner:
+    """Group log messages into templates, such as "Received block <*> of size <*>", as they stream in.
+
+    Messages are split into tokens and routed down a tree by their number of tokens and their first
+    depth - 2 tokens, tokens with digits take the wildcard branch. The leaf holds candidate templates of
+    the same length. A message joins the most similar one when at least similarity of their tokens are
+    equal, the tokens that differ become wildcards. Otherwise it starts a new template. Template ids
+    never change, so they can be encoded instead of the messages.
+    """
+
+    def __init__(self, depth=4, similarity=0.4, max_children=100):
+        """Create an empty miner."""
+        self.depth = max(depth, 3)
+        self.similarity = similarity
+        self.max_children = max_children
+        self.templates = []
+        self.sizes = []
+        self.root = {}
+        self.changed = False
+        self._messages = {}
+
+    def add(self, message):
+        """Template id of a message, the template is created or generalized to match it."""
+        template_id = self._messages.get(message)
+        if template_id is not None:
+            self.sizes[template_id] += 1
+            return template_id
+
+        tokens = message.split()
+        leaf = self._leaf(tokens)
+        template_id = self._match(leaf, tokens)
+        if template_id is None:
+            template_id = len(self.templates)
+            self.templates.append(tokens)
+            self.sizes.append(0)
+            leaf.append(template_id)
+            self.changed = True
+        else:
+            template = self.templates[template_id]
+            merged = [token if token == other else WILDCARD for token, other in zip(template, tokens)]
+            if merged != template:
+                self.templates[template_id] = merged
+                self.changed = True
+        self.sizes[template_id] += 1
+        self._remember(message, template_id)
+        return template_id
+
+    def _remember(self, message, template_id):
+        """Cache the template id of a message, the cache is emptied once it holds _MESSAGE_CACHE_SIZE messages."""
+        if len(self._messages) >= _MESSAGE_CACHE_SIZE:
+            self._messages.clear()
+        self._messages[message] = template_id
+
+    def match(self, message):
+        """Template id of a message without changing any template, None when no template is similar enough."""
+        template_id = self._messages.get(message)
+        if template_id is not None:
+            return template_id
+        tokens = message.split()
+        node = self.root.get(len(tokens), {})
+        prefix = tokens[:self.depth - 2]
+        for token in prefix or [WILDCARD]:
+            if any(char.isdigit() for char in token) or token not in node:
+                token = WILDCARD
+            node = node.get(token)
+            if node is None:
+                return None
+        template_id = self._match(node, tokens)
+        if template_id is not None:
+            self._remember(message, template_id)
+        return template_id
+
+    def template(self, template_id):
+        """Text of a template."""
+        return " ".join(self.templates[template_id])
+
+    def __len__(self):
+        """Number of templates."""
+        return len(self.templates)
+
+    def _leaf(self, tokens):
+        """List of template ids at the end of the tree path of tokens, the path is created as needed."""
+        node = self.root.setdefault(len(tokens), {})
+        prefix = tokens[:self.depth - 2]
+        for i, token in enumerate(prefix):
+            if any(char.isdigit() for char in token):
+                token = WILDCARD
+            if token not in node:
+                if len(node) >= self.max_children - (WILDCARD not in node):
+                    # Full nodes send every new token down the wildcard branch, which always gets a slot
+                    token = WILDCARD
+            default = [] if i == len(prefix) - 1 else {}
+            node = node.setdefault(token, default)
+        if not prefix:
+            node = node.setdefault(WILDCARD, [])
+        return node
+
+    def _match(self, leaf, tokens):
+        """Most similar template of the leaf that is similar enough to tokens, or None."""
+        best, best_score = None, (-1.0, -1)
+        for template_id in leaf:
+            template = self.templates[template_id]
+            equal = sum(token == other for token, other in zip(template, tokens))
+            score = (equal / max(len(tokens), 1), template.count(WILDCARD))
+            if score > best_score:
+                best, best_score = template_id, score
+        if best is not None and best_score[0] >= self.similarity:
+            return best
+        return None
+
+    def to_dict(self):
+        """Templates and settings of the miner as plain types, the tree is rebuilt from the templates."""
+        return {"depth": self.depth, "similarity": self.similarity, "max_children": self.max_children,
+                "templates": [" ".join(tokens) for tokens in self.templates], "sizes": self.sizes}
+
+    @classmethod
+    def from_dict(cls, state):
+        """Restore a miner saved with to_dict."""
+        miner = cls(state["depth"], state["similarity"], state["max_children"])
+        for template_id, template in enumerate(state["templates"]):
+            miner.templates.append(template.split())
+            miner._leaf(miner.templates[-1]).append(template_id)
+        miner.sizes = list(state["sizes"])
+        return miner
+
+    def save(self, path):
+        """Write the templates to a json file, replacing it only once the new file is complete."""
+        tmp = "%s.tmp-%s" % (path, uuid.uuid4().hex)
+        with open(tmp, "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp, path)
+        self.changed = False
+
+    @classmethod
+    def load(cls, path, depth=4, similarity=0.4, max_children=100):
+        """Miner saved at path, or a new one with the given settings when there is none."""
+        if not os.path.isfile(path):
+            return cls(depth, similarity, max_children)
+        with open(path) as f:
+            miner = cls.from_dict(json.load(f))
+        _LOGGER.info("Loaded %d log templates from %s" % (len(miner), path))
+        return miner
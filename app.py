@@ -2,6 +2,8 @@
 from prometheus_client import start_http_server
 from anomaly_detector.config import Configuration
 from anomaly_detector.facade import Facade
+from anomaly_detector.model.base_model import BaseModel
+from anomaly_detector.model.umatrix import render_u_matrix, u_matrix
 import click
 import os
 
@@ -84,5 +86,21 @@ def run(job_type: str, config_yaml: str, single_run: bool, tracing_enabled: bool
         anomaly_detector.run(single_run=single_run)
 
 
+@cli.command("umatrix")
+@click.option("--config-yaml", default=".env_config.yaml", help="configuration file used to configure service")
+@click.option("--output-dir", default=".", help="directory the U-matrix image is saved to")
+def umatrix(config_yaml: str, output_dir: str):
+    """Render the U-matrix of the trained SOM model to a png image.
+
+    :param config_yaml: provides path to the config file to load into application.
+    :param output_dir: directory the image is saved to.
+    :return: None
+    """
+    config = Configuration(prefix=CONFIGURATION_PREFIX, config_yaml=config_yaml)
+    model = BaseModel(config)
+    model.load(config.MODEL_PATH)
+    click.echo("Saved U-matrix to {}".format(render_u_matrix(u_matrix(model.get()), output_dir)))
+
+
 if __name__ == "__main__":
     cli(auto_envvar_prefix="LAD")
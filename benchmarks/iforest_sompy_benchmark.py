@@ -0,0 +1,85 @@
+"""Compare train and inference throughput and accuracy of the isolation forest against SOMPY on the same logs."""
+import json
+import os
+import random
+import tempfile
+import time
+
+import click
+import numpy as np
+from sklearn.metrics import precision_score, recall_score, roc_auc_score
+
+from anomaly_detector.adapters import IsolationForestModelAdapter, SomModelAdapter, SomStorageAdapter
+from anomaly_detector.config import Configuration
+
+
+def corrupt(message, rng):
+    """Overwrite random characters of a message, the way validation_data/generate_validation_data.py does."""
+    chars = list(message)
+    for _ in range(len(chars)):
+        chars[rng.randint(0, len(chars) - 1)] = chr(rng.randint(65, 123))
+    return "".join(chars)
+
+
+def split(input_path, directory, anomaly_share, rng):
+    """Write the first 80% of the logs as training set and the rest with a share of corrupted logs as test set."""
+    with open(input_path) as fp:
+        logs = [{"message": log["message"]} for log in json.load(fp)]
+    cut = int(round(len(logs) * 0.8))
+    labels = np.array([rng.random() < anomaly_share for _ in logs[cut:]])
+    test = [{"message": corrupt(log["message"], rng)} if label else log for log, label in zip(logs[cut:], labels)]
+    paths = os.path.join(directory, "train.json"), os.path.join(directory, "test.json")
+    for path, data in zip(paths, (logs[:cut], test)):
+        with open(path, "w") as fp:
+            json.dump(data, fp)
+    return paths, labels
+
+
+def evaluate(adapter_class, config, node_map, train_path, test_path, labels):
+    """Train a model adapter and score the test set, returns throughputs and accuracy of its predictions."""
+    model_adapter = adapter_class(SomStorageAdapter(config=config, feedback_strategy=None))
+    config.LS_INPUT_PATH = train_path
+    dataframe, _ = model_adapter.preprocess(config_type="train", recreate_model=True)
+    start = time.time()
+    model_adapter.train(node_map=node_map, data=dataframe)
+    train_rate = len(dataframe) / max(time.time() - start, 1e-9)
+
+    config.LS_INPUT_PATH = test_path
+    dataframe, _ = model_adapter.preprocess(config_type="infer", recreate_model=False)
+    start = time.time()
+    scores = model_adapter.process_anomaly_score(dataframe)
+    infer_rate = len(dataframe) / max(time.time() - start, 1e-9)
+    _, threshold = model_adapter.set_threshold()
+    model_adapter.close()
+    predicted = scores > threshold
+    # A model flagging nothing has no precision, count it as 0 like later scikit-learn versions can
+    precision = precision_score(labels, predicted) if predicted.sum() else 0.0
+    return train_rate, infer_rate, roc_auc_score(labels, scores), precision, recall_score(labels, predicted)
+
+
+@click.command()
+@click.option("--input-path", default="validation_data/Hadoop_2k.json", help="json log file to train and score")
+@click.option("--node-map", default=24, help="size of the SOM map")
+@click.option("--parallelism", default=2, help="PARALLELISM used to train and score both models")
+@click.option("--anomaly-share", default=0.1, help="share of the test logs replaced by corrupted logs")
+@click.option("--seed", default=42, help="seed of the test set corruption")
+def main(input_path, node_map, parallelism, anomaly_share, seed):
+    """Print train and inference rows/sec, ROC AUC and precision and recall at the threshold of both models."""
+    directory = tempfile.mkdtemp()
+    (train_path, test_path), labels = split(input_path, directory, anomaly_share, random.Random(seed))
+    click.echo("{} anomalies among {} test logs".format(labels.sum(), len(labels)))
+    header = ("model", "train rows/sec", "infer rows/sec", "roc auc", "precision", "recall")
+    click.echo("{:>8} {:>16} {:>16} {:>8} {:>10} {:>8}".format(*header))
+    for name, adapter_class in (("sompy", SomModelAdapter), ("iforest", IsolationForestModelAdapter)):
+        config = Configuration()
+        config.STORAGE_DATASOURCE = "local"
+        config.STORAGE_DATASINK = "stdout"
+        config.PARALLELISM = parallelism
+        config.MODEL_PATH = os.path.join(directory, "%s.model" % name)
+        config.W2V_MODEL_PATH = os.path.join(directory, "%s.w2v.model" % name)
+        result = evaluate(adapter_class, config, node_map, train_path, test_path, labels)
+        click.echo("{:>8} {:>16.0f} {:>16.0f} {:>8.3f} {:>10.3f} {:>8.3f}".format(name, *result))
+
+
+if __name__ == "__main__":
+    main()
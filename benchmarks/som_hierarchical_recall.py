@@ -0,0 +1,50 @@
+"""Report recall of hierarchical SOM search against exact scoring on validation_data/Hadoop_2k.json."""
+import time
+
+import click
+import numpy as np
+
+from anomaly_detector.adapters import SomModelAdapter, SomStorageAdapter
+from anomaly_detector.config import Configuration
+from anomaly_detector.core import SomTrainJob
+from anomaly_detector.model.som_scorer import HierarchicalScorer, SOMScorer
+
+
+def timed_bmu(scorer, vectors):
+    """Best matching units of all vectors together with the observed rows/sec."""
+    start = time.time()
+    bmu, dist = scorer.bmu(vectors)
+    return bmu, np.sqrt(dist), len(vectors) / max(time.time() - start, 1e-9)
+
+
+@click.command()
+@click.option("--input-path", default="validation_data/Hadoop_2k.json", help="log file used to train and score")
+@click.option("--node-map", default=24, help="size of the SOM map")
+@click.option("--region-size", default=4, help="SOM_COARSE_REGION_SIZE used by the coarse map")
+@click.option("--top-k", default="1,2,3,4,6,8", help="comma separated SOM_COARSE_TOP_K values to evaluate")
+def main(input_path, node_map, region_size, top_k):
+    """Train a model on the input logs and compare approximate against exact best matching units."""
+    config = Configuration()
+    config.STORAGE_DATASOURCE = "local"
+    config.STORAGE_DATASINK = "stdout"
+    config.LS_INPUT_PATH = input_path
+    storage_adapter = SomStorageAdapter(config=config, feedback_strategy=None)
+    model_adapter = SomModelAdapter(storage_adapter=storage_adapter)
+    SomTrainJob(node_map=node_map, model_adapter=model_adapter).execute()
+    dataframe, _ = storage_adapter.load_data("train")
+    vectors = model_adapter.w2v_model.one_vector(dataframe)
+    codebook = model_adapter.model.get()
+
+    exact_bmu, exact_dist, exact_rate = timed_bmu(SOMScorer(codebook), vectors)
+    click.echo("exact search: {:.0f} rows/sec over {} rows".format(exact_rate, len(vectors)))
+    click.echo("{:>6} {:>8} {:>20} {:>20} {:>10}".format("top_k", "recall", "mean distance error",
+                                                         "max distance error", "rows/sec"))
+    for k in [int(k) for k in top_k.split(",")]:
+        bmu, dist, rate = timed_bmu(HierarchicalScorer(codebook, region_size, k), vectors)
+        error = (dist - exact_dist) / np.maximum(exact_dist, np.finfo(exact_dist.dtype).tiny)
+        click.echo("{:>6} {:>8.4f} {:>20.4%} {:>20.4%} {:>10.0f}".format(
+            k, np.mean(bmu == exact_bmu), np.mean(error), np.max(error), rate))
+
+
+if __name__ == "__main__":
+    main()
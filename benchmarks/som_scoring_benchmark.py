@@ -0,0 +1,55 @@
+"""Benchmark SOMPYModel scoring against the previous multiprocessing Pool implementation."""
+from multiprocessing import Pool
+import time
+
+import click
+import numpy as np
+
+from anomaly_detector.config import Configuration
+from anomaly_detector.model import SOMPYModel
+
+
+def pool_score(model, logs, parallelism):
+    """Score logs the way SOMPYModel.get_anomaly_score did before the blocked scoring engine."""
+    pool = Pool(parallelism)
+    dist = pool.map(model.calculate_anomaly_score, logs)
+    pool.close()
+    pool.join()
+    return np.array(dist)
+
+
+def rows_per_sec(func, rows):
+    """Run func once and return its result together with the observed throughput."""
+    start = time.time()
+    result = func()
+    return result, rows / max(time.time() - start, 1e-9)
+
+
+@click.command()
+@click.option("--rows", default="10000,100000,1000000", help="comma separated number of log vectors to score")
+@click.option("--map-size", default=24, help="size of the SOM map")
+@click.option("--vector-length", default=26, help="length of the encoded log vectors")
+@click.option("--parallelism", default=2, help="number of processes used by the Pool path")
+@click.option("--block-size", default=4096, help="SOM_BLOCK_SIZE used by the blocked scoring engine")
+@click.option("--pool-max-rows", default=100000, help="skip the Pool path above this many rows, it takes hours at 1M")
+def main(rows, map_size, vector_length, parallelism, block_size, pool_max_rows):
+    """Print rows/sec of both scoring paths for every input size."""
+    config = Configuration()
+    config.SOM_BLOCK_SIZE = block_size
+    model = SOMPYModel(config=config)
+    model.set(np.random.rand(map_size, map_size, vector_length))
+
+    click.echo("{:>10} {:>16} {:>16} {:>10}".format("rows", "pool rows/sec", "blocked rows/sec", "max diff"))
+    for n in [int(r) for r in rows.split(",")]:
+        logs = np.random.rand(n, vector_length)
+        blocked, blocked_rate = rows_per_sec(lambda: model.get_anomaly_score(logs, parallelism), n)
+        if n <= pool_max_rows:
+            pooled, pool_rate = rows_per_sec(lambda: pool_score(model, logs, parallelism), n)
+            click.echo("{:>10} {:>16.0f} {:>16.0f} {:>10.2e}".format(n, pool_rate, blocked_rate,
+                                                                     np.max(np.abs(pooled - blocked))))
+        else:
+            click.echo("{:>10} {:>16} {:>16.0f} {:>10}".format(n, "skipped", blocked_rate, "-"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark W2VModel.one_vector against the previous row by row np.append implementation."""
+import time
+
+import click
+import numpy as np
+import pandas
+
+from anomaly_detector.config import Configuration
+from anomaly_detector.model import W2VModel
+
+
+def append_one_vector(model, new_D):
+    """Encode logs the way W2VModel.one_vector did before vectors were gathered into a preallocated matrix."""
+    transforms = {}
+    for col in model.model.keys():
+        if col in new_D:
+            transforms[col] = model.model[col].wv[new_D[col]]
+
+    new_data = []
+
+    for i in range(len(transforms["message"])):
+        logc = np.array(0)
+        for _, c in transforms.items():
+            if c.item(i):
+                logc = np.append(logc, c[i])
+            else:
+                logc = np.append(logc, [0, 0, 0, 0, 0])
+        new_data.append(logc)
+
+    return np.array(new_data, ndmin=2, dtype=model.dtype)
+
+
+def rows_per_sec(func, rows):
+    """Run func once and return its result together with the observed throughput."""
+    start = time.time()
+    result = func()
+    return result, rows / max(time.time() - start, 1e-9)
+
+
+@click.command()
+@click.option("--rows", default="10000,100000,300000", help="comma separated number of logs to encode")
+@click.option("--vocab", default=2000, help="number of distinct messages")
+@click.option("--vector-length", default=25, help="TRAIN_VECTOR_LENGTH of the W2V model")
+def main(rows, vocab, vector_length):
+    """Print rows/sec of both encodings for every input size and check that their outputs are identical."""
+    config = Configuration()
+    words = ["message%d" % i for i in range(vocab)]
+    model = W2VModel(config=config)
+    model.create(pandas.DataFrame({"message": words}), vector_length, config.TRAIN_WINDOW)
+
+    click.echo("{:>10} {:>18} {:>18} {:>10}".format("rows", "append rows/sec", "gather rows/sec", "identical"))
+    for n in [int(r) for r in rows.split(",")]:
+        logs = pandas.DataFrame({"message": np.random.choice(words, n)})
+        appended, append_rate = rows_per_sec(lambda: append_one_vector(model, logs), n)
+        gathered, gather_rate = rows_per_sec(lambda: model.one_vector(logs), n)
+        click.echo("{:>10} {:>18.0f} {:>18.0f} {:>10}".format(n, append_rate, gather_rate,
+                                                              str(np.array_equal(appended, gathered))))
+
+
+if __name__ == "__main__":
+    main()
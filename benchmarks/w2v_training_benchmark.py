@@ -0,0 +1,66 @@
+"""Benchmark W2V training words/sec against the number of workers for the ways a column can be fed to gensim."""
+import os
+import tempfile
+import time
+
+import click
+import numpy as np
+import pandas
+from gensim.models import Word2Vec
+
+from anomaly_detector.config import Configuration
+from anomaly_detector.model import W2VModel
+from anomaly_detector.model.w2v_model import MAX_SENTENCE_LENGTH
+
+
+def synthetic_words(rows, vocab):
+    """Column of log messages following each other like the lines of a few interleaved services."""
+    rng = np.random.RandomState(0)
+    successors = rng.randint(0, vocab, size=(vocab, 4))
+    words = np.empty(rows, dtype=np.int64)
+    words[0] = 0
+    steps = rng.randint(0, 4, size=rows)
+    for i in range(1, rows):
+        words[i] = successors[words[i - 1], steps[i]]
+    return pandas.DataFrame({"message": ["message%d" % word for word in words]})
+
+
+@click.command()
+@click.option("--rows", default=300000, help="number of log messages in the training column")
+@click.option("--vocab", default=2000, help="number of distinct messages")
+@click.option("--workers", default="1,2,4,8", help="comma separated W2V_WORKERS values")
+@click.option("--sentence-length", default=1000, help="W2V_SENTENCE_LENGTH of the chunked corpora")
+@click.option("--iterations", default=5, help="W2V_ITER, number of epochs over the corpus")
+def main(rows, vocab, workers, sentence_length, iterations):
+    """Print trained words/sec of one sentence per column, chunked sentences in memory and on disk."""
+    words = synthetic_words(rows, vocab)
+    corpus_dir = tempfile.mkdtemp()
+    modes = (("single", None, ""), ("memory", sentence_length, ""), ("file", sentence_length, corpus_dir))
+
+    click.echo("{:>8} {:>8} {:>14} {:>14}".format("workers", "corpus", "trained words", "words/sec"))
+    for n_workers in [int(w) for w in workers.split(",")]:
+        for name, length, directory in modes:
+            config = Configuration()
+            config.W2V_WORKERS = n_workers
+            config.W2V_ITER = iterations
+            start = time.time()
+            if length is None:
+                # The column as a single sentence, the way it was fed to gensim before, words past
+                # MAX_SENTENCE_LENGTH are not trained
+                Word2Vec([list(words["message"])], min_count=config.W2V_MIN_COUNT, size=config.TRAIN_VECTOR_LENGTH,
+                         window=config.TRAIN_WINDOW, iter=iterations, workers=n_workers, seed=config.W2V_SEED)
+                trained = min(rows, MAX_SENTENCE_LENGTH) * iterations
+            else:
+                config.W2V_SENTENCE_LENGTH = length
+                config.W2V_CORPUS_DIR = directory
+                W2VModel(config=config).create(words, config.TRAIN_VECTOR_LENGTH, config.TRAIN_WINDOW)
+                trained = rows * iterations
+            elapsed = max(time.time() - start, 1e-9)
+            click.echo("{:>8} {:>8} {:>14} {:>14.0f}".format(n_workers, name, trained, trained / elapsed))
+    for name in os.listdir(corpus_dir):
+        os.remove(os.path.join(corpus_dir, name))
+    os.rmdir(corpus_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,54 +15,75 @@ class Spec(Enum):
 
 
 @pytest.fixture(scope='module')
-def cnf_hadoop_2k():
+def cnf_hadoop_2k(tmp_path_factory):
     """Initialize configurations before testing."""
     config = Configuration()
     config.STORAGE_DATASOURCE = "local"
     config.STORAGE_DATASINK = "stdout"
     config.LS_INPUT_PATH = "validation_data/Hadoop_2k.json"
+    models = tmp_path_factory.mktemp("models")
+    config.MODEL_PATH = str(models / "SOM.model")
+    config.W2V_MODEL_PATH = str(models / "W2V.model")
+    return config
+
+
+@pytest.fixture
+def cnf_hadoop_2k_tmp(tmp_path):
+    """Configurations reading Hadoop_2k.json for a single test, which keeps its models in tmp_path."""
+    config = Configuration()
+    config.STORAGE_DATASOURCE = "local"
+    config.STORAGE_DATASINK = "stdout"
+    config.LS_INPUT_PATH = "validation_data/Hadoop_2k.json"
+    config.MODEL_PATH = str(tmp_path / "SOM.model")
+    config.W2V_MODEL_PATH = str(tmp_path / "W2V.model")
     return config
 
 
 @pytest.fixture(scope='module')
-def cnf_wrong_settings():
+def cnf_wrong_settings(tmp_path_factory):
     """Initialize configurations before testing."""
     config = Configuration()
     config.STORAGE_DATASOURCE = "local.source"
     config.STORAGE_DATASINK = "local.sink"
     config.LS_INPUT_PATH = "validation_data/orders-500.log"
-    config.LS_OUTPUT_PATH = "validation_data/results-oct4.1.txt"
+    config.LS_OUTPUT_PATH = str(tmp_path_factory.mktemp("results") / "results-oct4.1.txt")
     return config
 
 
 @pytest.fixture(scope='module')
-def cnf_100K_events():
+def cnf_100K_events(tmp_path_factory):
     """Provide default configurations to load yaml instead of env var."""
     config = Configuration()
     config.STORAGE_DATASOURCE = "local"
     config.STORAGE_DATASINK = "stdout"
     config.LS_INPUT_PATH = "validation_data/log_anomaly_detector-100000-events.json"
+    models = tmp_path_factory.mktemp("models")
+    config.MODEL_PATH = str(models / "SOM.model")
+    config.W2V_MODEL_PATH = str(models / "W2V.model")
     return config
 
 
 @pytest.fixture(scope='module')
-def cnf_localdir():
+def cnf_localdir(tmp_path_factory):
     """Initialize configurations before testing."""
     config = Configuration()
     config.STORAGE_DATASOURCE = "localdir"
     config.STORAGE_DATASINK = "stdout"
     config.LS_INPUT_PATH = "validation_data/test_sample_input"
+    models = tmp_path_factory.mktemp("models")
+    config.MODEL_PATH = str(models / "SOM.model")
+    config.W2V_MODEL_PATH = str(models / "W2V.model")
     return config
 
 
 @pytest.fixture(scope='module')
-def cnf_local_500():
+def cnf_local_500(tmp_path_factory):
     """Initialize configurations before testing."""
     config = Configuration()
     config.STORAGE_DATASOURCE = "local"
     config.STORAGE_DATASINK = "local"
     config.LS_INPUT_PATH = "validation_data/orders-500.log"
-    config.LS_OUTPUT_PATH = "validation_data/results-oct4.1.txt"
+    config.LS_OUTPUT_PATH = str(tmp_path_factory.mktemp("results") / "results-oct4.1.txt")
     return config
 
 
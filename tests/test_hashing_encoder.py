@@ -0,0 +1,68 @@
+"""Test hashing encoder model and its selection by the model adapter."""
+from anomaly_detector.adapters import SomModelAdapter, SomStorageAdapter
+from anomaly_detector.config import Configuration
+from anomaly_detector.core import SomTrainJob, SomInferenceJob
+from anomaly_detector.core.encoder import LogEncoderCatalog
+from anomaly_detector.exception import ModelLoadException
+from anomaly_detector.model import HashingEncoderModel, W2VModel
+import numpy as np
+import pandas
+import pytest
+
+
+@pytest.mark.core
+@pytest.mark.hashing_encoder
+def test_hashing_encoder_vectors(tmp_path):
+    """Test that equal messages get equal unit vectors without training and that missing values are zeros."""
+    config = Configuration()
+    config.W2V_MODEL_PATH = str(tmp_path / "W2V.model")
+    encoder = LogEncoderCatalog("hashing_encoder", config)
+    model = encoder.build()
+    assert isinstance(model, HashingEncoderModel)
+    vectors = encoder.one_vector(pandas.DataFrame({"message": ["INFOmainorgapache", "WARNretry", None,
+                                                               "INFOmainorgapache"]}))
+    assert vectors.shape == (4, 1 + config.HASHING_VECTOR_LENGTH)
+    assert np.all(vectors[:, 0] == 0)
+    np.testing.assert_array_equal(vectors[0], vectors[3])
+    assert not np.array_equal(vectors[0], vectors[1])
+    np.testing.assert_allclose(np.linalg.norm(vectors[[0, 1, 3], 1:], axis=1), 1.0)
+    assert not vectors[2].any()
+
+    encoder.encode_log(pandas.DataFrame({"message": ["WARNretry"]}))
+    loaded = HashingEncoderModel(config=config)
+    loaded.load(config.W2V_MODEL_PATH)
+    assert loaded.state() == model.state()
+
+
+@pytest.mark.core
+@pytest.mark.hashing_encoder
+def test_hashing_encoder_jobs(cnf_hadoop_2k_tmp):
+    """Test that the model adapter trains and infers with the hashing encoder selected by LOG_ENCODER."""
+    config = cnf_hadoop_2k_tmp
+    config.INFER_LOOPS = 1
+    config.LOG_ENCODER = "hashing_encoder"
+    model_adapter = SomModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+    assert isinstance(model_adapter.w2v_model, HashingEncoderModel)
+    result, dist = SomTrainJob(node_map=2, model_adapter=model_adapter).execute()
+    assert model_adapter.model.get().shape[-1] == 1 + config.HASHING_VECTOR_LENGTH
+    assert len(dist) == 2000
+
+    model_adapter = SomModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+    assert SomInferenceJob(model_adapter=model_adapter, sleep=False).execute() == 0
+
+    config.LOG_ENCODER = "unknown"
+    with pytest.raises(ValueError):
+        SomModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+
+
+@pytest.mark.core
+@pytest.mark.hashing_encoder
+def test_hashing_encoder_rejects_w2v_model(tmp_path):
+    """Test that a W2V model left at W2V_MODEL_PATH is not loaded as the hashing encoder."""
+    config = Configuration()
+    config.W2V_MODEL_PATH = str(tmp_path / "W2V.model")
+    w2v_model = W2VModel(config=config)
+    w2v_model.create(pandas.DataFrame({"message": ["INFOmainorgapache", "WARNretry"]}), 5, 2)
+    w2v_model.save(config.W2V_MODEL_PATH)
+    with pytest.raises(ModelLoadException):
+        LogEncoderCatalog("hashing_encoder", config).build()
@@ -0,0 +1,53 @@
+"""Test isolation forest model and adapter."""
+from anomaly_detector.adapters import IsolationForestModelAdapter, SomStorageAdapter
+from anomaly_detector.config import Configuration
+from anomaly_detector.core import DetectorPipelineCatalog, SomTrainJob, SomInferenceJob
+from anomaly_detector.model import IsolationForestModel
+from anomaly_detector.model.umatrix import UMATRIX_IMAGE
+import numpy as np
+import pytest
+
+
+@pytest.mark.core
+@pytest.mark.iforest_model
+def test_isolation_forest_scoring(tmp_path):
+    """Test that outliers score higher and that batched and threaded scoring match scoring at once."""
+    config = Configuration()
+    config.IFOREST_BATCH_SIZE = 100
+    config.MODEL_FORMAT = "native"
+    model = IsolationForestModel(config=config)
+    inp = np.random.RandomState(0).normal(size=(1000, 5))
+    model.train(inp, parallelism=2)
+    outliers = np.full((10, 5), 10.0)
+    scores = model.get_anomaly_score(np.concatenate((inp, outliers)), parallelism=2)
+    assert scores[-10:].min() > scores[:-10].max()
+    np.testing.assert_allclose(scores, -model.get().score_samples(np.concatenate((inp, outliers))))
+
+    model.set_metadata((0.5, 0.1, 1.0, 0.0, 1))
+    model.save(str(tmp_path / "IF.model"))
+    loaded = IsolationForestModel(config=config)
+    loaded.load(str(tmp_path / "IF.model"))
+    assert loaded.state() == model.state()
+    np.testing.assert_allclose(loaded.get_anomaly_score(outliers, parallelism=1), scores[-10:])
+
+
+@pytest.mark.core
+@pytest.mark.iforest_model
+def test_isolation_forest_jobs(tmp_path, pipeline, cnf_hadoop_2k_tmp):
+    """Test that the isolation forest trains, without a U-matrix, and infers through the jobs and the catalog."""
+    config = cnf_hadoop_2k_tmp
+    config.MODEL_PATH = str(tmp_path / "IF.model")
+    config.INFER_LOOPS = 1
+    config.SOM_UMATRIX_DIR = str(tmp_path)
+    model_adapter = IsolationForestModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+    result, dist = SomTrainJob(model_adapter=model_adapter).execute()
+    assert len(dist) == 2000
+    assert np.max(dist) == 1.0
+    model_adapter.close()
+    # Forests have no codebook, no U-matrix is rendered for them
+    assert not (tmp_path / UMATRIX_IMAGE).exists()
+
+    model_adapter = IsolationForestModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+    assert SomInferenceJob(model_adapter=model_adapter, sleep=False).execute() == 0
+    DetectorPipelineCatalog(config=config, feedback_strategy=None, job="iforest.train.inference").get_pipeline()
+    assert [type(step) for step in pipeline.steps] == [SomTrainJob, SomInferenceJob]
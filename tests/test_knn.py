@@ -0,0 +1,63 @@
+"""Test kNN model and adapter."""
+from anomaly_detector.adapters import KNNModelAdapter, SomStorageAdapter
+from anomaly_detector.config import Configuration
+from anomaly_detector.core import SomTrainJob, SomInferenceJob
+from anomaly_detector.model import IVFKNNModel
+from anomaly_detector.model.umatrix import UMATRIX_IMAGE
+import numpy as np
+import pytest
+
+
+@pytest.mark.core
+@pytest.mark.knn_model
+def test_ivf_knn_scoring(tmp_path):
+    """Test that probing every list is exact kNN without self matches in training, and the index is mmapped."""
+    config = Configuration()
+    config.MODEL_PRECISION = "float64"
+    config.IVF_NLIST = 32
+    config.IVF_NPROBE = 32
+    config.IVF_BLOCK_SIZE = 128
+    rng = np.random.RandomState(0)
+    inp, logs = rng.normal(size=(3000, 8)), rng.normal(size=(500, 8))
+    model = IVFKNNModel(config=config)
+    model.train(inp, parallelism=2)
+    dist = np.linalg.norm(logs[:, np.newaxis, :] - inp[np.newaxis, :, :], axis=-1)
+    exact = np.sort(dist, axis=1)[:, :config.IVF_K].mean(axis=1)
+    np.testing.assert_allclose(model.get_anomaly_score(logs, parallelism=2), exact)
+    # Training logs are scored without themselves, like logs never seen in training
+    dist = np.linalg.norm(inp[:, np.newaxis, :] - inp[np.newaxis, :, :], axis=-1)
+    np.testing.assert_allclose(model.train_dist, np.sort(dist, axis=1)[:, 1:config.IVF_K + 1].mean(axis=1))
+    assert abs(np.mean(model.train_dist) - np.mean(exact)) < 0.05 * np.mean(exact)
+
+    config.IVF_NPROBE = 4
+    scores = model.get_anomaly_score(logs, parallelism=1)
+    assert np.all(scores >= exact - 1e-9)
+    assert np.mean((scores - exact) / exact) < 0.05
+
+    model.set_metadata((0.5, 0.1, 1.0, 0.0, model.epochs))
+    model.save(str(tmp_path / "KNN.model"))
+    loaded = IVFKNNModel(config=config)
+    loaded.load(str(tmp_path / "KNN.model"))
+    assert isinstance(loaded.get()["vectors"], np.memmap)
+    np.testing.assert_allclose(loaded.get_anomaly_score(logs, parallelism=1), scores)
+
+
+@pytest.mark.core
+@pytest.mark.knn_model
+def test_knn_jobs(tmp_path, cnf_hadoop_2k_tmp):
+    """Test that the kNN model trains and infers through the jobs."""
+    config = cnf_hadoop_2k_tmp
+    config.MODEL_PATH = str(tmp_path / "KNN.model")
+    config.IVF_NLIST = 16
+    config.INFER_LOOPS = 1
+    config.SOM_UMATRIX_DIR = str(tmp_path)
+    model_adapter = KNNModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+    result, dist = SomTrainJob(model_adapter=model_adapter).execute()
+    assert len(dist) == 2000
+    assert np.max(dist) == 1.0
+    model_adapter.close()
+    # Indexes have no codebook, no U-matrix is rendered for them
+    assert not (tmp_path / UMATRIX_IMAGE).exists()
+
+    model_adapter = KNNModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+    assert SomInferenceJob(model_adapter=model_adapter, sleep=False).execute() == 0
@@ -1,11 +1,17 @@
 """Validates if training was successful."""
+from anomaly_detector.adapters.model_registry import ModelRegistry
 from anomaly_detector.adapters.som_model_adapter import SomModelAdapter
 from anomaly_detector.adapters.som_storage_adapter import SomStorageAdapter
 from anomaly_detector.core.job import SomTrainJob, SomInferenceJob
 from anomaly_detector.config import Configuration
+from anomaly_detector.model import SOMModel, SOMPYModel
+from anomaly_detector.model.quantile_sketch import TDigest
 
+import numpy as np
+import os
 import pytest
 import random
+import sys
 
 random.seed(55)
 
@@ -43,3 +49,490 @@ def test_model_shape(cnf_hadoop_2k):
     tc = SomTrainJob(node_map=2, model_adapter=model_adapter)
     result, dist = tc.execute()
     assert model_adapter.model.model.shape[0:2] == (2, 2)
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+@pytest.mark.parametrize("map_size", [24, 5])
+def test_vectorized_training_parity(map_size):
+    """Test that the vectorized online trainer produces the same map as the reference loop."""
+    inp = np.random.rand(200, 6)
+    vectorized = SOMModel()
+    vectorized.set(np.random.rand(map_size, map_size, inp.shape[1]))
+    reference = SOMModel()
+    reference.set(vectorized.get().copy())
+    np.random.seed(7)
+    vectorized.train(inp, map_size, 300, 1)
+    np.random.seed(7)
+    reference._train_loop(inp, 300)
+    assert np.allclose(vectorized.get(), reference.get())
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_batch_training_mode(monkeypatch, cnf_hadoop_2k_tmp):
+    """Test that batch SOM training is selected from config and scores every training log while training."""
+    config = cnf_hadoop_2k_tmp
+    config.SOM_TRAIN_MODE = "batch"
+    config.SOM_BATCH_EPOCHS = 3
+    config.SOM_BLOCK_SIZE = 256
+    storage_adapter = SomStorageAdapter(config=config, feedback_strategy=None)
+    model_adapter = SomModelAdapter(storage_adapter=storage_adapter)
+    assert isinstance(model_adapter.model, SOMModel)
+    scored = []
+
+    def get_anomaly_score(model, log, parallelism, original=SOMModel.get_anomaly_score):
+        """Record the number of logs scored after training."""
+        scored.append(len(log))
+        return original(model, log, parallelism)
+    monkeypatch.setattr(SOMModel, "get_anomaly_score", get_anomaly_score)
+    tc = SomTrainJob(node_map=4, model_adapter=model_adapter)
+    result, dist = tc.execute()
+    assert len(dist) == 2000
+    assert not scored
+    assert np.max(dist) == 1
+    assert np.isclose(model_adapter.model.get_metadata()[0], np.mean(dist))
+    assert np.isclose(model_adapter.model.get_metadata()[1], np.std(dist))
+    assert model_adapter.model.model.shape[0:2] == (4, 4)
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_blocked_scoring_matches_loop():
+    """Test that the blocked scoring engine returns the same minimum distances as the per node loop."""
+    config = Configuration()
+    config.SOM_BLOCK_SIZE = 64
+    model = SOMPYModel(config=config)
+    model.set(np.random.rand(24, 24, 6))
+    logs = np.random.rand(300, 6)
+    dist = model.get_anomaly_score(logs, 1)
+    assert len(dist) == 300
+    assert np.array_equal(dist, [model.calculate_anomaly_score(log) for log in logs])
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+@pytest.mark.parametrize("index", ["", "kd_tree", "hierarchical"])
+def test_shared_scoring_pool(index):
+    """Test that the shared memory scoring pool matches in process scoring with every SOM_INDEX and codebook swap."""
+    pytest.importorskip("multiprocessing.shared_memory")
+    from anomaly_detector.model.scoring_pool import SharedMemoryScoringPool
+
+    config = Configuration()
+    config.SOM_INDEX = index
+    config.SOM_COARSE_TOP_K = 1
+    model = SOMPYModel(config=config)
+    pool = SharedMemoryScoringPool(processes=2, block_size=128, config=config)
+    try:
+        for _ in range(2):
+            model.set(np.random.rand(6, 6, 5))
+            pool.publish(model.get())
+            logs = np.random.rand(1000, 5)
+            assert np.array_equal(pool.score(logs), model.get_anomaly_score(logs, 1))
+    finally:
+        pool.close()
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_shared_scoring_pool_python_version(monkeypatch):
+    """Test that the shared memory scoring pool is rejected on python versions without shared memory."""
+    monkeypatch.setenv("LAD_SOM_SHARED_SCORING_POOL", "true")
+    assert Configuration().SOM_SHARED_SCORING_POOL
+    monkeypatch.setattr(sys, "version_info", (3, 7, 0))
+    with pytest.raises(ValueError):
+        Configuration()
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+@pytest.mark.parametrize("index", ["kd_tree", "ball_tree"])
+def test_codebook_index_scoring(index):
+    """Test that scoring through a codebook index gives the same distances as the exhaustive scan."""
+    config = Configuration()
+    logs = np.random.rand(500, 5)
+    codebook = np.random.rand(30, 30, 5)
+    exhaustive = SOMPYModel(config=config)
+    exhaustive.set(codebook)
+    expected = exhaustive.get_anomaly_score(logs, 1)
+    config.SOM_INDEX = index
+    indexed = SOMPYModel(config=config)
+    indexed.set(codebook)
+    assert np.array_equal(indexed.get_anomaly_score(logs, 1), expected)
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_hierarchical_scoring():
+    """Test that hierarchical search is exact when it searches all regions and never beats exact search."""
+    config = Configuration()
+    config.SOM_INDEX = "hierarchical"
+    config.SOM_COARSE_REGION_SIZE = 4
+    logs = np.random.rand(500, 5)
+    codebook = np.random.rand(10, 10, 5)
+    exact = SOMPYModel()
+    exact.set(codebook)
+    expected = exact.get_anomaly_score(logs, 1)
+    config.SOM_COARSE_TOP_K = 1
+    approximate = SOMPYModel(config=config)
+    approximate.set(codebook)
+    assert np.all(approximate.get_anomaly_score(logs, 1) >= expected)
+    config.SOM_COARSE_TOP_K = 9
+    complete = SOMPYModel(config=config)
+    complete.set(codebook)
+    assert np.array_equal(complete.get_anomaly_score(logs, 1), expected)
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_float32_precision(tmp_path):
+    """Test that float32 precision is carried through training and float64 models still load."""
+    config = Configuration()
+    config.MODEL_PRECISION = "float32"
+    model = SOMModel(config=config)
+    model.train(np.random.rand(100, 5), 4, 50, 1)
+    assert model.get().dtype == np.float32
+    assert model.get_anomaly_score(np.random.rand(10, 5), 1).dtype == np.float32
+
+    legacy = SOMPYModel()
+    legacy.set(np.random.rand(4, 4, 5))
+    legacy.set_metadata((0.0, 1.0, 1.0, 0.0))
+    legacy.save(str(tmp_path / "SOM.model"))
+    loaded = SOMPYModel(config=config)
+    loaded.load(str(tmp_path / "SOM.model"))
+    assert loaded.get().dtype == np.float32
+    assert np.allclose(loaded.get(), legacy.get())
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_native_model_format(tmp_path):
+    """Test that native format models are memory mapped on load and replace joblib files in place."""
+    config = Configuration()
+    dest = str(tmp_path / "SOM.model")
+    legacy = SOMPYModel(config=config)
+    legacy.set(np.random.rand(4, 4, 5))
+    legacy.set_metadata((0.5, 0.1, 2.0, 0.0))
+    legacy.save(dest)
+
+    config.MODEL_FORMAT = "native"
+    native = SOMPYModel(config=config)
+    native.load(dest)
+    native.save(dest)
+    loaded = SOMPYModel(config=config)
+    loaded.load(dest)
+    assert isinstance(loaded.get(), np.memmap)
+    assert np.array_equal(loaded.get(), legacy.get())
+    assert loaded.get_metadata() == legacy.get_metadata()
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_native_model_replaced_atomically(tmp_path, monkeypatch):
+    """Test that a loader finds a complete model at every rename of a native format model being saved again."""
+    config = Configuration()
+    config.MODEL_FORMAT = "native"
+    dest = str(tmp_path / "SOM.model")
+    model = SOMPYModel(config=config)
+    model.set(np.random.rand(4, 4, 5))
+    model.set_metadata((0.5, 0.1, 2.0, 0.0))
+    model.save(dest)
+
+    def loading(rename):
+        """Load the model right before and after every rename, like a concurrent loader would."""
+        def renamed(src, dst):
+            SOMPYModel(config=config).load(dest)
+            rename(src, dst)
+            SOMPYModel(config=config).load(dest)
+        return renamed
+
+    monkeypatch.setattr(os, "rename", loading(os.rename))
+    monkeypatch.setattr(os, "replace", loading(os.replace))
+    model.save(dest)
+    monkeypatch.undo()
+    loaded = SOMPYModel(config=config)
+    loaded.load(dest)
+    assert np.array_equal(loaded.get(), model.get())
+    assert sorted(os.listdir(str(tmp_path))) == sorted(["SOM.model", os.readlink(dest)])
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_warm_start_training(cnf_hadoop_2k_tmp):
+    """Test that a saved model is trained further on new logs and rebuilt when the logs drifted too far."""
+    config = cnf_hadoop_2k_tmp
+    config.TRAIN_WARM_START = True
+    storage_adapter = SomStorageAdapter(config=config, feedback_strategy=None)
+    model_adapter = SomModelAdapter(storage_adapter=storage_adapter)
+    tc = SomTrainJob(node_map=4, model_adapter=model_adapter, warm_start=True)
+    assert not model_adapter.load_for_warm_start(4)
+    result, dist = tc.execute()
+    assert model_adapter.load_for_warm_start(4)
+    assert not model_adapter.load_for_warm_start(5)
+
+    model_adapter.load_for_warm_start(4)
+    codebook = np.array(model_adapter.model.get())
+    result, dist = tc.execute()
+    assert len(dist) == 2000
+    assert not np.array_equal(model_adapter.model.get(), codebook)
+
+    config.TRAIN_WARM_START_MAX_DRIFT = 0
+    model_adapter.load_for_warm_start(4)
+    dataframe, _ = model_adapter.preprocess(config_type="warm", recreate_model=False)
+    assert model_adapter.warm_start(dataframe) is None
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_warm_start_scoring_space():
+    """Test that warm start moves the codebook towards the vectors as they are scored, not normalized ones."""
+    config = Configuration()
+    model = SOMPYModel(config=config)
+    model.set(np.zeros((4, 4, 3)))
+    inp = np.random.RandomState(0).normal(loc=100.0, size=(500, 3))
+    model.train_warm(inp, rough_len=5, finetune_len=5, parallelism=1)
+    np.testing.assert_allclose(model.get().mean(axis=(0, 1)), inp.mean(axis=0), atol=1.0)
+    assert np.mean(model.get_anomaly_score(inp, parallelism=1)) < 2.0
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_online_inference_updates(cnf_hadoop_2k_tmp):
+    """Test that inference with online updates moves the SOM towards normal logs and checkpoints it."""
+    config = cnf_hadoop_2k_tmp
+    config.INFER_LOOPS = 2
+    config.INFER_ONLINE_MAX_UPDATES = 200
+    config.INFER_ONLINE_CHECKPOINT_LOOPS = 3
+    model_adapter = SomModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+    SomTrainJob(node_map=4, model_adapter=model_adapter).execute()
+    codebook = np.array(model_adapter.model.get())
+
+    model_adapter = SomModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+    tc_infer = SomInferenceJob(model_adapter=model_adapter, sleep=False, online_update=True)
+    assert tc_infer.execute() == 0
+    assert not np.array_equal(model_adapter.model.get(), codebook)
+    assert model_adapter.update_online(threshold=np.inf, infer_loop=0) == 0
+
+    checkpoint = SOMPYModel(config=config)
+    checkpoint.load(config.MODEL_PATH)
+    assert np.array_equal(checkpoint.get(), model_adapter.model.get())
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_score_cache(tmp_path, cnf_hadoop_2k_tmp):
+    """Test that cached inference scores match uncached ones and are dropped when the model changes."""
+    config = cnf_hadoop_2k_tmp
+    model_adapter = SomModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+    SomTrainJob(node_map=4, model_adapter=model_adapter).execute()
+    data, _ = model_adapter.preprocess(config_type="infer", recreate_model=False)
+    expected = model_adapter.process_anomaly_score(data)
+
+    config.INFER_SCORE_CACHE_SIZE = 100
+    config.INFER_SCORE_CACHE_PATH = str(tmp_path / "scores.db")
+    model_adapter = SomModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+    model_adapter.load_w2v_model()
+    model_adapter.load_som_model()
+    assert np.allclose(model_adapter.process_anomaly_score(data), expected)
+    assert len(model_adapter.score_cache) == 100
+    assert np.allclose(model_adapter.process_anomaly_score(data), expected)
+    model_adapter.close()
+    # A closed adapter holds no cache, it is reopened from disk when the adapter is used again
+    assert model_adapter.score_cache is None
+    assert np.allclose(model_adapter.process_anomaly_score(data), expected)
+    assert len(model_adapter.score_cache) == 100
+    model_adapter.close()
+
+    # Scores survive a restart on disk and are dropped once the model is retrained
+    model_adapter = SomModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+    model_adapter.load_w2v_model()
+    model_adapter.load_som_model()
+    scores, missing = model_adapter.get_score_cache().get(model_adapter.score_keys(data))
+    assert len(missing) < len(data)
+    model_adapter.train(node_map=4, data=data)
+    scores, missing = model_adapter.get_score_cache().get(model_adapter.score_keys(data))
+    assert len(missing) == len(data)
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_deduplicated_scoring(cnf_hadoop_2k):
+    """Test that scoring every distinct log once gives the same scores as scoring every row."""
+    model_adapter = SomModelAdapter(SomStorageAdapter(config=cnf_hadoop_2k, feedback_strategy=None))
+    SomTrainJob(node_map=4, model_adapter=model_adapter).execute()
+    data, _ = model_adapter.preprocess(config_type="infer", recreate_model=False)
+    expected = model_adapter.model.get_anomaly_score(model_adapter.w2v_model.one_vector(data), 1)
+    dist = model_adapter.process_anomaly_score(data)
+    assert len(dist) == len(data)
+    assert np.array_equal(dist, expected / model_adapter.model.get_metadata()[2])
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_u_matrix(tmp_path):
+    """Test that the U-matrix is computed for any map size and rendered in the background."""
+    from anomaly_detector.model.umatrix import UMatrixRenderer, u_matrix
+
+    codebook = np.zeros((3, 5, 4))
+    codebook[1, 2] = 1
+    umatrix = u_matrix(codebook)
+    assert umatrix.shape == (3, 5)
+    assert umatrix[1, 2] == 2
+    assert umatrix[0, 1] == 2 / 5
+    assert umatrix[0, 4] == 0
+
+    renderer = UMatrixRenderer()
+    path = renderer.submit(np.random.rand(6, 9, 4), str(tmp_path)).result()
+    renderer.close()
+    assert path == str(tmp_path / "U-map.png")
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_early_stopping(cnf_hadoop_2k):
+    """Test that training stops once the held out quantization error converged and records the epochs."""
+    config = Configuration()
+    config.SOM_TRAIN_MODE = "batch"
+    config.SOM_BATCH_EPOCHS = 100
+    config.SOM_EARLY_STOPPING = True
+    config.SOM_EARLY_STOPPING_TOLERANCE = 0.5
+    config.SOM_EARLY_STOPPING_SAMPLE = 100
+    model = SOMModel(config=config)
+    model.train(np.random.rand(1000, 5), 6, 0, 1)
+    assert model.epochs < 100
+
+    storage_adapter = SomStorageAdapter(config=cnf_hadoop_2k, feedback_strategy=None)
+    model_adapter = SomModelAdapter(storage_adapter=storage_adapter)
+    SomTrainJob(node_map=4, model_adapter=model_adapter).execute()
+    assert model_adapter.model.get_metadata()[4] == model_adapter.model.epochs > 0
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_sompy_early_stopping(cnf_hadoop_2k_tmp):
+    """Test that SOMPY training stops before the end of its rough and fine tuning schedule once converged."""
+    config = cnf_hadoop_2k_tmp
+    config.SOM_EARLY_STOPPING = True
+    config.SOM_EARLY_STOPPING_TOLERANCE = 0.5
+    config.SOM_EARLY_STOPPING_SAMPLE = 100
+    schedule = config.SOMPY_TRAIN_ROUGH_LEN + config.SOMPY_TRAIN_FINETUNE_LEN
+    model = SOMPYModel(config=config)
+    model.train(np.random.rand(1000, 5), 6, 0, 1)
+    assert 0 < model.epochs < schedule
+    assert model.get().shape == (6, 6, 5)
+
+    model_adapter = SomModelAdapter(storage_adapter=SomStorageAdapter(config=config, feedback_strategy=None))
+    assert isinstance(model_adapter.model, SOMPYModel)
+    SomTrainJob(node_map=4, model_adapter=model_adapter).execute()
+    assert model_adapter.model.get_metadata()[4] == model_adapter.model.epochs < schedule
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+@pytest.mark.parametrize("early_stopping", [False, True])
+def test_sompy_raw_space(early_stopping):
+    """Test that SOMPY codebooks and training distances are in the space of the vectors, not the normalized one."""
+    config = Configuration()
+    config.SOM_EARLY_STOPPING = early_stopping
+    config.SOMPY_TRAIN_ROUGH_LEN = 5
+    config.SOMPY_TRAIN_FINETUNE_LEN = 5
+    inp = 100 + 10 * np.random.rand(1000, 5)
+    model = SOMPYModel(config=config)
+    model.train(inp, 6, 0, 1)
+    assert np.allclose(model.get().mean(axis=(0, 1)), inp.mean(axis=0), atol=1)
+    dist = model.get_anomaly_score(inp, 1)
+    trained = ~np.isnan(model.train_dist)
+    assert np.all(model.train_dist[trained] >= dist[trained] - 1e-3)
+    assert np.nanmean(model.train_dist) < 2 * dist.mean()
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_digest_moments():
+    """Test that the score digest keeps the exact mean and standard deviation through merging and scaling."""
+    values = np.random.lognormal(size=10000)
+    digest, other = TDigest(), TDigest()
+    digest.update(values[:3000])
+    other.update(values[3000:])
+    digest.merge(other)
+    digest = TDigest.from_dict(digest.to_dict())
+    digest.scale(0.5)
+    assert np.isclose(digest.mean, np.mean(values) / 2)
+    assert np.isclose(digest.std, np.std(values) / 2)
+    assert digest.max == np.max(values) / 2
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_quantile_threshold(cnf_hadoop_2k_tmp):
+    """Test that the quantile threshold comes from a score digest saved with the model and updated in inference."""
+    config = cnf_hadoop_2k_tmp
+    config.INFER_THRESHOLD_MODE = "quantile"
+    config.INFER_THRESHOLD_QUANTILE = 0.9
+    config.INFER_LOOPS = 1
+    model_adapter = SomModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+    result, dist = SomTrainJob(node_map=4, model_adapter=model_adapter).execute()
+    mean, threshold = model_adapter.set_threshold()
+    assert np.quantile(dist, 0.8) <= threshold <= np.max(dist)
+
+    config.SOM_SHARED_SCORING_POOL = True
+    model_adapter = SomModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+    assert SomInferenceJob(model_adapter=model_adapter, sleep=False).execute() == 0
+    assert model_adapter.scoring_pool is None
+    assert model_adapter.threshold_digest.count == 2 * len(dist)
+    model_adapter.load_som_model()
+    assert model_adapter.threshold_digest.count == 2 * len(dist)
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_model_registry(tmp_path, monkeypatch, cnf_hadoop_2k_tmp):
+    """Test that logs are routed to the model of their tenant and least recently used models are unloaded."""
+    config = cnf_hadoop_2k_tmp
+    config.MODEL_REGISTRY_KEY = "kubernetes.namespace_name"
+    config.MODEL_REGISTRY_MAX_BYTES = 1
+    config.SOM_SHARED_SCORING_POOL = True
+    registry = ModelRegistry(SomStorageAdapter(config=config, feedback_strategy=None))
+    routes = registry.route([{"kubernetes": {"namespace_name": "a"}}, {"message": "b"},
+                             {"kubernetes": {"namespace_name": "a"}}])
+    assert list(routes) == ["a", "default"]
+    assert routes["a"].tolist() == [0, 2]
+
+    result, dist = SomTrainJob(node_map=4, model_adapter=registry).execute()
+    assert len(dist) == 2000
+    assert (tmp_path / "default" / "SOM.model").exists()
+    assert (tmp_path / "default" / "W2V.model").exists()
+
+    registry.get("other")
+    assert list(registry.adapters) == ["other"]
+    assert registry.get("default").model.get() is not None
+    assert registry.get("default").scoring_pool is None
+    assert list(registry.adapters) == ["default"]
+
+    thresholds = []
+
+    def set_threshold(adapter, original=SomModelAdapter.set_threshold):
+        """Record every threshold set by a tenant model adapter."""
+        thresholds.append(original(adapter))
+        return thresholds[-1]
+    monkeypatch.setattr(SomModelAdapter, "set_threshold", set_threshold)
+    config.INFER_LOOPS = 3
+    assert SomInferenceJob(model_adapter=registry, sleep=False, online_update=True).execute() == 0
+    assert len(thresholds) == 1
+
+
+@pytest.mark.core
+@pytest.mark.som_model
+def test_model_registry_saves_digests(cnf_hadoop_2k_tmp):
+    """Test that the score digests tenants learn during inference are saved when the job ends."""
+    config = cnf_hadoop_2k_tmp
+    config.MODEL_REGISTRY_KEY = "kubernetes.namespace_name"
+    config.INFER_THRESHOLD_MODE = "quantile"
+    config.INFER_LOOPS = 1
+    result, dist = SomTrainJob(node_map=4, model_adapter=ModelRegistry(
+        SomStorageAdapter(config=config, feedback_strategy=None))).execute()
+    registry = ModelRegistry(SomStorageAdapter(config=config, feedback_strategy=None))
+    assert SomInferenceJob(model_adapter=registry, sleep=False).execute() == 0
+
+    registry = ModelRegistry(SomStorageAdapter(config=config, feedback_strategy=None))
+    assert registry.get("default").threshold_digest.count == 2 * len(dist)
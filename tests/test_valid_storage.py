@@ -1,10 +1,12 @@
 """Validates if training was successful."""
 import pytest
 
-from anomaly_detector.adapters import SomModelAdapter, SomStorageAdapter
+from anomaly_detector.adapters import FeedbackStrategy, SomModelAdapter, SomStorageAdapter
 from anomaly_detector.config import Configuration
 from anomaly_detector.core import SomTrainJob, SomInferenceJob
 from anomaly_detector.storage.local_storage import DefaultStorageAttribute
+from anomaly_detector.storage.storage import DataCleaner, UNKNOWN_TEMPLATE
+from anomaly_detector.storage.template_miner import TemplateMiner
 
 NUM_LOG_LINES = 812
 
@@ -31,3 +33,90 @@ def test_training_local_dir(cnf_localdir):
     tc_infer = SomInferenceJob(model_adapter=model_adapter, sleep=False)
     result = tc_infer.execute()
     assert result == 0
+
+
+@pytest.mark.storage
+@pytest.mark.parametrize("stratified", [False, True])
+def test_reservoir_sampled_training_data(stratified, cnf_hadoop_2k_tmp):
+    """Test that training loads a fixed size sample of logs with the raw logs kept in line."""
+    config = cnf_hadoop_2k_tmp
+    config.TRAIN_SAMPLE_SIZE = 500
+    config.TRAIN_SAMPLE_STRATIFIED = stratified
+    storage_adapter = SomStorageAdapter(config=config, feedback_strategy=None)
+    data, raw = storage_adapter.load_data("train")
+    assert len(data) == len(raw) == 500
+    for i in range(len(data)):
+        assert data["message"][i] == DataCleaner._clean_message(raw[i]["message"])
+
+
+@pytest.mark.storage
+def test_stratified_sample_data(cnf_hadoop_2k_tmp):
+    """Test that sampling loaded logs gives rare messages an equal share of the sample."""
+    config = cnf_hadoop_2k_tmp
+    config.TRAIN_SAMPLE_SIZE = 500
+    config.TRAIN_SAMPLE_STRATIFIED = True
+    storage_adapter = SomStorageAdapter(config=config, feedback_strategy=None)
+    data, raw = storage_adapter.retrieve_data(config.TRAIN_TIME_SPAN, config.TRAIN_MAX_ENTRIES, None)
+    sample, sample_raw = storage_adapter.sample_data(data, raw, chunk_size=300)
+    assert len(sample) == len(sample_raw) == 500
+    for i in range(len(sample)):
+        assert sample["message"][i] == DataCleaner._clean_message(sample_raw[i]["message"])
+    assert set(sample["message"]) == set(data["message"])
+    streamed, _ = storage_adapter.load_data("train")
+    assert set(streamed["message"]) == set(data["message"])
+
+
+@pytest.mark.storage
+@pytest.mark.parametrize("datasource, path", [("local", "validation_data/Hadoop_2k.json"),
+                                              ("localdir", "validation_data/test_sample_input")])
+def test_sampled_false_positives(datasource, path):
+    """Test that false positive feedback is added once to sampled training logs."""
+    config = Configuration()
+    config.STORAGE_DATASOURCE = datasource
+    config.STORAGE_DATASINK = "stdout"
+    config.LS_INPUT_PATH = path
+    config.TRAIN_SAMPLE_SIZE = 100
+    feedback = [{"message": "false positive %d" % i} for i in range(10)]
+    storage_adapter = SomStorageAdapter(config=config,
+                                        feedback_strategy=FeedbackStrategy(config, func=lambda ctx: feedback))
+    data, raw = storage_adapter.load_data("train")
+    assert len(data) == len(raw) == 110
+    assert raw[-10:] == feedback
+
+
+@pytest.mark.storage
+def test_template_miner():
+    """Test that messages differing in parameters share a template that survives a save and load."""
+    miner = TemplateMiner()
+    first = miner.add("Received block blk_1 of size 67108864 from 10.0.0.1")
+    assert miner.add("Received block blk_2 of size 1024 from 10.0.0.2") == first
+    assert miner.add("Deleting block blk_1 file /data/current/blk_1") != first
+    assert miner.template(first) == "Received block <*> of size <*> from <*>"
+    assert miner.match("Received block blk_9 of size 1 from 10.0.0.9") == first
+    assert miner.match("Replicating block blk_1 to 10.0.0.1") is None
+    assert len(miner) == 2
+
+    restored = TemplateMiner.from_dict(miner.to_dict())
+    assert restored.add("Received block blk_3 of size 1 from 10.0.0.3") == first
+    assert len(restored) == 2
+
+
+@pytest.mark.storage
+def test_template_mined_messages(tmp_path, cnf_hadoop_2k_tmp):
+    """Test that preprocessing replaces messages by template ids that are kept between runs."""
+    config = cnf_hadoop_2k_tmp
+    config.LOG_TEMPLATE_MINER = True
+    data, raw = SomStorageAdapter(config=config, feedback_strategy=None).load_data("train")
+    assert data["message"].str.startswith("template").all()
+    cleaned = {DataCleaner._clean_message(log["message"]) for log in raw}
+    assert data["message"].nunique() < len(cleaned)
+    assert (tmp_path / config.LOG_TEMPLATE_FILE).exists()
+
+    data_again, _ = SomStorageAdapter(config=config, feedback_strategy=None).load_data("train")
+    assert data_again["message"].tolist() == data["message"].tolist()
+
+    saved = (tmp_path / config.LOG_TEMPLATE_FILE).read_text()
+    config.LS_INPUT_PATH = "validation_data/log_anomaly_detector-1000-events.json"
+    infer, _ = SomStorageAdapter(config=config, feedback_strategy=None).load_data("infer")
+    assert (infer["message"] == UNKNOWN_TEMPLATE).any()
+    assert (tmp_path / config.LOG_TEMPLATE_FILE).read_text() == saved
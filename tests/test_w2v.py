@@ -1,9 +1,13 @@
 """Validates if training was successful."""
 from anomaly_detector.adapters.som_model_adapter import SomModelAdapter
 from anomaly_detector.adapters.som_storage_adapter import SomStorageAdapter
-from anomaly_detector.core.job import SomTrainJob
+from anomaly_detector.core.job import SomTrainJob, SomInferenceJob
+from anomaly_detector.model import W2VModel
+from anomaly_detector.model.w2v_model import SentenceCorpus
 import logging
 
+import numpy as np
+import pandas
 import pytest
 
 CONFIGURATION_PREFIX = "LAD"
@@ -54,3 +58,93 @@ def test_loss_value(cnf_hadoop2k_w2v_params):
     logging.info(model_adapter.w2v_model.model["message"].get_latest_training_loss())
     tl = model_adapter.w2v_model.model["message"].get_latest_training_loss()
     assert tl < 320000.0
+
+
+@pytest.mark.core
+@pytest.mark.w2v_model
+def test_one_vector(cnf_hadoop2k_w2v_params):
+    """Check that logs are encoded as a leading 0 and their embedding, with zeros for unknown messages."""
+    storage_adapter = SomStorageAdapter(config=cnf_hadoop2k_w2v_params, feedback_strategy=None)
+    model_adapter = SomModelAdapter(storage_adapter=storage_adapter)
+    SomTrainJob(node_map=2, model_adapter=model_adapter).execute()
+    log = 'INFOmainorgapachehadoopmapreducevappMRAppMasterExecutingwithtokens'
+    model_adapter.w2v_model.config.W2V_OOV_STRATEGY = "zero"
+    vectors = model_adapter.w2v_model.one_vector(pandas.DataFrame({"message": [log, "unknown", log]}))
+    model_adapter.w2v_model.config.W2V_OOV_STRATEGY = "hash"
+
+    wv = model_adapter.w2v_model.model["message"].wv
+    expected = np.zeros((3, 1 + cnf_hadoop2k_w2v_params.TRAIN_VECTOR_LENGTH), dtype=vectors.dtype)
+    expected[[0, 2], 1:] = wv[log]
+    np.testing.assert_array_equal(vectors, expected)
+
+
+@pytest.mark.core
+@pytest.mark.w2v_model
+def test_frozen_encoder(tmp_path, cnf_hadoop_2k_tmp):
+    """Check that inference with a frozen encoder leaves the W2V model alone and hashes unknown words."""
+    config = cnf_hadoop_2k_tmp
+    config.INFER_LOOPS = 1
+    config.INFER_FREEZE_ENCODER = True
+    model_adapter = SomModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+    SomTrainJob(node_map=2, model_adapter=model_adapter).execute()
+    saved = (tmp_path / "W2V.model").stat().st_mtime_ns
+
+    config.LS_INPUT_PATH = "validation_data/log_anomaly_detector-1000-events.json"
+    model_adapter = SomModelAdapter(SomStorageAdapter(config=config, feedback_strategy=None))
+    assert SomInferenceJob(model_adapter=model_adapter, sleep=False).execute() == 0
+    assert (tmp_path / "W2V.model").stat().st_mtime_ns == saved
+    assert len(model_adapter.w2v_model.get()["message"].wv.vocab) == 141
+
+    vectors = model_adapter.w2v_model.one_vector(pandas.DataFrame({"message": ["unknown", "other", "unknown"]}))
+    assert np.all(vectors[:, 1:] != 0)
+    np.testing.assert_array_equal(vectors[0], vectors[2])
+    assert not np.array_equal(vectors[0], vectors[1])
+
+
+@pytest.mark.core
+@pytest.mark.w2v_model
+def test_sentence_corpus(tmp_path, cnf_hadoop_2k_tmp):
+    """Check that a column is chunked into sentences and trained from a LineSentence file that is removed after."""
+    words = ["word%d" % i for i in range(25)]
+    corpus = SentenceCorpus(words, 10)
+    assert len(corpus) == 3
+    assert [len(sentence) for sentence in corpus] == [10, 10, 5]
+    assert list(corpus) == list(corpus)
+    assert corpus.plain() and not SentenceCorpus(["two words"]).plain()
+    corpus.save(str(tmp_path / "message.txt"))
+    assert (tmp_path / "message.txt").read_text().split() == words
+
+    config = cnf_hadoop_2k_tmp
+    config.W2V_SENTENCE_LENGTH = 100
+    config.W2V_CORPUS_DIR = str(tmp_path)
+    storage_adapter = SomStorageAdapter(config=config, feedback_strategy=None)
+    data, _ = storage_adapter.load_data("train")
+    model = W2VModel(config=config)
+    model.create(data, config.TRAIN_VECTOR_LENGTH, config.TRAIN_WINDOW)
+    assert len(model.get()["message"].wv.vocab) == 141
+    assert [path.name for path in tmp_path.iterdir()] == ["message.txt"]
+
+
+@pytest.mark.core
+@pytest.mark.w2v_model
+def test_bounded_vocab_update(cnf_hadoop_2k_tmp):
+    """Check that bounded updates keep known vectors, learn the new words and evict the least recently seen."""
+    config = cnf_hadoop_2k_tmp
+    config.W2V_MAX_VOCAB = 100
+    train, _ = SomStorageAdapter(config=config, feedback_strategy=None).load_data("train")
+    model = W2VModel(config=config)
+    model.create(train, config.TRAIN_VECTOR_LENGTH, config.TRAIN_WINDOW)
+    wv = model.get()["message"].wv
+    known = {word: wv[word].copy() for word in wv.vocab}
+    state = model.state()
+
+    config.LS_INPUT_PATH = "validation_data/log_anomaly_detector-1000-events.json"
+    logs, _ = SomStorageAdapter(config=config, feedback_strategy=None).load_data("train")
+    model.update(logs)
+    assert model.state() != state
+    wv = model.get()["message"].wv
+    assert len(wv.vocab) == 100
+    assert set(logs["message"]) <= set(wv.vocab)
+    assert sorted(wv.vocab[word].index for word in wv.vocab) == list(range(100))
+    for word in set(known) & set(wv.vocab):
+        np.testing.assert_array_equal(wv[word], known[word])